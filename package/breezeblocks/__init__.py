@@ -3,5 +3,6 @@ from .database import Database
 from .sql import Table
 from .query_builder import QueryBuilder
 from .dml_builders import InsertBuilder, UpdateBuilder, DeleteBuilder
+from .dml_builders import UpsertBuilder, BulkUpdateBuilder
 
 __version__ = "0.3.2"
@@ -0,0 +1,195 @@
+"""Runs many statements together in a single transaction.
+
+Executing a statement without a connection takes one from the pool, commits,
+and puts it back. A :class:`StatementBatch` instead queues statements and runs
+them all on one connection with one commit, which saves a checkout, commit
+and rollback for every statement after the first.
+"""
+from collections.abc import Mapping
+
+from .sql.dml import Update, Delete
+
+# DBAPI modules that can run several statements, with parameters,
+# in a single call to `cursor.execute`.
+_MULTI_STATEMENT_MODULES = ("psycopg2",)
+
+class StatementBatch(object):
+    """Queues statements to run in order in one transaction.
+    
+    This is normally used as a context manager. The queued statements are
+    run when the block exits without an exception, and dropped otherwise.
+    
+    Where the DBAPI module allows it, consecutive updates, deletes and raw
+    SQL statements are joined and sent to the database in a single call.
+    """
+    
+    def __init__(self, db):
+        """
+        :param db: The database to run the statements against.
+        """
+        self._db = db
+        self._items = []
+    
+    def add(self, statement, *args, **kwargs):
+        """Queues a built statement, such as an `Insert`, `Update` or `Delete`.
+        
+        :param statement: The statement to queue.
+        :param args: Arguments for the statement's `execute` method,
+          such as the rows for an insert.
+        :param kwargs: Keyword arguments for the statement's `execute` method.
+        
+        :return: `self` for method chaining.
+        """
+        self._items.append((statement, args, kwargs))
+        return self
+    
+    def add_sql(self, sql, params=None):
+        """Queues a raw SQL statement.
+        
+        :param sql: The SQL statement, using the DBAPI module's paramstyle.
+        :param params: Optional parameters to pass along with the statement.
+        
+        :return: `self` for method chaining.
+        """
+        self._items.append((_RawStatement(sql, params), (), {}))
+        return self
+    
+    def execute(self, conn=None):
+        """Runs all queued statements in order and empties the queue.
+        
+        :param conn: Optional connection to run the statements on.
+          If this isn't provided, a connection is taken from the pool and
+          committed once, after all of the statements have run. It is
+          rolled back instead if any of them fails.
+        """
+        items = self._items
+        self._items = []
+        
+        manage_conn = conn is None
+        if manage_conn:
+            conn = self._db._connect_for_write()
+        
+        try:
+            self._execute_items(items, conn)
+            if manage_conn:
+                conn.commit()
+        except Exception:
+            if manage_conn:
+                _rollback_quietly(conn)
+            raise
+        finally:
+            if manage_conn:
+                conn.close()
+    
+    def _execute_items(self, items, conn):
+        merge = self._db._dbapi.__name__ in _MULTI_STATEMENT_MODULES
+        group = []
+        for statement, args, kwargs in items:
+            sql_params = _get_sql_params(statement, args, kwargs) if merge else None
+            
+            if sql_params is not None and _can_join(group, sql_params):
+                group.append(sql_params)
+                continue
+            
+            _execute_group(group, conn)
+            if sql_params is not None:
+                group = [sql_params]
+            else:
+                group = []
+                statement.execute(*args, conn=conn, **kwargs)
+        _execute_group(group, conn)
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.execute()
+        else:
+            self._items = []
+
+class _RawStatement(object):
+    """A SQL string and its parameters, executable like a built statement."""
+    
+    def __init__(self, sql, params=None):
+        self._sql = sql
+        self._params = params
+    
+    def execute(self, conn=None):
+        cur = conn.cursor()
+        if self._params is None:
+            cur.execute(self._sql)
+        else:
+            cur.execute(self._sql, self._params)
+        row_count = cur.rowcount
+        cur.close()
+        return row_count
+
+def _get_sql_params(statement, args, kwargs):
+    """Gets the SQL and parameters of a statement that can be joined.
+    
+    :return: A tuple of the SQL and parameters, or None if the statement
+      must be executed on its own.
+    """
+    if len(args) > 0 or len(kwargs) > 0:
+        return None
+    
+    if isinstance(statement, _RawStatement):
+        params = statement._params if statement._params is not None else []
+        return (statement._sql, params)
+    elif isinstance(statement, (Update, Delete)) and len(statement._returning) < 1:
+        return (statement._statement, statement._params.get_dbapi_params())
+    else:
+        return None
+
+def _can_join(group, sql_params):
+    """Checks whether a statement's parameters can join those of a group.
+    
+    Sequences of parameters are joined end to end and mappings are merged,
+    so a group must not mix the two or reuse a parameter name. Statements
+    without parameters only join groups without parameters, since their SQL
+    is not escaped for the paramstyle, as with a `%` in a LIKE pattern.
+    """
+    params = sql_params[1]
+    for _, other in group:
+        if (len(params) < 1) != (len(other) < 1):
+            return False
+        elif len(params) < 1:
+            continue
+        elif isinstance(params, Mapping) != isinstance(other, Mapping):
+            return False
+        elif isinstance(params, Mapping) and any(key in other for key in params):
+            return False
+    return True
+
+def _execute_group(group, conn):
+    """Executes a group of joined statements with one call."""
+    if len(group) < 1:
+        return
+    
+    sql = ";\n".join(sql for sql, _ in group)
+    if any(isinstance(p, Mapping) for _, p in group):
+        params = {}
+        for _, statement_params in group:
+            params.update(statement_params)
+    else:
+        params = []
+        for _, statement_params in group:
+            params.extend(statement_params)
+    
+    cur = conn.cursor()
+    if len(params) > 0:
+        cur.execute(sql, params)
+    else:
+        cur.execute(sql)
+    cur.close()
+
+def _rollback_quietly(conn):
+    """Rolls back a connection without hiding the error that caused it."""
+    try:
+        conn.rollback()
+    except Exception:
+        pass
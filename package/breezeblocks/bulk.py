@@ -0,0 +1,137 @@
+"""Driver-specific ways of sending many rows to the database at once.
+
+Every DBAPI module supports `cursor.executemany`, but several offer faster
+paths for bulk loading. A :class:`BulkLoader` sends chunks of rows for an
+:class:`.Insert` using one of these paths. Each :class:`.Database` picks a
+loader based on its DBAPI module, and a different one can be provided
+when the database is created.
+"""
+import importlib
+from io import StringIO
+
+from .exceptions import InsertError
+from .sql.param_store import get_param_store
+
+class BulkLoader(object):
+    """Sends chunks of rows for inserts to the database.
+    
+    Subclasses must implement `insert_chunk`.
+    """
+    
+    def get_chunk_size(self, insert, chunk_size):
+        """Adjusts the number of rows the insert should send per chunk.
+        
+        :param insert: The insert that rows are being loaded for.
+        :param chunk_size: The chunk size requested by the user.
+        :return: The chunk size to use.
+        """
+        return chunk_size
+    
+    def insert_chunk(self, insert, chunk, cur):
+        """Inserts a list of rows.
+        
+        :param insert: The insert that rows are being loaded for.
+        :param chunk: A list of rows to insert.
+        :param cur: The cursor to insert the rows with.
+        """
+        raise NotImplementedError()
+
+class ExecuteManyLoader(BulkLoader):
+    """Inserts rows with a single-row statement and `cursor.executemany`.
+    
+    This works with any DBAPI module.
+    """
+    
+    def insert_chunk(self, insert, chunk, cur):
+        insert._insert_chunk(chunk, cur)
+
+class MultiRowLoader(BulkLoader):
+    """Inserts rows with `INSERT ... VALUES (...), (...), ...` statements."""
+    
+    def get_chunk_size(self, insert, chunk_size):
+        batch_size = insert._get_multirow_batch_size()
+        # Keep chunks to whole batches so that only the very last
+        # statement can be a partial one.
+        return max(batch_size, chunk_size - chunk_size % batch_size)
+    
+    def insert_chunk(self, insert, chunk, cur):
+        insert._insert_multirow_chunk(chunk, cur)
+
+class PyodbcLoader(ExecuteManyLoader):
+    """Uses pyodbc's `fast_executemany` to send parameters in bulk."""
+    
+    def insert_chunk(self, insert, chunk, cur):
+        cur.fast_executemany = True
+        super().insert_chunk(insert, chunk, cur)
+
+class Psycopg2Loader(BulkLoader):
+    """Inserts rows with `psycopg2.extras.execute_values`.
+    
+    The rows in each chunk are sent in a single multi-row statement,
+    without the parameter limit that applies to other multi-row inserts.
+    Upserts with bound parameters in their conflict clause cannot be sent
+    this way and use regular multi-row inserts instead.
+    """
+    
+    def __init__(self, dbapi_module):
+        """
+        :param dbapi_module: The psycopg2 module.
+        """
+        self._extras = importlib.import_module(dbapi_module.__name__ + ".extras")
+    
+    def insert_chunk(self, insert, chunk, cur):
+        if len(insert._get_suffix_params()) > 0:
+            insert._insert_multirow_chunk(chunk, cur)
+            return
+        
+        params = get_param_store(insert._db._dbapi.paramstyle)
+        statement = insert._statement_base + " VALUES %s" + \
+            insert._get_statement_suffix(params)
+        self._extras.execute_values(cur, statement, chunk, page_size=len(chunk))
+
+class Psycopg2CopyLoader(BulkLoader):
+    """Inserts rows with `COPY ... FROM STDIN` through psycopg2.
+    
+    This is the fastest way to load rows into Postgres, but is not chosen
+    by default because values are sent as CSV text and must be in a format
+    Postgres can parse for the type of each column.
+    """
+    
+    def insert_chunk(self, insert, chunk, cur):
+        if insert._get_statement_suffix(get_param_store(insert._db._dbapi.paramstyle)):
+            raise InsertError("COPY cannot be used for upserts.")
+        
+        buffer = StringIO()
+        for row in chunk:
+            buffer.write(",".join(_get_csv_field(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+        
+        cur.copy_expert(
+            "COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, NULL '')".format(
+                insert._table.name, ",".join(insert._columns)),
+            buffer)
+
+def _get_csv_field(value):
+    """Formats a value as a field for `COPY ... (FORMAT csv, NULL '')`.
+    
+    NULLs are written as empty, unquoted fields. Every other value is quoted,
+    so that empty strings are kept apart from NULLs.
+    """
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+def get_bulk_loader(dbapi_module):
+    """Picks the fastest generally-usable bulk loader for a DBAPI module.
+    
+    :param dbapi_module: The DBAPI module to find a loader for.
+    :return: A :class:`BulkLoader` for the module.
+    """
+    module_name = dbapi_module.__name__
+    if module_name == "pyodbc":
+        return PyodbcLoader()
+    elif module_name == "psycopg2":
+        return Psycopg2Loader(dbapi_module)
+    else:
+        return ExecuteManyLoader()
@@ -1,14 +1,25 @@
+import threading
+
+from .batch import StatementBatch
+from .bulk import get_bulk_loader
 from .exceptions import MissingModuleError, UnsupportedModuleError
 from .pool import ConnectionPool as Pool
 from .query_builder import QueryBuilder
 from .dml_builders import InsertBuilder, UpdateBuilder, DeleteBuilder
+from .dml_builders import UpsertBuilder, BulkUpdateBuilder
+from .reflection import ReflectedSchema
+from .write_buffer import WriteBuffer
 
 class Database(object):
     """Proxies the database at the URI provided."""
     
     def __init__(self, dbapi_module=None, dsn=None, *,
-            connect_args=None, connect_kwargs=None, on_connect=None,
-            minconn=10, maxconn=20):
+            connect_args=None, connect_kwargs=None,
+            on_connect=None, on_checkout=None,
+            minconn=10, maxconn=20, prewarm=False, autocommit_reads=False,
+            max_idle=None, max_lifetime=None, ping_after=None,
+            leak_threshold=None, leak_action="warn", checkout_order="fifo",
+            param_limit=None, bulk_loader=None, dialect=None):
         """Refer to your DBAPI module documentation for what the content
         of `connect_args` and `connect_kwargs` should be.
         
@@ -18,10 +29,47 @@ class Database(object):
         :param connect_args: `*args` for calls to `dbapi.connect`.
         :param connect_kwargs: `**kwargs` for calls to `dbapi.connect`.
         :param on_connect: A SQL script to be executed per-connection.
-            If provided, it is executed each time a connection is taken
-            out of the connection pool.
+            If provided, it is executed and committed once for each
+            connection, right after the connection is opened.
+        :param on_checkout: A SQL script to be executed each time a
+            connection is taken out of the connection pool, such as to
+            reset session state.
         :param minconn: Number of standby connections for this database.
         :param maxconn: Limit on open connections to this database.
+        :param prewarm: Whether to open `minconn` connections right away,
+            and keep at least that many open from then on.
+        :param autocommit_reads: Whether queries that take their own
+            connection run it in the driver's autocommit mode, so that
+            reads never open a transaction that has to be rolled back.
+            Each statement then sees the latest committed data.
+        :param max_idle: Seconds a connection may sit idle in the pool
+            before it is closed. `minconn` idle connections are always
+            kept. Optional.
+        :param max_lifetime: Seconds after which a connection is retired,
+            shortened by a small random amount per connection. Optional.
+        :param ping_after: Seconds a connection may sit idle before it is
+            checked with a cheap query as it is taken out of the pool.
+            Optional.
+        :param leak_threshold: Seconds a connection may be held before it
+            is reported as leaked, along with where it was taken from.
+            Leak detection is off if this is not provided.
+        :param leak_action: "warn" to only warn about connections held
+            past `leak_threshold`, or "reclaim" to also close them.
+        :param checkout_order: "fifo" to hand out the connection that has
+            been idle longest, or "lifo" to hand out the one used last.
+            With "lifo", connections not needed under normal load stay idle
+            and can be closed by `max_idle`.
+        :param param_limit: Most bound parameters allowed in one statement.
+            A conservative limit is chosen based on the DBAPI module
+            if this is not provided.
+        :param bulk_loader: The :class:`.BulkLoader` that inserts send rows
+            through. One is chosen based on the DBAPI module if this is
+            not provided.
+        :param dialect: The SQL dialect of the database, one of "sqlite",
+            "postgres" or "mysql". This is only needed by statements whose
+            syntax differs between databases, such as upserts. It is
+            detected from the DBAPI module if not provided, which is not
+            possible for generic modules like pyodbc.
         """
         self._dsn = dsn
         self._dbapi = dbapi_module
@@ -29,14 +77,40 @@ class Database(object):
         if self._dbapi is None:
             raise MissingModuleError()
         
-        connect_args = list(connect_args) if connect_args is not None else []
-        connect_kwargs = dict(connect_kwargs) if connect_kwargs is not None else {}
+        if param_limit is None:
+            param_limit = _get_default_param_limit(self._dbapi)
+        self._param_limit = param_limit
         
-        if dsn is not None:
-            connect_args.insert(0, dsn)
+        if bulk_loader is None:
+            bulk_loader = get_bulk_loader(self._dbapi)
+        self._bulk_loader = bulk_loader
+        
+        if dialect is None:
+            dialect = _get_default_dialect(self._dbapi)
+        self._dialect = dialect
+        # Read from the server the first time it is needed.
+        self._server_version = None
         
-        self.pool = Pool(self._dbapi, minconn, maxconn,
-            on_connect, *connect_args, **connect_kwargs)
+        self._autocommit_reads = autocommit_reads
+        
+        self._connect_args = list(connect_args) if connect_args is not None else []
+        self._connect_kwargs = dict(connect_kwargs) if connect_kwargs is not None else {}
+        self._pool_args = (minconn, maxconn, on_connect)
+        self._pool_kwargs = {
+            "on_checkout": on_checkout,
+            "max_idle": max_idle,
+            "max_lifetime": max_lifetime,
+            "ping_after": ping_after,
+            "leak_threshold": leak_threshold,
+            "leak_action": leak_action,
+            "checkout_order": checkout_order
+        }
+        self._prewarm = prewarm
+        
+        self.pool = self._create_pool(dsn)
+    
+        # Holds the connection pinned by each thread, if any.
+        self._local = threading.local()
     
     def query(self, *queryables):
         """Starts building a query in this database.
@@ -55,6 +129,15 @@ class Database(object):
         """
         return InsertBuilder(table, columns, db=self)
     
+    def upsert(self, table, columns=[]):
+        """Starts building an upsert in this database.
+        
+        :param table: The table to insert into or update.
+        :param columns: A list of the columns to set values of.
+        :return: An Upsert builder for the table and columns provided.
+        """
+        return UpsertBuilder(table, columns, db=self)
+    
     def update(self, table):
         """Starts building an update in this database.
         
@@ -63,6 +146,16 @@ class Database(object):
         """
         return UpdateBuilder(table, db=self)
     
+    def bulk_update(self, table, keys=[], columns=[]):
+        """Starts building an update of many rows in this database.
+        
+        :param table: The table to update rows of.
+        :param keys: A list of the columns identifying rows to update.
+        :param columns: A list of the columns to set values of.
+        :return: A bulk update builder for the table and columns provided.
+        """
+        return BulkUpdateBuilder(table, keys, columns, db=self)
+    
     def delete(self, table):
         """Starts building a delete in this database.
         
@@ -71,6 +164,221 @@ class Database(object):
         """
         return DeleteBuilder(table, db=self)
     
+    def reflect(self, schema=None, cache_path=None, max_age=None):
+        """Builds tables from the catalog of this database.
+        
+        When `cache_path` names an existing, compatible cache file the
+        tables are loaded from it without querying the database. The cache
+        is refreshed from the database the first time a table that it does
+        not contain is looked up, or when it is older than `max_age`.
+        
+        :param schema: The schema to read tables from. Defaults to the
+          database's current schema.
+        :param cache_path: Path of a file to cache reflected tables in.
+        :param max_age: Most seconds a cache file is used for. Optional.
+        :return: A :class:`.ReflectedSchema` mapping table names to tables.
+        """
+        return ReflectedSchema(self, schema, cache_path, max_age).load()
+    
+    def batch(self):
+        """Starts a batch of statements to run in one transaction.
+        
+        Statements added to the batch are run in order on a single
+        connection and committed together when the batch is executed,
+        or when a `with` block using the batch exits.
+        
+        :return: An empty :class:`.StatementBatch` for this database.
+        """
+        return StatementBatch(self)
+    
+    def write_buffer(self, table, columns, *,
+            flush_rows=1000, flush_interval=1.0, key=None,
+            max_depth=None, on_full="block"):
+        """Starts a buffer that writes rows to a table in the background.
+        
+        :param table: The table to write rows into.
+        :param columns: A list of the columns rows hold values for.
+        :param flush_rows: The number of buffered rows that triggers a write.
+        :param flush_interval: Most seconds that rows wait to be written.
+        :param key: Optional columns identifying rows. Only the latest row for
+          each key is kept, and rows are written as an upsert.
+        :param max_depth: Most rows that may wait to be written. Optional.
+        :param on_full: Whether rows added to a full buffer "block" until
+          there is room, or "raise" an :class:`.InsertError`.
+        :return: A running :class:`.WriteBuffer`. Close it when done.
+        """
+        return WriteBuffer(self, table, columns, flush_rows=flush_rows,
+            flush_interval=flush_interval, key=key,
+            max_depth=max_depth, on_full=on_full)
+    
+    def pinned(self):
+        """Keeps one connection checked out for a unit of work in this thread.
+        
+        Statements that would take a connection from the pool use the
+        pinned connection instead, as long as they run in the same thread
+        and inside a `with` block using the returned object. The connection
+        goes back to the pool once, when the outermost such block exits.
+        Statements still commit their own changes.
+        
+        :return: The pinned connection, for use as a context manager.
+        """
+        pinned = getattr(self._local, "pinned", None)
+        if pinned is None:
+            pinned = _PinnedConnection(self)
+        return pinned
+    
     def connect(self):
         """Returns a new connection to the database."""
-        return self.pool.get()
+        return self._checkout_for_write()
+    
+    def close(self):
+        """Closes the connection pool of this database.
+        
+        Idle connections are closed right away, and connections in use are
+        closed when they are given back. Statements that need a connection
+        raise a :class:`.PoolClosedError` afterwards. Using the database as
+        a context manager closes it when the `with` block exits.
+        """
+        self.pool.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+    
+    def _create_pool(self, dsn):
+        """Creates a connection pool with this database's settings.
+        
+        :param dsn: The DSN to connect to, pre-pended to `connect_args`.
+        """
+        connect_args = list(self._connect_args)
+        if dsn is not None:
+            connect_args.insert(0, dsn)
+        
+        pool = Pool(self._dbapi, *self._pool_args, *connect_args,
+            **self._pool_kwargs, **self._connect_kwargs)
+        if self._prewarm:
+            pool.warm()
+        return pool
+    
+    def _connect_for_read(self):
+        """Gets a connection for statements that only read data."""
+        pinned = getattr(self._local, "pinned", None)
+        if pinned is not None:
+            return pinned
+        return self._checkout_for_read()
+    
+    def _connect_for_write(self, track_leaks=True):
+        """Gets a connection for statements that may change data."""
+        pinned = getattr(self._local, "pinned", None)
+        if pinned is not None:
+            return pinned
+        return self._checkout_for_write(track_leaks)
+    
+    def _checkout_for_read(self, track_leaks=True):
+        """Takes a connection for reading from the pool."""
+        return self.pool.get(autocommit=self._autocommit_reads,
+            track_leaks=track_leaks)
+    
+    def _checkout_for_write(self, track_leaks=True, block=True, timeout=None):
+        """Takes a connection for writing from the pool.
+        
+        :param track_leaks: Whether the pool's leak detection applies to the
+          connection. Connections held on purpose for a long time, such as
+          pinned ones, are taken without it.
+        :param block: Whether to wait for a connection to become free.
+        :param timeout: Most seconds to wait, as for `Pool.get`.
+        """
+        return self.pool.get(block, timeout, track_leaks=track_leaks)
+
+    def _get_server_version(self):
+        """Gets the version string reported by the database server.
+        
+        The version is queried once, with `SELECT VERSION()`, and kept.
+        """
+        if self._server_version is None:
+            conn = self._connect_for_read()
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT VERSION()")
+                self._server_version = cur.fetchone()[0]
+                cur.close()
+            finally:
+                conn.close()
+        return self._server_version
+
+class _PinnedConnection(object):
+    """A connection kept checked out by one thread for a unit of work.
+    
+    Closing it does nothing, so that statements using it leave it checked
+    out. It is put back in the pool when the outermost block exits.
+    """
+    
+    def __init__(self, db):
+        self._db = db
+        self._conn = None
+        self._depth = 0
+    
+    def commit(self):
+        self._conn.commit()
+    
+    def rollback(self):
+        self._conn.rollback()
+    
+    def cursor(self):
+        return self._conn.cursor()
+    
+    def close(self):
+        pass
+    
+    def __enter__(self):
+        if self._depth < 1:
+            self._conn = self._db._checkout_for_write(track_leaks=False)
+            self._db._local.pinned = self
+        self._depth += 1
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self._depth -= 1
+        if self._depth < 1:
+            self._db._local.pinned = None
+            conn = self._conn
+            self._conn = None
+            conn.__exit__(exc_type, exc_value, exc_tb)
+
+def _get_default_param_limit(dbapi_module):
+    """Looks up how many bound parameters a DBAPI module allows per statement.
+    
+    :param dbapi_module: The DBAPI module to find a limit for.
+    :return: The parameter limit, or a conservative default if unknown.
+    """
+    module_name = dbapi_module.__name__
+    if module_name == "sqlite3":
+        # SQLITE_MAX_VARIABLE_NUMBER was raised in SQLite 3.32.0
+        if dbapi_module.sqlite_version_info >= (3, 32, 0):
+            return 32766
+        else:
+            return 999
+    elif module_name in ("psycopg2", "psycopg"):
+        return 65535
+    elif module_name == "pyodbc":
+        return 2100
+    else:
+        return 999
+
+def _get_default_dialect(dbapi_module):
+    """Looks up the SQL dialect spoken through a DBAPI module.
+    
+    :param dbapi_module: The DBAPI module to find a dialect for.
+    :return: The name of the dialect, or None if it cannot be known.
+    """
+    module_name = dbapi_module.__name__
+    if module_name == "sqlite3":
+        return "sqlite"
+    elif module_name in ("psycopg2", "psycopg"):
+        return "postgres"
+    elif module_name in ("pymysql", "MySQLdb", "mysql.connector", "mariadb"):
+        return "mysql"
+    else:
+        return None
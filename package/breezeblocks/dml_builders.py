@@ -1,8 +1,10 @@
 from io import StringIO
 
-from .exceptions import InsertError, UpdateError, DeleteError
+from .exceptions import BuilderError, InsertError, UpdateError, DeleteError
 from .sql import Value
-from .sql.dml import Insert, Update, Delete
+from .sql.dml import Insert, Upsert, Update, BulkUpdate, Delete
+from .sql.dml import ConflictClause, Excluded, KeyedBatch
+from .sql.dml import supports_returning, _get_returning_sql
 from .sql.expressions import _fix_expression
 from .sql.param_store import get_param_store
 
@@ -14,6 +16,7 @@ class InsertBuilder(object):
         self._db = db
         self._table = table
         self._column_names = []
+        self._returning = []
         self.add_columns(*columns)
     
     def add_columns(self, *columns):
@@ -24,15 +27,21 @@ class InsertBuilder(object):
         
         :return: `self` for method chaining.
         """
-        for column in columns:
-            if isinstance(column, str):
-                column_name = column
-            else:
-                column_name = column.name
-            
-            self._table.columns[column_name] # Should raise exception if no column with name exists in table
-            self._column_names.append(column_name)
+        self._column_names.extend(_get_column_names(self._table, columns))
+        return self
+    
+    def returning(self, *columns):
+        """Adds columns to return from the inserted rows.
+        
+        :param columns: All arguments provided to the method.
+          Column names as strings and `Column` objects are accepted.
+        
+        :return: `self` for method chaining.
+        """
+        if not supports_returning(self._db, "INSERT"):
+            raise InsertError("This database does not support RETURNING for inserts.")
         
+        self._returning.extend(_get_column_names(self._table, columns))
         return self
     
     def get(self):
@@ -40,7 +49,8 @@ class InsertBuilder(object):
         
         :return: A finished, executable `Insert`.
         """
-        return Insert(self._construct_sql(), self._table, self._column_names, db=self._db)
+        return Insert(self._construct_sql(), self._table, self._column_names,
+            db=self._db, returning=list(self._returning))
     
     def _construct_sql(self):
         return "INSERT INTO {0} ({1})".format(
@@ -48,6 +58,103 @@ class InsertBuilder(object):
             ",".join(self._column_names)
         )
 
+class UpsertBuilder(InsertBuilder):
+    """Builds an insert that updates existing rows on conflicts.
+    
+    Rows that would violate the unique index on the conflict columns are
+    updated instead of inserted. The SQL used depends on the database's
+    dialect: `ON CONFLICT ... DO UPDATE` for SQLite and Postgres, and
+    `ON DUPLICATE KEY UPDATE` for MySQL and MariaDB.
+    """
+    
+    def __init__(self, table, columns=[], db=None):
+        super().__init__(table, columns, db)
+        
+        self._conflict_columns = []
+        self._updates = []
+        self._do_nothing = False
+    
+    def on_conflict(self, *columns):
+        """Sets the columns whose unique index rows can conflict on.
+        
+        :param columns: All arguments provided to the method.
+          Column names as strings and `Column` objects are accepted.
+        
+        :return: `self` for method chaining.
+        """
+        self._conflict_columns.extend(_get_column_names(self._table, columns))
+        return self
+    
+    def set_(self, column, expr):
+        """Adds a column-value pair to set on conflicting rows.
+        
+        If this is never called, every inserted column that is not a conflict
+        column is set to the value that would have been inserted.
+        
+        :param column: A column in the table to set to a value.
+            Column names as strings and `Column` objects are accepted.
+        :param expr: An expression to set the column value to.
+            Use :meth:`excluded` to refer to the values being inserted.
+        
+        :return: `self` for method chaining.
+        """
+        if isinstance(column, str):
+            column = self._table.columns[column]
+        
+        self._updates.append((column.name, _fix_expression(expr)))
+        
+        return self
+    
+    def do_nothing(self):
+        """Leaves conflicting rows unchanged instead of updating them.
+        
+        :return: `self` for method chaining.
+        """
+        self._do_nothing = True
+        return self
+    
+    def excluded(self, column):
+        """Gets an expression for the value that would have been inserted.
+        
+        :param column: The inserted column to refer to.
+            Column names as strings and `Column` objects are accepted.
+        
+        :return: An expression usable in :meth:`set_`.
+        """
+        if isinstance(column, str):
+            column = self._table.columns[column]
+        
+        return Excluded(column.name, self._db._dialect)
+    
+    def get(self):
+        """Get an upsert object for the current state of the builder.
+        
+        :return: A finished, executable `Upsert`.
+        """
+        return Upsert(self._construct_sql(), self._table, self._column_names,
+            self._construct_conflict_clause(), db=self._db,
+            returning=list(self._returning))
+    
+    def _construct_conflict_clause(self):
+        if self._db._dialect not in ("sqlite", "postgres", "mysql"):
+            raise InsertError(
+                "Upserts need a known SQL dialect. "
+                "Provide one when creating the database.")
+        
+        if len(self._conflict_columns) < 1:
+            raise InsertError("Upserts must have at least one conflict column.")
+        
+        if self._do_nothing:
+            updates = []
+        elif len(self._updates) > 0:
+            updates = self._updates
+        else:
+            updates = [(name, Excluded(name, self._db._dialect))
+                for name in self._column_names
+                if name not in self._conflict_columns]
+        
+        return ConflictClause(self._db._dialect, self._conflict_columns, updates)
+
 class UpdateBuilder(object):
     def __init__(self, table, db=None):
         if db is None:
@@ -57,14 +164,28 @@ class UpdateBuilder(object):
         self._table = table
         self._updates = []
         self._conditions = []
+        self._returning = []
     
     def get(self):
         """Get an update object for the current state of the builder.
         
         :return: A finished, executable `Update`.
         """
-        statement, params = self._construct_sql()
-        return Update(statement, params, self._db)
+        return self._get_with_conditions([])
+    
+    def get_batched(self, key_column, chunk_size=1000, pause=0, start_after=None):
+        """Get a runner that performs this update in chunks of rows.
+        
+        :param key_column: A column of the table with unique, ordered values
+          to split rows by. Column names as strings and `Column` objects
+          are accepted.
+        :param chunk_size: The number of rows to update in each chunk.
+        :param pause: Seconds to sleep between chunks.
+        :param start_after: Optional key to resume an earlier run after.
+        
+        :return: An executable `KeyedBatch`.
+        """
+        return _get_keyed_batch(self, key_column, chunk_size, pause, start_after)
     
     def set_(self, column, expr):
         """Adds a column-value pair to the update statement.
@@ -93,9 +214,28 @@ class UpdateBuilder(object):
         
         return self
     
-    def _construct_sql(self):
+    def returning(self, *columns):
+        """Adds columns to return from the updated rows.
+        
+        :param columns: All arguments provided to the method.
+          Column names as strings and `Column` objects are accepted.
+        
+        :return: `self` for method chaining.
+        """
+        if not supports_returning(self._db, "UPDATE"):
+            raise UpdateError("This database does not support RETURNING for updates.")
+        
+        self._returning.extend(_get_column_names(self._table, columns))
+        return self
+    
+    def _get_with_conditions(self, extra_conditions):
+        statement, params = self._construct_sql(extra_conditions)
+        return Update(statement, params, self._db, returning=list(self._returning))
+    
+    def _construct_sql(self, extra_conditions=[]):
         statement_buffer = StringIO()
         params = get_param_store(self._db._dbapi.paramstyle)
+        conditions = self._conditions + list(extra_conditions)
         
         statement_buffer.write("UPDATE {} SET\n\t".format(self._table.name))
         
@@ -107,16 +247,68 @@ class UpdateBuilder(object):
             for u in self._updates
         ))
         
-        if len(self._conditions) > 0:
+        if len(conditions) > 0:
             statement_buffer.write("\nWHERE ")
             
-            for cond in self._conditions:
+            for cond in conditions:
                 params.add_params(cond._get_params())
             statement_buffer.write("\n  AND ".join(
-                cond._get_ref_field(params) for cond in self._conditions))
+                cond._get_ref_field(params) for cond in conditions))
+        
+        statement_buffer.write(_get_returning_sql(self._returning))
         
         return (statement_buffer.getvalue(), params)
 
+class BulkUpdateBuilder(object):
+    """Builds an update of many rows from in-memory data.
+    
+    Rows are matched on the key columns and have the value columns set.
+    """
+    
+    def __init__(self, table, keys=[], columns=[], db=None):
+        if db is None:
+            raise UpdateError("Attempting to build an update statement without a database.")
+        
+        self._db = db
+        self._table = table
+        self._key_names = []
+        self._column_names = []
+        self.add_keys(*keys)
+        self.add_columns(*columns)
+    
+    def add_keys(self, *columns):
+        """Adds columns that identify the rows to update.
+        
+        :param columns: All arguments provided to the method.
+          Column names as strings and `Column` objects are accepted.
+        
+        :return: `self` for method chaining.
+        """
+        self._key_names.extend(_get_column_names(self._table, columns))
+        return self
+    
+    def add_columns(self, *columns):
+        """Adds columns to set the values of.
+        
+        :param columns: All arguments provided to the method.
+          Column names as strings and `Column` objects are accepted.
+        
+        :return: `self` for method chaining.
+        """
+        self._column_names.extend(_get_column_names(self._table, columns))
+        return self
+    
+    def get(self):
+        """Get a bulk update object for the current state of the builder.
+        
+        :return: A finished, executable `BulkUpdate`.
+        """
+        if len(self._key_names) < 1 or len(self._column_names) < 1:
+            raise UpdateError("Bulk updates need at least one key and one value column.")
+        
+        return BulkUpdate(self._table, list(self._key_names),
+            list(self._column_names), db=self._db)
+
 class DeleteBuilder(object):
     def __init__(self, table, db=None):
         if db is None:
@@ -125,14 +317,28 @@ class DeleteBuilder(object):
         self._db = db
         self._table = table
         self._conditions = []
+        self._returning = []
     
     def get(self):
         """Get a delete object for the current state of the builder.
         
         :return: A finished, executable `Delete`.
         """
-        statement, params = self._construct_sql()
-        return Delete(statement, params, self._db)
+        return self._get_with_conditions([])
+    
+    def get_batched(self, key_column, chunk_size=1000, pause=0, start_after=None):
+        """Get a runner that performs this delete in chunks of rows.
+        
+        :param key_column: A column of the table with unique, ordered values
+          to split rows by. Column names as strings and `Column` objects
+          are accepted.
+        :param chunk_size: The number of rows to delete in each chunk.
+        :param pause: Seconds to sleep between chunks.
+        :param start_after: Optional key to resume an earlier run after.
+        
+        :return: An executable `KeyedBatch`.
+        """
+        return _get_keyed_batch(self, key_column, chunk_size, pause, start_after)
     
     def where(self, *conditions):
         """Adds filtering conditions to the rows to delete.
@@ -145,18 +351,68 @@ class DeleteBuilder(object):
         
         return self
     
-    def _construct_sql(self):
+    def returning(self, *columns):
+        """Adds columns to return from the deleted rows.
+        
+        :param columns: All arguments provided to the method.
+          Column names as strings and `Column` objects are accepted.
+        
+        :return: `self` for method chaining.
+        """
+        if not supports_returning(self._db, "DELETE"):
+            raise DeleteError("This database does not support RETURNING for deletes.")
+        
+        self._returning.extend(_get_column_names(self._table, columns))
+        return self
+    
+    def _get_with_conditions(self, extra_conditions):
+        statement, params = self._construct_sql(extra_conditions)
+        return Delete(statement, params, self._db, returning=list(self._returning))
+    
+    def _construct_sql(self, extra_conditions=[]):
         statement_buffer = StringIO()
         params = get_param_store(self._db._dbapi.paramstyle)
+        conditions = self._conditions + list(extra_conditions)
         
         statement_buffer.write("DELETE FROM {}".format(self._table.name))
         
-        if len(self._conditions) > 0:
+        if len(conditions) > 0:
             statement_buffer.write("\nWHERE ")
             
-            for cond in self._conditions:
+            for cond in conditions:
                 params.add_params(cond._get_params())
             statement_buffer.write("\n  AND ".join(
-                cond._get_ref_field(params) for cond in self._conditions))
+                cond._get_ref_field(params) for cond in conditions))
+        
+        statement_buffer.write(_get_returning_sql(self._returning))
         
         return (statement_buffer.getvalue(), params)
+
+def _get_column_names(table, columns):
+    """Gets the names of columns given as strings or `Column` objects."""
+    column_names = []
+    for column in columns:
+        if isinstance(column, str):
+            column_name = column
+        else:
+            column_name = column.name
+        
+        table.columns[column_name] # Should raise exception if no column with name exists in table
+        column_names.append(column_name)
+    return column_names
+
+def _get_keyed_batch(builder, key_column, chunk_size, pause, start_after):
+    """Creates a `KeyedBatch` for an update or delete builder."""
+    if len(builder._returning) > 0:
+        raise BuilderError("Batched statements cannot return rows.")
+    
+    if isinstance(key_column, str):
+        key_column = builder._table.columns[key_column]
+    
+    def get_key_query(conditions):
+        return builder._db.query(key_column)\
+            .where(*(builder._conditions + conditions))\
+            .order_by(key_column).get()
+    
+    return KeyedBatch(key_column, builder._get_with_conditions, get_key_query, builder._db,
+        chunk_size=chunk_size, pause=pause, start_after=start_after)
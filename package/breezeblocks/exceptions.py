@@ -64,6 +64,19 @@ class InsertError(BreezeBlocksError):
     def __repr__(self):
         return "BreezeBlocks Insert Error: {}".format(self._message)
 
+class ParallelInsertError(InsertError):
+    """An error raised when chunks of a parallel insert fail.
+    
+    `errors` holds pairs of a chunk number and the exception raised while
+    inserting it. The chunk number is None for errors outside of inserting
+    a chunk, such as when a worker could not get a connection.
+    `row_count` is the number of rows that were committed.
+    """
+    def __init__(self, errors, row_count):
+        super().__init__("{} chunks of a parallel insert failed.".format(len(errors)))
+        self.errors = errors
+        self.row_count = row_count
+
 class UpdateError(BreezeBlocksError):
     """An error occuring during creation of a update statement."""
     def __init__(self, message):
@@ -96,3 +109,16 @@ class MissingColumnError(BreezeBlocksError):
     
     def set_table(table):
         self._table = table
+
+class PoolClosedError(BreezeBlocksError):
+    """An error raised when taking a connection from a closed pool."""
+    
+    def __repr__(self):
+        return "BreezeBlocks Error: The connection pool is closed."
+
+class ConnectionLeakWarning(UserWarning):
+    """A warning that a pooled connection was held too long or never closed.
+    
+    The message includes the stack from where the connection was taken
+    out of the pool.
+    """
@@ -1,58 +1,114 @@
 """Implements a connection pool for use in this package."""
+import bisect
+import collections
 import queue
+import random
+import sys
+import threading
+import time
+import traceback
+import warnings
 import weakref
 
+from .exceptions import ConnectionLeakWarning, PoolClosedError
+
+# Upper bounds, in seconds, of the buckets that checkout wait times
+# and connection hold times are counted in.
+_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float("inf"))
+
+# Most frames of the stack kept from where a connection is checked out.
+_LEAK_STACK_LIMIT = 12
+
+# Cursor methods that send statements, and so may open a transaction.
+_STATEMENT_METHODS = frozenset((
+    "execute", "executemany", "callproc", "copy_expert", "copy_from", "copy_to"))
+
 class PooledConnection(object):
     """Wraps a DBAPI 2.0 connection for use with connection pools.
     
     This class calls DBAPI 2.0 methods on its underlying connection.
     It only guarantees that it can handle the DBAPI-compliant subset
     of any underlying cursor's functionality.
+    
+    The connection keeps track of whether statements may have been sent
+    since the last commit or rollback, so that the pool only rolls back
+    connections that could have a transaction open.
     """
     
-    def __init__(self, pool, conn):
+    def __init__(self, pool, record):
         """Bundles a connection with a specific pool.
         
         :param pool: The source connection pool.
-        :param conn: The underlying connection.
+        :param record: The pool's record of the underlying connection.
         """
         self._pool = pool
-        self._conn = conn
+        self._record = record
+        self._conn = record.conn
         
-        self._cursor_refs = []
+        self._cursors = weakref.WeakSet()
+        self._in_transaction = False
+    
+    @property
+    def autocommit(self):
+        """Whether the underlying connection is in autocommit mode."""
+        return self._record is not None and self._record.autocommit
     
     def close(self):
         """Puts the connection back in the pool."""
         if self._conn is not None:
-            conn = self._conn
+            record = self._record
             self._conn = None
+            self._record = None
+            if not self._pool._untrack(record):
+                # The pool has already reclaimed the connection.
+                return
             
-            for cur_ref in self._cursor_refs:
-                cur = cur_ref()
-                if cur is not None:
-                    try:
-                        cur.close()
-                    except self._pool._dbapi.Error:
-                        pass
+            for cur in list(self._cursors):
+                try:
+                    cur.close()
+                except self._pool._dbapi.Error:
+                    pass
             
-            self._pool._putconn(conn)
+            self._pool._putconn(record, self._in_transaction)
+            self._pool._collect_orphans()
+    
+    def _discard(self):
+        """Closes the underlying connection instead of returning it."""
+        if self._conn is not None:
+            record = self._record
+            self._conn = None
+            self._record = None
+            if not self._pool._untrack(record):
+                return
+            
+            self._pool._note_checkin(record)
+            self._pool._drop(record)
+    
+    def _mark_transaction(self):
+        """Notes that a statement is about to be sent on this connection."""
+        if self._record is not None and not self._record.autocommit:
+            self._in_transaction = True
     
     def commit(self):
         """Commits changes to the underlying connection."""
         self._conn.commit()
+        self._in_transaction = False
     
     def rollback(self):
         """Rolls back the underlying connection."""
         self._conn.rollback()
+        self._in_transaction = False
     
     def cursor(self):
         """Allocates a cursor from the underlying connection.
         
         Also store a weak-reference to this cursor so it can be
-        closed when the connection is "closed".
+        closed when the connection is "closed". References to cursors that
+        are gone are dropped, so a connection held for a long time does
+        not collect them.
         """
-        cursor = CursorProxy(self._conn.cursor())
-        self._cursor_refs.append(weakref.ref(cursor))
+        cursor = CursorProxy(self._conn.cursor(), self)
+        self._cursors.add(cursor)
         return cursor
     
     def __enter__(self):
@@ -64,12 +120,28 @@ class PooledConnection(object):
         if exc_type is None or (not issubclass(exc_type, self._pool._dbapi.Error)):
             self.close()
         else:
-            self._pool._decrement_conn_count()
+            self._discard()
     
     def __del__(self):
-        """Puts the connection back in the pool when this object is deleted."""
-        # Make sure this "closes".
-        self.close()
+        """Puts the connection back in the pool when this object is deleted.
+        
+        Garbage collection can run this on a thread that holds the pool's
+        lock. The connection is then only queued, and the pool puts it back
+        the next time a connection is taken or given back.
+        """
+        if self._conn is None:
+            return
+        
+        pool = self._pool
+        if pool._lock.acquire(blocking=False):
+            # No thread, this one included, is inside the pool's lock.
+            pool._lock.release()
+            pool._report_leak(self._record, "was never closed")
+            self.close()
+        else:
+            pool._orphans.append((self._record, self._in_transaction))
+            self._conn = None
+            self._record = None
         # There is no superclass destructor but it would be called here.
 
 class CursorProxy(object):
@@ -80,15 +152,25 @@ class CursorProxy(object):
     context manager if it could not already.
     """
     
-    def __init__(self, cursor):
+    def __init__(self, cursor, conn=None):
         self._cursor = cursor
+        self._conn = conn
     
     def __getattr__(self, n):
-        return getattr(self._cursor, n)
+        attr = getattr(self._cursor, n)
+        if n not in _STATEMENT_METHODS or self._conn is None:
+            return attr
+        
+        # Marked on each call, since callers may keep the bound method.
+        conn = self._conn
+        def send_statement(*args, **kwargs):
+            conn._mark_transaction()
+            return attr(*args, **kwargs)
+        return send_statement
     
     def __setattr__(self, n, v):
-        if (n == '_cursor'):
-            return object.__setattr__(self, '_cursor', v)
+        if (n in ('_cursor', '_conn')):
+            return object.__setattr__(self, n, v)
         else:
             return setattr(self._cursor, n, v)
     
@@ -98,23 +180,123 @@ class CursorProxy(object):
     def __exit__(self, exc_type, exc_value, exc_tb):
         self._cursor.close()
 
+class _ConnectionRecord(object):
+    """An open connection of the pool and the state kept along with it."""
+    
+    __slots__ = ("conn", "autocommit", "default_mode", "expires", "idle_since",
+        "checkout_time", "checkout_stack")
+    
+    def __init__(self, conn, expires=None):
+        self.conn = conn
+        # When the connection should be retired, if ever, and when it was
+        # last put back, both in `time.monotonic` seconds.
+        self.expires = expires
+        self.idle_since = time.monotonic()
+        self.checkout_time = None
+        # Only kept when leak detection is on.
+        self.checkout_stack = None
+        # Whether the pool has switched the connection to autocommit mode,
+        # and the driver's setting to switch back to when it leaves it.
+        self.autocommit = False
+        self.default_mode = None
+
+class _Histogram(object):
+    """Counts durations in buckets with increasing upper bounds."""
+    
+    def __init__(self, bounds=_TIME_BUCKETS):
+        self._bounds = bounds
+        self._counts = [0] * len(bounds)
+        self._sum = 0.0
+        self._max = 0.0
+    
+    def add(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self._sum += value
+        self._max = max(self._max, value)
+    
+    def snapshot(self):
+        return {
+            "count": sum(self._counts),
+            "sum": self._sum,
+            "max": self._max,
+            "buckets": list(zip(self._bounds, self._counts))
+        }
+
+class _Waiter(object):
+    """A thread waiting in line for a connection from the pool."""
+    
+    __slots__ = ("event", "record", "may_create")
+    
+    def __init__(self):
+        self.event = threading.Event()
+        # Set when a connection is handed over to this waiter, or when
+        # room opens up for this waiter to create one itself.
+        self.record = None
+        self.may_create = False
+
 class ConnectionPool(object):
-    """A pool of DBAPI 2.0 connections."""
+    """A pool of DBAPI 2.0 connections.
+    
+    All bookkeeping is done under a single lock. Threads that cannot get a
+    connection right away wait in line, and connections that are put back
+    are handed to the longest-waiting thread first.
+    
+    Connections can be retired after a maximum lifetime or time spent idle.
+    Stale connections are closed by a background reaper thread, and are
+    never handed out even if the reaper has not gotten to them yet.
+    
+    The pool keeps counters and histograms that `stats` takes a snapshot
+    of. Listeners added with `add_listener` are told about each event as
+    it happens.
+    
+    With a `leak_threshold`, the pool remembers where each connection was
+    checked out from and warns about connections held longer than that, or
+    deleted without being closed. `leak_report` lists where leaked
+    connections came from most often.
+    """
     
     def __init__(self, dbapi_module, pool_size, conn_limit, on_connect,
-            *connect_args, **connect_kwargs):
+            *connect_args, on_checkout=None, max_idle=None, max_lifetime=None,
+            lifetime_jitter=0.1, ping_after=None, ping_sql="SELECT 1",
+            leak_threshold=None, leak_action="warn", checkout_order="fifo",
+            **connect_kwargs):
         """
         :param dbapi_module: The DBAPI module to connect through.
         :param pool_size: Number of standby connections in the pool.
         :param conn_limit: Maximum number of open connections from the pool.
         :param on_connect: A SQL script to execute for each connection.
-            It is executed for a connection each time it is taken out.
+            It is executed and committed once, when the connection is opened.
+        :param on_checkout: A SQL script to execute each time a connection
+            is taken out of the pool.
+        :param max_idle: Seconds a connection may sit idle in the pool
+            before it is closed. Connections beyond `pool_size` are then
+            kept idle until this runs out, instead of being closed as soon
+            as they are put back, while `pool_size` idle connections are
+            always kept. Optional.
+        :param max_lifetime: Seconds after which a connection is closed
+            instead of being reused. Optional.
+        :param lifetime_jitter: Fraction by which each connection's lifetime
+            is randomly shortened, so that connections opened together are
+            not all retired at once.
+        :param ping_after: Seconds a connection may sit idle before it is
+            checked with `ping_sql` as it is taken out of the pool. Recently
+            used connections are handed out without a check. Optional.
+        :param ping_sql: A cheap statement used to check connections.
+        :param leak_threshold: Seconds a connection may be held before it is
+            taken as leaked. Leak detection is off if this is not provided.
+        :param leak_action: What to do with a connection held past the
+            threshold. "warn" issues a :class:`.ConnectionLeakWarning`, and
+            "reclaim" also closes the connection and frees its place.
+        :param checkout_order: Which idle connection to hand out first.
+            "fifo" takes the one that has been idle longest, spreading use
+            over all connections. "lifo" takes the one put back last, so a
+            small set of connections serves most requests and the rest stay
+            idle long enough for `max_idle` to close them.
         :param connect_args: `*args` for calls to `dbapi.connect`.
         :param connect_kwargs: `**kwargs` for calls to `dbapi.connect`.
         """
         self._pool_size = pool_size
         self._conn_limit = conn_limit
-        self._num_conns = 0
         
         self._dbapi = dbapi_module
         
@@ -122,55 +304,566 @@ class ConnectionPool(object):
         self._connect_args = connect_args
         self._connect_kwargs = connect_kwargs
         self._on_connect = on_connect
+        self._on_checkout = on_checkout
+        
+        self._max_idle = max_idle
+        self._max_lifetime = max_lifetime
+        self._lifetime_jitter = lifetime_jitter
+        self._ping_after = ping_after
+        self._ping_sql = ping_sql
+        
+        if leak_action not in ("warn", "reclaim"):
+            raise ValueError("Unknown leak action '{}'.".format(leak_action))
+        self._leak_threshold = leak_threshold
+        
+        if checkout_order not in ("fifo", "lifo"):
+            raise ValueError("Unknown checkout order '{}'.".format(checkout_order))
+        self._lifo = checkout_order == "lifo"
+        self._leak_action = leak_action
+        # Records of connections in use, mapped to whether they have been
+        # reported as leaked yet. Only kept when leak detection is on.
+        self._checked_out = {}
+        self._leak_counts = collections.Counter()
+        
+        self._lock = threading.Lock()
+        # Every open connection is either idle or in use. Connections still
+        # being created count as in use so the limit is never exceeded.
+        self._num_conns = 0
+        self._idle = collections.deque()
+        self._waiters = collections.deque()
+        # Records of connections deleted without being closed while the
+        # lock was held, with whether they may have a transaction open.
+        # Appending to a deque needs no lock.
+        self._orphans = collections.deque()
+        
+        self._created_count = 0
+        self._dropped_count = 0
+        self._failed_count = 0
+        self._wait_times = _Histogram()
+        self._hold_times = _Histogram()
+        self._listeners = []
+        
+        # Started by `warm` to keep `pool_size` connections open.
+        self._replenisher = None
+        self._replenish_event = threading.Event()
+        self._closed_event = threading.Event()
+        # Set by `close`, under the lock.
+        self._closed = False
+    
+        limits = [ t for t in (max_idle, max_lifetime, leak_threshold)
+            if t is not None ]
+        if len(limits) > 0:
+            self._reap_interval = min(limits) / 2
+            self._reaper = threading.Thread(target=self._reap, daemon=True)
+            self._reaper.start()
+        else:
+            self._reaper = None
+    
+    @property
+    def open_count(self):
+        """The number of open connections, idle or in use."""
+        with self._lock:
+            return self._num_conns
+    
+    @property
+    def idle_count(self):
+        """The number of open connections waiting in the pool."""
+        with self._lock:
+            return len(self._idle)
+    
+    @property
+    def in_use_count(self):
+        """The number of open connections taken out of the pool."""
+        with self._lock:
+            return self._num_conns - len(self._idle)
+    
+    def stats(self):
+        """Gets a snapshot of the pool's gauges, counters and histograms.
+        
+        :return: A dictionary with the number of `open`, `idle` and `in_use`
+          connections and of callers `waiting` for one; the number of
+          connections `created`, `dropped` by the pool and `failed` to open;
+          and histograms of checkout `wait_time` and connection `hold_time`.
+          Each histogram is a dictionary with the `count`, `sum` and `max`
+          of its durations in seconds, and `buckets`, a list of pairs of an
+          upper bound and the number of durations above the previous bound.
+        """
+        with self._lock:
+            return {
+                "open": self._num_conns,
+                "idle": len(self._idle),
+                "in_use": self._num_conns - len(self._idle),
+                "waiting": len(self._waiters),
+                "created": self._created_count,
+                "dropped": self._dropped_count,
+                "failed": self._failed_count,
+                "wait_time": self._wait_times.snapshot(),
+                "hold_time": self._hold_times.snapshot()
+            }
+    
+    def add_listener(self, listener):
+        """Adds a function to call on pool events.
+        
+        The listener is called with the name of the event and a duration in
+        seconds, or None. Events are "connect" and "connect_failed" with the
+        time spent connecting, "checkout" with the time spent waiting for a
+        connection, "checkin" with the time the connection was held, and
+        "drop" when the pool closes a connection. Listeners are called from
+        whichever thread causes the event and should return quickly.
+        
+        :param listener: The function to call.
+        """
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+    
+    def remove_listener(self, listener):
+        """Stops calling a function added with `add_listener`."""
+        with self._lock:
+            self._listeners = [ l for l in self._listeners if l != listener ]
+    
+    def _notify(self, event, seconds=None):
+        for listener in self._listeners:
+            listener(event, seconds)
+    
+    def warm(self, replenish=True):
+        """Opens connections until the pool holds its standby number.
+        
+        This moves the cost of connecting from the first requests to the
+        time the pool is warmed.
+        
+        :param replenish: Whether to also start a background thread that
+          opens new connections whenever dropped ones take the number of
+          open connections below the standby number again.
+        """
+        self._fill()
+        
+        with self._lock:
+            start_replenisher = replenish and self._replenisher is None
+            if start_replenisher:
+                self._replenisher = threading.Thread(
+                    target=self._replenish, daemon=True)
+        if start_replenisher:
+            self._replenisher.start()
+    
+    def close(self):
+        """Stops background work and closes all idle connections.
+        
+        Connections that are in use are closed when they are put back.
+        Taking a connection from the pool afterwards raises a
+        :class:`.PoolClosedError`, as it does for threads waiting for one.
+        """
+        self._closed_event.set()
+        self._replenish_event.set()
+        
+        with self._lock:
+            self._closed = True
+            self._pool_size = 0
+            idle = list(self._idle)
+            self._idle.clear()
+            self._num_conns -= len(idle)
+            self._dropped_count += len(idle)
+            
+            waiters = list(self._waiters)
+            self._waiters.clear()
+            for waiter in waiters:
+                # Woken with neither a connection nor room to create one.
+                waiter.event.set()
+        
+        for record in idle:
+            try:
+                record.conn.close()
+            except self._dbapi.Error:
+                pass
+            self._notify("drop")
+    
+    def _fill(self):
+        """Opens connections until `pool_size` connections are open."""
+        while True:
+            with self._lock:
+                if self._num_conns >= min(self._pool_size, self._conn_limit):
+                    return
+                self._num_conns += 1
+            
+            self._return_conn(self._create_connection())
+    
+    def _replenish(self):
+        """Keeps `pool_size` connections open until the pool is closed."""
+        while True:
+            self._replenish_event.wait()
+            if self._closed_event.is_set():
+                return
+            self._replenish_event.clear()
+            
+            try:
+                self._fill()
+            except Exception:
+                # The database may be unreachable, such as during a failover.
+                # Try again after a moment.
+                self._closed_event.wait(1.0)
+                self._replenish_event.set()
+    
+    def _reap(self):
+        """Closes stale idle connections and finds leaked ones until the
+        pool is closed.
+        """
+        while not self._closed_event.wait(self._reap_interval):
+            self._collect_orphans()
+            
+            now = time.monotonic()
+            with self._lock:
+                stale = [ r for r in self._idle if self._is_expired(r, now) ]
+                # Connections that have only sat idle are closed while more
+                # than `pool_size` are idle, longest idle first.
+                for record in self._idle:
+                    if len(self._idle) - len(stale) <= self._pool_size:
+                        break
+                    if record not in stale and self._is_idle_too_long(record, now):
+                        stale.append(record)
+                
+                for record in stale:
+                    self._idle.remove(record)
+            
+            for record in stale:
+                self._drop(record)
+            
+            if self._leak_threshold is not None:
+                self._check_leaks(now)
+    
+    def _collect_orphans(self):
+        """Puts back connections queued by `PooledConnection.__del__`."""
+        while True:
+            try:
+                record, in_transaction = self._orphans.popleft()
+            except IndexError:
+                return
+            
+            if self._untrack(record):
+                self._report_leak(record, "was never closed")
+                self._putconn(record, in_transaction)
+    
+    def leak_report(self, limit=10):
+        """Lists the places leaked connections were checked out from.
+        
+        :param limit: Most places to list.
+        :return: A list of pairs of a formatted stack and the number of
+          leaks from it, with the most frequent first.
+        """
+        with self._lock:
+            return self._leak_counts.most_common(limit)
+    
+    def _check_leaks(self, now):
+        """Reports connections held past the leak threshold."""
+        with self._lock:
+            leaked = [
+                record for record, reported in self._checked_out.items()
+                if not reported and now - record.checkout_time >= self._leak_threshold
+            ]
+            for record in leaked:
+                if self._leak_action == "reclaim":
+                    del self._checked_out[record]
+                else:
+                    self._checked_out[record] = True
         
-        self._pool = queue.Queue(self._pool_size)
+        for record in leaked:
+            if self._leak_action == "reclaim":
+                self._report_leak(record, "was reclaimed after {:.1f}s".format(
+                    now - record.checkout_time))
+                self._note_checkin(record)
+                self._drop(record)
+            else:
+                self._report_leak(record, "has been held for {:.1f}s".format(
+                    now - record.checkout_time))
+    
+    def _report_leak(self, record, problem):
+        """Counts a leaked connection and warns about it."""
+        if record.checkout_stack is None:
+            return
+        
+        stack = "".join(record.checkout_stack.format())
+        with self._lock:
+            self._leak_counts[stack] += 1
+        warnings.warn(
+            "Pooled connection {}. It was checked out at:\n{}".format(problem, stack),
+            ConnectionLeakWarning)
+    
+    def _untrack(self, record):
+        """Notes that a connection is being put back by its user.
+        
+        :return: False if the pool has already reclaimed the connection.
+        """
+        if self._leak_threshold is None:
+            return True
+        with self._lock:
+            return self._checked_out.pop(record, None) is not None
+    
+    def _is_expired(self, record, now):
+        """Checks whether a connection is past its lifetime."""
+        return record.expires is not None and now >= record.expires
+    
+    def _is_idle_too_long(self, record, now):
+        """Checks whether a connection has been idle past `max_idle`."""
+        return self._max_idle is not None and now - record.idle_since >= self._max_idle
+    
+    def _needs_ping(self, record, now):
+        """Checks whether a connection has been idle long enough to check."""
+        return self._ping_after is not None and \
+            now - record.idle_since >= self._ping_after
+    
+    def _ping(self, record):
+        """Checks that a connection still works.
+        
+        :return: Whether the check succeeded.
+        """
+        try:
+            cur = record.conn.cursor()
+            cur.execute(self._ping_sql)
+            cur.fetchall()
+            cur.close()
+            if not record.autocommit:
+                record.conn.rollback()
+        except self._dbapi.Error:
+            return False
+        return True
+    
+    def _drop(self, record):
+        """Closes a connection and gives up its place in the pool."""
+        try:
+            record.conn.close()
+        except self._dbapi.Error:
+            pass
+        with self._lock:
+            self._dropped_count += 1
+        self._decrement_conn_count()
+        self._notify("drop")
     
     def _create_connection(self):
-        """Creates a connection and puts in in the pool."""
-        self._pool.put(
-            self._connect(*self._connect_args, **self._connect_kwargs))
-        self._num_conns += 1
+        """Opens a new connection and returns a record of it.
+        
+        A place for the connection must already be counted in `_num_conns`.
+        If connecting fails, that place is given up again.
+        """
+        start = time.monotonic()
+        try:
+            conn = self._connect(*self._connect_args, **self._connect_kwargs)
+        except BaseException:
+            self._connect_failed(start)
+            raise
+        
+        if self._on_connect is not None:
+            try:
+                cur = conn.cursor()
+                cur.execute(self._on_connect)
+                cur.close()
+                # Commit so that the rollback when the connection is put
+                # back cannot undo the setup.
+                conn.commit()
+            except BaseException:
+                try:
+                    conn.close()
+                except self._dbapi.Error:
+                    pass
+                self._connect_failed(start)
+                raise
+        
+        now = time.monotonic()
+        with self._lock:
+            self._created_count += 1
+        self._notify("connect", now - start)
+        
+        if self._max_lifetime is None:
+            expires = None
+        else:
+            lifetime = self._max_lifetime * \
+                (1 - random.uniform(0, self._lifetime_jitter))
+            expires = now + lifetime
+        return _ConnectionRecord(conn, expires)
+    
+    def _connect_failed(self, start):
+        """Gives up the place of a connection that could not be opened."""
+        with self._lock:
+            self._failed_count += 1
+        self._decrement_conn_count()
+        self._notify("connect_failed", time.monotonic() - start)
     
     def _getconn(self, block=True, timeout=None):
-        """Returns an unwrapped connection object from the pool.
+        """Returns the record of an unwrapped connection from the pool.
         
         With `block` set to False or `timeout` set, this method
         will raise `queue.Empty` when the pool cannot find a
         connection quickly enough."""
-        if self._pool.empty() and self._num_conns < self._conn_limit:
-            self._create_connection()
+        with self._lock:
+            if self._closed:
+                raise PoolClosedError()
+            
+            # Idle connections go to threads already waiting in line first.
+            if len(self._waiters) < 1:
+                if len(self._idle) > 0:
+                    # Connections are put back on the right.
+                    if self._lifo:
+                        return self._idle.pop()
+                    return self._idle.popleft()
+                elif self._num_conns < self._conn_limit:
+                    self._num_conns += 1
+                    create = True
+                else:
+                    create = False
+            else:
+                create = False
+            
+            if not create:
+                if not block:
+                    raise queue.Empty()
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+        
+        if create:
+            return self._create_connection()
+        
+        waiter.event.wait(timeout)
         
-        return self._pool.get(block, timeout)
+        with self._lock:
+            if not waiter.event.is_set():
+                self._waiters.remove(waiter)
+                raise queue.Empty()
+        
+        if waiter.may_create:
+            return self._create_connection()
+        elif waiter.record is None:
+            raise PoolClosedError()
+        return waiter.record
     
-    def get(self, block=True, timeout=None):
+    def get(self, block=True, timeout=None, autocommit=False,
+            track_leaks=True):
         """Returns a wrapped connection object from the pool.
         
-        As `ConnectionPool._getconn`, may raise `queue.Empty`."""
-        conn = PooledConnection(self, self._getconn(block, timeout))
-        if self._on_connect is not None:
-            cur = conn.cursor()
-            cur.execute(self._on_connect)
-            cur.close()
+        As `ConnectionPool._getconn`, may raise `queue.Empty`.
+        
+        :param autocommit: Whether to switch the connection to the driver's
+          autocommit mode, so that statements sent on it do not open a
+          transaction. Connections stay in that mode while they are idle,
+          so the switch is only made when the mode asked for changes.
+          Drivers without an autocommit mode are left as they are.
+        :param track_leaks: Whether leak detection applies to this
+          connection. Turn it off for connections that are meant to be held
+          for longer than the leak threshold.
+        """
+        self._collect_orphans()
+        
+        start = time.monotonic()
+        record = self._get_live_record(block, timeout)
+        record.checkout_time = time.monotonic()
+        wait_time = record.checkout_time - start
+        with self._lock:
+            self._wait_times.add(wait_time)
+        self._notify("checkout", wait_time)
+        
+        if self._leak_threshold is not None:
+            if track_leaks:
+                # Source lines are only looked up if the stack is ever shown.
+                stack = traceback.StackSummary.extract(
+                    traceback.walk_stack(sys._getframe(1)),
+                    limit=_LEAK_STACK_LIMIT, lookup_lines=False)
+                stack.reverse()
+                record.checkout_stack = stack
+            else:
+                record.checkout_stack = None
+            with self._lock:
+                # Untracked connections count as already reported.
+                self._checked_out[record] = not track_leaks
+        
+        conn = PooledConnection(self, record)
+        try:
+            _set_autocommit(self._dbapi, conn._record, autocommit)
+            if self._on_checkout is not None:
+                cur = conn.cursor()
+                cur.execute(self._on_checkout)
+                cur.close()
+        except BaseException:
+            conn._discard()
+            raise
         return conn
     
-    def _putconn(self, conn, block=True, timeout=None):
+    def _get_live_record(self, block=True, timeout=None):
+        """Gets a connection record from the pool, skipping stale ones.
+        
+        Connections past their lifetime are dropped, as are connections
+        that fail a ping after being idle for a while.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            record = self._getconn(block, timeout)
+            
+            now = time.monotonic()
+            if self._is_expired(record, now):
+                self._drop(record)
+            elif self._needs_ping(record, now) and not self._ping(record):
+                self._drop(record)
+            else:
+                return record
+            
+            if deadline is not None:
+                timeout = max(deadline - now, 0)
+    
+    def _putconn(self, record, in_transaction=True):
         """Returns a connection to the connection pool.
         
         Connection may not actually return to the pool,
-        such as if it is closed or the pool is full."""
+        such as if it is closed or the pool is full.
+        
+        :param in_transaction: Whether the connection may have a transaction
+          open. Only then is it rolled back, which saves a round-trip for
+          connections that were committed or only used in autocommit mode.
+        """
+        self._note_checkin(record)
+        
+        if in_transaction:
+            try:
+                record.conn.rollback()
+            except self._dbapi.Error:
+                # This occuring during a rollback means the connection is broken.
+                # Because of this we're just going to drop it.
+                self._drop(record)
+                return
+        
+        if record.expires is not None and time.monotonic() >= record.expires:
+            self._drop(record)
+            return
+        
+        self._return_conn(record)
+    
+    def _return_conn(self, record):
+        """Hands an open connection to a waiting thread or keeps it idle."""
+        record.idle_since = time.monotonic()
+        with self._lock:
+            if not self._closed and len(self._waiters) > 0:
+                waiter = self._waiters.popleft()
+                waiter.record = record
+                waiter.event.set()
+                return
+            elif not self._closed and (len(self._idle) < self._pool_size or
+                    self._max_idle is not None):
+                # With `max_idle`, the reaper closes surplus connections
+                # once they have sat idle that long.
+                self._idle.append(record)
+                return
+            
+            # The pool is closed, or there are enough idle connections that
+            # we don't need this one. We're going to close and drop it.
+            self._num_conns -= 1
+            self._dropped_count += 1
+        
         try:
-            # Perform a rollback just in case and put the connection back.
-            conn.rollback()
-            self._pool.put(conn, block, timeout)
+            record.conn.close()
         except self._dbapi.Error:
-            # This occuring during a rollback means the connection is closed.
-            # Because of this we're just going to drop it.
-            self._num_conns -= 1
-        except queue.Full:
-            # There are enough idle connections that we don't need this one.
-            # We're going to close and drop it.
-            conn.close()
-            self._num_conns -= 1
+            pass
+        self._notify("drop")
+    
+    def _note_checkin(self, record):
+        """Counts the time a connection was held, as it is given back."""
+        hold_time = time.monotonic() - record.checkout_time
+        with self._lock:
+            self._hold_times.add(hold_time)
+        self._notify("checkin", hold_time)
     
     def put(self, wrapped_conn, block=True, timeout=None):
         """Returns a wrapped connection to the pool."""
@@ -179,4 +872,52 @@ class ConnectionPool(object):
         wrapped_conn.close()
     
     def _decrement_conn_count(self):
-        self._num_conns -= 1
+        """Gives up the place of a connection that has been dropped."""
+        with self._lock:
+            if len(self._waiters) > 0:
+                # Rather than freeing the place, let the next thread in line
+                # open a connection in it.
+                waiter = self._waiters.popleft()
+                waiter.may_create = True
+                waiter.event.set()
+            else:
+                self._num_conns -= 1
+                if self._num_conns < self._pool_size:
+                    self._replenish_event.set()
+
+def _set_autocommit(dbapi_module, record, autocommit):
+    """Switches a pooled connection in or out of autocommit mode.
+    
+    sqlite3 connections are in autocommit mode when their `isolation_level`
+    is None. pymysql and MySQLdb connections have an `autocommit` method,
+    and most other drivers have an `autocommit` property. Connections of
+    drivers with neither stay out of autocommit mode, so the pool still
+    rolls them back after use.
+    """
+    if record.autocommit == autocommit:
+        return
+    
+    conn = record.conn
+    if dbapi_module.__name__ == "sqlite3":
+        if autocommit:
+            record.default_mode = conn.isolation_level
+            conn.isolation_level = None
+        else:
+            conn.isolation_level = record.default_mode
+    elif callable(getattr(conn, "autocommit", None)):
+        if autocommit:
+            get_autocommit = getattr(conn, "get_autocommit", None)
+            record.default_mode = get_autocommit() if get_autocommit else False
+            conn.autocommit(True)
+        else:
+            conn.autocommit(record.default_mode)
+    elif hasattr(conn, "autocommit"):
+        if autocommit:
+            record.default_mode = conn.autocommit
+            conn.autocommit = True
+        else:
+            conn.autocommit = record.default_mode
+    else:
+        return
+    
+    record.autocommit = autocommit
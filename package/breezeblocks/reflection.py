@@ -0,0 +1,200 @@
+"""Builds table objects from the catalog of a live database.
+
+Reflection reads table and column names from the database itself instead of
+requiring every :class:`.Table` to be declared by hand. The result can be
+saved to a cache file so that later processes can skip the catalog queries
+entirely when they start up.
+"""
+import json
+import os
+import tempfile
+import time
+
+from .sql import Table, Value
+from .sql.param_store import get_param_store
+
+# Bump this whenever the layout of the cache file changes.
+CACHE_VERSION = 1
+
+_SYSTEM_SCHEMAS = (
+    "information_schema", "pg_catalog", "mysql", "performance_schema", "sys")
+
+class ReflectedSchema(dict):
+    """The tables of a database schema, keyed by table name.
+    
+    Tables come from the cache file when one is available. The cache is only
+    checked against the database lazily: looking up a table that is not in
+    the cache re-reads the catalog once and rewrites the cache before the
+    lookup fails. Changes to the columns of cached tables are not noticed
+    this way, so a cache older than `max_age` seconds is not used, and
+    `refresh` re-reads the catalog on demand.
+    """
+    
+    def __init__(self, db, schema=None, cache_path=None, max_age=None):
+        """
+        :param db: The database to reflect.
+        :param schema: The schema to read tables from. Defaults to the
+          database's current schema.
+        :param cache_path: Path of a file to load and save reflected
+          tables to. Optional.
+        :param max_age: Seconds after it was written that the cache file is
+          read from the database again. Optional.
+        """
+        super().__init__()
+        self._db = db
+        self._schema = schema
+        self._cache_path = cache_path
+        self._max_age = max_age
+        self._refreshed = False
+    
+    def load(self):
+        """Fills in the tables from the cache, or the database if needed.
+        
+        :return: `self` for method chaining.
+        """
+        table_columns = self._read_cache()
+        if table_columns is None:
+            self.refresh()
+        else:
+            self._set_tables(table_columns)
+        return self
+    
+    def refresh(self):
+        """Re-reads the tables from the database and updates the cache.
+        
+        :return: `self` for method chaining.
+        """
+        table_columns = _read_catalog(self._db, self._schema)
+        self._set_tables(table_columns)
+        self._write_cache(table_columns)
+        self._refreshed = True
+        return self
+    
+    def __missing__(self, key):
+        if self._refreshed:
+            raise KeyError(key)
+        
+        self.refresh()
+        return self[key]
+    
+    def _set_tables(self, table_columns):
+        self.clear()
+        for table_name, column_names in table_columns.items():
+            self[table_name] = Table(table_name, column_names, schema=self._schema)
+    
+    def _read_cache(self):
+        if self._cache_path is None:
+            return None
+        
+        try:
+            if self._max_age is not None and \
+                    time.time() - os.path.getmtime(self._cache_path) >= self._max_age:
+                return None
+            with open(self._cache_path, "r") as f:
+                contents = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if (not isinstance(contents, dict) or
+                contents.get("version") != CACHE_VERSION or
+                contents.get("schema") != self._schema):
+            return None
+        
+        return contents.get("tables")
+    
+    def _write_cache(self, table_columns):
+        if self._cache_path is None:
+            return
+        
+        contents = {
+            "version": CACHE_VERSION,
+            "schema": self._schema,
+            "tables": table_columns
+        }
+        
+        # Write to a temporary file first so that concurrent readers never
+        # see a partially written cache.
+        cache_dir = os.path.dirname(os.path.abspath(self._cache_path))
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(contents, f)
+            os.replace(temp_path, self._cache_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+def _read_catalog(db, schema=None):
+    """Reads the names of all tables and their columns from the database.
+    
+    :return: A dictionary mapping table names to lists of column names,
+      with columns in the order they are declared in.
+    """
+    if db._dbapi.__name__ == "sqlite3":
+        statement, params = _get_sqlite_catalog_sql(db, schema)
+    else:
+        statement, params = _get_information_schema_sql(db, schema)
+    
+    conn = db._connect_for_read()
+    try:
+        cur = conn.cursor()
+        cur.execute(statement, params.get_dbapi_params())
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+    
+    table_columns = {}
+    for table_name, column_name in rows:
+        table_columns.setdefault(table_name, []).append(column_name)
+    return table_columns
+
+def _get_sqlite_catalog_sql(db, schema):
+    params = get_param_store(db._dbapi.paramstyle)
+    
+    if schema is None:
+        master_table = "sqlite_master"
+        schema_param = Value("main")
+    else:
+        master_table = "{}.sqlite_master".format(schema)
+        schema_param = Value(schema)
+    params.add_param(schema_param)
+    
+    statement = (
+        "SELECT m.name, p.name\n"
+        "FROM {0} AS m, pragma_table_info(m.name, {1}) AS p\n"
+        "WHERE m.type IN ('table', 'view')\n"
+        "  AND m.name NOT LIKE 'sqlite_%'\n"
+        "ORDER BY m.name, p.cid"
+    ).format(master_table, schema_param._get_ref_field(params))
+    
+    return (statement, params)
+
+def _get_information_schema_sql(db, schema):
+    params = get_param_store(db._dbapi.paramstyle)
+    
+    if schema is None and db._dialect == "postgres":
+        schema_condition = "table_schema = current_schema()"
+    elif schema is None and db._dialect == "mysql":
+        schema_condition = "table_schema = DATABASE()"
+    elif schema is None:
+        # Without a known way to name the current schema, take every
+        # schema that is not part of the database system itself.
+        schema_params = [Value(name) for name in _SYSTEM_SCHEMAS]
+        params.add_params(schema_params)
+        schema_condition = "table_schema NOT IN ({})".format(
+            ", ".join(p._get_ref_field(params) for p in schema_params))
+    else:
+        schema_param = Value(schema)
+        params.add_param(schema_param)
+        schema_condition = "table_schema = {}".format(
+            schema_param._get_ref_field(params))
+    
+    statement = (
+        "SELECT table_name, column_name\n"
+        "FROM information_schema.columns\n"
+        "WHERE {}\n"
+        "ORDER BY table_name, ordinal_position"
+    ).format(schema_condition)
+    
+    return (statement, params)
@@ -0,0 +1,123 @@
+"""Sends reads to replicas of a database and writes to its primary.
+
+A :class:`RoutedDatabase` is used like a :class:`.Database`, but keeps a
+connection pool for the primary database and one for each read replica.
+Queries that take their own connection are run on a replica, while
+inserts, updates, deletes and connections taken with `connect` use the
+primary.
+"""
+import itertools
+import time
+
+from .database import Database
+
+class RoutedDatabase(Database):
+    """Proxies a primary database and its read replicas.
+    
+    Replicas can lag behind the primary, so a read right after a write to
+    the primary may not see its changes on a replica. With `sticky_seconds`
+    set, reads go to the primary for that many seconds after a connection
+    taken for writing was last committed or given back. This applies to
+    reads from every thread, since writes are often made from other
+    threads, such as the workers of a parallel insert or a write buffer.
+    Statements in a block using `pinned` all run on the primary.
+    """
+    
+    def __init__(self, dbapi_module=None, dsn=None, replica_dsns=[], *,
+            strategy="round_robin", sticky_seconds=0, **kwargs):
+        """
+        :param dbapi_module: The DBAPI 2.0 module to use for all databases.
+        :param dsn: The DSN (connection string) for the primary database.
+        :param replica_dsns: A list of DSNs for the read replicas.
+        :param strategy: How to pick a replica for each read. Either
+          "round_robin" to take turns, or "least_loaded" to pick the one
+          with the fewest connections in use.
+        :param sticky_seconds: Seconds after a write is committed during
+          which reads go to the primary.
+        :param kwargs: Other options, as for :class:`.Database`. They apply
+          to the pools of the primary and of each replica.
+        """
+        if strategy not in ("round_robin", "least_loaded"):
+            raise ValueError("Unknown replica strategy '{}'.".format(strategy))
+        
+        super().__init__(dbapi_module, dsn, **kwargs)
+        
+        self._strategy = strategy
+        self._sticky_seconds = sticky_seconds
+        self._last_write_time = None
+        self.replica_pools = [ self._create_pool(d) for d in replica_dsns ]
+        
+        self._turns = itertools.count()
+    
+    def close(self):
+        """Closes the connection pools of the primary and the replicas."""
+        super().close()
+        for pool in self.replica_pools:
+            pool.close()
+    
+    def _checkout_for_read(self, track_leaks=True):
+        pool = self._choose_read_pool()
+        return pool.get(autocommit=self._autocommit_reads,
+            track_leaks=track_leaks)
+    
+    def _checkout_for_write(self, track_leaks=True, block=True, timeout=None):
+        return _WriteConnection(self,
+            self.pool.get(block, timeout, track_leaks=track_leaks))
+    
+    def _note_write(self):
+        """Notes that a write to the primary has just ended."""
+        self._last_write_time = time.monotonic()
+    
+    def _choose_read_pool(self):
+        """Picks the pool that a read should take a connection from."""
+        if len(self.replica_pools) < 1:
+            return self.pool
+        
+        last_write_time = self._last_write_time
+        if last_write_time is not None and \
+                time.monotonic() - last_write_time < self._sticky_seconds:
+            return self.pool
+        
+        # Start from a different replica each time, so that ties between
+        # equally loaded replicas are broken in turn.
+        turn = next(self._turns) % len(self.replica_pools)
+        pools = self.replica_pools[turn:] + self.replica_pools[:turn]
+        
+        if self._strategy == "least_loaded":
+            return min(pools, key=lambda pool: pool.in_use_count)
+        else:
+            return pools[0]
+
+class _WriteConnection(object):
+    """Wraps a connection to the primary to note when writes on it end.
+    
+    Replicas can only fall behind on changes once they are committed, so
+    the time is noted when the connection is committed or given back,
+    rather than when it is taken.
+    """
+    
+    def __init__(self, db, conn):
+        self._db = db
+        self._conn = conn
+    
+    def commit(self):
+        self._conn.commit()
+        self._db._note_write()
+    
+    def close(self):
+        try:
+            self._conn.close()
+        finally:
+            self._db._note_write()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        try:
+            return self._conn.__exit__(exc_type, exc_value, exc_tb)
+        finally:
+            self._db._note_write()
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
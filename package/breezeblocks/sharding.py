@@ -0,0 +1,327 @@
+"""Runs queries against data split across several databases.
+
+A :class:`ShardedDatabase` holds one :class:`.Database` per shard and a
+function that picks the shard for a value of the shard key. Queries whose
+where clause fixes the shard key with an equality are run on that shard
+alone. Other queries are run on every shard at once, and the results are
+merged in the query's order. Grouped, distinct and aggregate queries cannot
+be merged this way, so they must fix the shard key.
+"""
+import heapq
+import itertools
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import QueryError
+from .query_builder import QueryBuilder
+from .sql.aggregates import _Aggregator, RecordCount
+from .sql.column import AliasedColumnExpr, ColumnExpr
+from .sql.expressions import Value, _AliasedExpr
+from .sql.expressions import _BinaryOperator, _ChainableOperator, _UnaryOperator
+from .sql.join import _JoinColumn
+from .sql.operators import And_, Equal_
+from .sql.table import AliasedTableExpression
+
+class ShardedDatabase(object):
+    """Proxies a set of databases that each hold one shard of the data.
+    
+    All shards must use the same DBAPI module and SQL dialect, since a query
+    is built once and run unchanged on each of them.
+    """
+    
+    def __init__(self, shards, shard_key, shard_for, *, max_workers=None):
+        """
+        :param shards: A list of :class:`.Database` objects, or a dictionary
+          of them keyed by shard name.
+        :param shard_key: The name of the column that data is sharded by,
+          or a pair of a table or table name and a column name. With a name
+          alone, columns with that name in any table are taken as the shard
+          key, which is only right if every table sharing the name is
+          sharded by it, as when joined tables are kept together.
+        :param shard_for: A function taking a value of the shard key and
+          returning the index or name of the shard holding it.
+        :param max_workers: Most shards to query at once. Defaults to the
+          number of shards.
+        """
+        self.shards = shards
+        if isinstance(shard_key, str):
+            self._shard_key = (None, shard_key)
+        else:
+            table, column_name = shard_key
+            self._shard_key = (getattr(table, "name", table), column_name)
+        self._shard_for = shard_for
+        
+        if isinstance(shards, Mapping):
+            self._shard_list = list(shards.values())
+        else:
+            self._shard_list = list(shards)
+        if len(self._shard_list) < 1:
+            raise QueryError("A sharded database needs at least one shard.")
+        
+        if max_workers is None:
+            max_workers = len(self._shard_list)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+    
+    def shard(self, key):
+        """Gets the database holding the shard for a value of the shard key.
+        
+        Use this to insert, update or delete rows for a shard key value.
+        
+        :param key: The value of the shard key.
+        :return: The :class:`.Database` for the shard.
+        """
+        return self.shards[self._shard_for(key)]
+    
+    def query(self, *queryables):
+        """Starts building a query across the shards.
+        
+        :return: A query builder whose `get` method returns a
+          :class:`ShardedQuery`.
+        """
+        return ShardedQueryBuilder(self).select(*queryables)
+    
+    def close(self):
+        """Stops the threads used to query shards and closes each shard."""
+        self._executor.shutdown()
+        for db in self._shard_list:
+            db.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+class ShardedQueryBuilder(QueryBuilder):
+    """Builds queries that run against a :class:`ShardedDatabase`."""
+    
+    def __init__(self, sharded_db):
+        # Queries are built for the first shard and run on any of them.
+        super().__init__(sharded_db._shard_list[0])
+        self._sharded_db = sharded_db
+    
+    def clone(self, db=None):
+        if db is not None:
+            return super().clone(db)
+        
+        cloned_builder = ShardedQueryBuilder(self._sharded_db)
+        cloned_builder._state = self._state.clone()
+        return cloned_builder
+    
+    def get(self):
+        return ShardedQuery(self._sharded_db, super().get())
+
+class ShardedQuery(object):
+    """A query that runs on one shard or on all of them."""
+    
+    def __init__(self, sharded_db, query):
+        """
+        :param sharded_db: The sharded database to run the query against.
+        :param query: The query, as built for any one of the shards.
+        """
+        self._sharded_db = sharded_db
+        self._query = query
+    
+    @property
+    def columns(self):
+        return self._query.columns
+    
+    def execute(self, limit=None, offset=None):
+        """Fetch rows in this query from the shards.
+        
+        When the where clause fixes the shard key, the query is run on that
+        shard only. Otherwise it is run on all shards at once, with each
+        shard limited to the rows that could make it into the result.
+        Grouped, distinct and aggregate queries raise a
+        :class:`.QueryError` instead, since rows from different shards
+        would have to be combined.
+        
+        :param limit: LIMIT argument for this execution.
+        :param offset: OFFSET argument for this execution.
+        
+        :return: The rows returned by the query.
+        """
+        key = _find_shard_key(self._query._spec.where_conds,
+            self._sharded_db._shard_key)
+        if key is not _NO_KEY:
+            db = self._sharded_db.shard(key)
+            return self._execute_on(db, limit, offset)
+        
+        _check_mergeable(self._query)
+        # Only needed to merge rows, so single-shard queries may be ordered
+        # by columns they do not select.
+        sort_key = _get_sort_key(self._query, self._query._db._dialect)
+        
+        if offset is None:
+            offset = 0
+        shard_limit = None if limit is None else limit + offset
+        
+        futures = [
+            self._sharded_db._executor.submit(self._execute_on, db, shard_limit)
+            for db in self._sharded_db._shard_list
+        ]
+        results = [ future.result() for future in futures ]
+        
+        if sort_key is None:
+            rows = itertools.chain.from_iterable(results)
+        else:
+            rows = heapq.merge(*results, key=sort_key)
+        
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(rows, offset, stop))
+    
+    def set_param(self, param_key, value):
+        """Sets a bound parameter for the query.
+        
+        :param param_key: The identifier of the parameter to set.
+        :param value: The value to assign to the parameter.
+        """
+        return self._query.set_param(param_key, value)
+    
+    def _execute_on(self, db, limit=None, offset=None):
+        conn = db._connect_for_read()
+        try:
+            return self._query.execute(limit, offset, conn=conn)
+        finally:
+            conn.close()
+
+# Returned when no shard key can be found, since None is a valid key.
+_NO_KEY = object()
+
+def _find_shard_key(conditions, shard_key):
+    """Looks for a condition fixing the shard key to a single value.
+    
+    :param conditions: Conditions that must all hold, such as those in
+      a where clause.
+    :param shard_key: A pair of the shard key's table name, or None for any
+      table, and its column name.
+    :return: The value of the shard key, or `_NO_KEY` if none is fixed.
+    """
+    for cond in conditions:
+        if isinstance(cond, And_):
+            key = _find_shard_key(cond._operands, shard_key)
+        elif isinstance(cond, Equal_):
+            key = _get_equal_value(cond._lhs, cond._rhs, shard_key)
+            if key is _NO_KEY:
+                key = _get_equal_value(cond._rhs, cond._lhs, shard_key)
+        else:
+            key = _NO_KEY
+        
+        if key is not _NO_KEY:
+            return key
+    return _NO_KEY
+
+def _get_equal_value(column, value, shard_key):
+    if not isinstance(value, Value):
+        return _NO_KEY
+    
+    column_key = _get_column_key(column)
+    if column_key is None:
+        return _NO_KEY
+    
+    table_name, column_name = shard_key
+    if column_key[1] == column_name and table_name in (None, column_key[0]):
+        return value.get_value()
+    return _NO_KEY
+
+def _get_column_key(expr):
+    """Gets the table name and column name of a column expression.
+    
+    Columns used through joins or aliases are followed back to the table
+    they belong to.
+    
+    :return: A pair of names, or None if the expression is not a column.
+    """
+    while isinstance(expr, (_JoinColumn, AliasedColumnExpr)):
+        if isinstance(expr, _JoinColumn):
+            expr = expr._column_expr
+        else:
+            expr = expr.column
+    if not isinstance(expr, ColumnExpr):
+        return None
+    
+    table = expr.table
+    while isinstance(table, AliasedTableExpression):
+        table = table._table_expr
+    return (table.name, expr.name)
+
+def _check_mergeable(query):
+    """Checks that the rows of a query from each shard can be merged."""
+    spec = query._spec
+    if len(spec.group_exprs) > 0 or spec.distinct or \
+            any(_has_aggregate(expr) for expr in spec.select_exprs):
+        raise QueryError(
+            "Grouped, distinct and aggregate queries must fix the shard key.")
+
+def _has_aggregate(expr):
+    """Checks whether an expression uses an aggregate function."""
+    if isinstance(expr, (_Aggregator, RecordCount)):
+        return True
+    elif isinstance(expr, _AliasedExpr):
+        return _has_aggregate(expr._expr)
+    elif isinstance(expr, _UnaryOperator):
+        return _has_aggregate(expr._operand)
+    elif isinstance(expr, _BinaryOperator):
+        return _has_aggregate(expr._lhs) or _has_aggregate(expr._rhs)
+    elif isinstance(expr, _ChainableOperator):
+        return any(_has_aggregate(operand) for operand in expr._operands)
+    return False
+
+def _get_sort_key(query, dialect):
+    """Builds a function giving the merge order of a query's result rows.
+    
+    :return: The key function, or None if the query is not ordered.
+    """
+    orderings = query._spec.orderings
+    if len(orderings) < 1:
+        return None
+    
+    names = query.columns.get_names()
+    # Postgres sorts nulls as larger than any value, while the other
+    # dialects sort them as smaller.
+    nulls_large = dialect == "postgres"
+    
+    fields = []
+    for ordering in orderings:
+        name = ordering._expr._get_name()
+        if name not in names:
+            raise QueryError(
+                "Sharded queries can only be ordered by selected columns.")
+        
+        nulls = ordering._nulls.lower() if ordering._nulls is not None else None
+        fields.append((names.index(name), ordering._ascending, nulls))
+    
+    def sort_key(row):
+        key = []
+        for index, ascending, nulls in fields:
+            value = row[index]
+            is_null = value is None
+            
+            if is_null:
+                field = (nulls_large, 0)
+            else:
+                field = (not nulls_large, value)
+            if not ascending:
+                field = _Descending(field)
+            
+            if nulls is None:
+                key.append((0, field))
+            else:
+                key.append((is_null != (nulls == "first"), field))
+        return tuple(key)
+    
+    return sort_key
+
+class _Descending(object):
+    """Wraps a value to reverse the order it sorts in."""
+    
+    __slots__ = ("value",)
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def __lt__(self, other):
+        return other.value < self.value
+    
+    def __eq__(self, other):
+        return self.value == other.value
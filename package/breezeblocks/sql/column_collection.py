@@ -14,18 +14,23 @@ class ColumnCollection(object):
     Instances are meant to be passed to the `select` method of `Query` objects.
     Calling `select` on one of these adds all of the columns in it to the
     select clause of the query.
+    
+    Subclasses may provide column names without column objects and override
+    `_make_column`, in which case each column is only created the first time
+    it is used.
     """
     
     def __init__(self, columns):
         self._column_names = tuple(column._get_name() for column in columns)
         self._columns = {column._get_name(): column for column in columns}
+        self._name_set = None
     
     def _get_selectables(self):
-        return [self._columns[name] for name in self._column_names]
+        return [self._get_column(name) for name in self.get_names()]
     
     def _get_tables(self):
         tables = set()
-        for column in self._columns.values():
+        for column in self._get_selectables():
             tables.update(column._get_tables())
         return tables
     
@@ -36,10 +41,29 @@ class ColumnCollection(object):
         try:
             return self._columns[key]
         except KeyError:
+            pass
+        
+        if key not in self._get_name_set():
             raise MissingColumnError(key)
     
+        # Another thread may have created the column in the meantime,
+        # and everyone should end up with the same object.
+        return self._columns.setdefault(key, self._make_column(key))
+    
+    def _make_column(self, name):
+        """Creates the column object for a name in this collection.
+        
+        Only called for names without a column object yet.
+        """
+        raise MissingColumnError(name)
+    
+    def _get_name_set(self):
+        if self._name_set is None:
+            self._name_set = frozenset(self.get_names())
+        return self._name_set
+    
     def __contains__(self, key):
-        return key in self._columns
+        return key in self._get_name_set()
     
     def __getitem__(self, key):
         try:
@@ -54,3 +78,24 @@ class ColumnCollection(object):
     def get_names(self):
         """:return: The names of all columns in the collection."""
         return self._column_names
+
+class _DerivedColumnCollection(ColumnCollection):
+    """A collection with the same column names as another collection.
+    
+    Only a reference to the source collection is kept, so creating one of
+    these does not depend on the number of columns. Subclasses must
+    implement `_make_column`.
+    """
+    
+    def __init__(self, source):
+        self._source = source
+        self._columns = {}
+    
+    def _make_column(self, name):
+        raise NotImplementedError()
+    
+    def _get_name_set(self):
+        return self._source._get_name_set()
+    
+    def get_names(self):
+        return self._source.get_names()
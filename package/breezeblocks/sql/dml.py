@@ -1,9 +1,168 @@
-from ..exceptions import InsertError, UpdateError, DeleteError
-from .expressions import Value
-from .param_store import get_param_store
+import queue
+import threading
+import time
+from collections import namedtuple
+from collections.abc import Mapping
+from itertools import chain, dropwhile, islice
+from operator import attrgetter, itemgetter
+
+from ..bulk import MultiRowLoader
+from ..exceptions import BuilderError, InsertError, ParallelInsertError
+from ..exceptions import UpdateError, DeleteError
+from .expressions import Value, ValueExpr
+from .operators import InValues_
+from .param_store import get_param_store, MappedParamStore
 from .query import Query
 from .statement import Statement
 
+# Upper bound on rows in a single multi-row insert, so that statement text
+# stays a reasonable size even when the parameter limit is very high.
+_MAX_ROWS_PER_STATEMENT = 1000
+
+def _get_values_rows_sql(values, num_columns, param_store):
+    """Gets the rows of a VALUES list for parameters.
+    
+    :param values: Parameters for all rows, one row after another.
+    :param num_columns: The number of parameters in each row.
+    :param param_store: The parameter store the values were added to.
+    :return: The rows as SQL, such as `(?,?),(?,?)`.
+    """
+    return ",".join(
+        "({0})".format(",".join(
+            v._get_ref_field(param_store) for v in values[i:i + num_columns]))
+        for i in range(0, len(values), num_columns))
+
+def _execute_values_batches(chunk, cur, batch_size, full_batch, construct_sql,
+        returned_rows=None):
+    """Runs a statement with a VALUES list for each batch of rows in a chunk.
+    
+    :param chunk: The rows to send, each a sequence of parameter values.
+    :param cur: The cursor to execute statements on.
+    :param batch_size: The most rows sent in one statement.
+    :param full_batch: What `construct_sql` returns for `batch_size` rows,
+      which is reused for every full batch.
+    :param construct_sql: Callable taking a number of rows and returning the
+      statement for them, the names of its row parameters in order and its
+      other parameters. The names are None for paramstyles that take a
+      sequence.
+    :param returned_rows: Optional list to add rows returned by each
+      statement to.
+    """
+    for i in range(0, len(chunk), batch_size):
+        batch = chunk[i:i + batch_size]
+        
+        if len(batch) == batch_size:
+            statement, param_keys, other_params = full_batch
+        else:
+            # Only the final, partial batch needs a new statement.
+            statement, param_keys, other_params = construct_sql(len(batch))
+        
+        flat_values = [value for row in batch for value in row]
+        if param_keys is not None:
+            param_data = dict(zip(param_keys, flat_values))
+            param_data.update(
+                (p._param_name, p.get_value()) for p in other_params)
+            cur.execute(statement, param_data)
+        else:
+            flat_values.extend(p.get_value() for p in other_params)
+            cur.execute(statement, flat_values)
+        
+        if returned_rows is not None:
+            returned_rows.extend(cur.fetchall())
+
+def supports_returning(db, statement_type):
+    """Checks whether a database supports RETURNING for a type of statement.
+    
+    :param db: The database the statement would run against.
+    :param statement_type: One of "INSERT", "UPDATE" or "DELETE".
+    :return: True if the statement can end with a RETURNING clause.
+    """
+    if db._dialect == "postgres":
+        return True
+    elif db._dialect == "sqlite":
+        return db._dbapi.sqlite_version_info >= (3, 35, 0)
+    elif db._dialect == "mysql":
+        # MySQL has no RETURNING. MariaDB 10.5 added it for inserts and
+        # deletes only.
+        if statement_type == "UPDATE":
+            return False
+        return _get_mariadb_version(db._get_server_version()) >= (10, 5)
+    else:
+        return False
+
+def _get_mariadb_version(server_version):
+    """Parses the version of a MariaDB server, such as `10.6.4-MariaDB-log`.
+    
+    :return: The major and minor version numbers, or `(0, 0)` if the server
+      is not MariaDB.
+    """
+    if "mariadb" not in server_version.lower():
+        return (0, 0)
+    
+    # Older servers put a MySQL version in front for old clients.
+    version = server_version.split("-")
+    if version[0] == "5.5.5" and len(version) > 1:
+        version = version[1:]
+    try:
+        major, minor = version[0].split(".")[:2]
+        return (int(major), int(minor))
+    except ValueError:
+        return (0, 0)
+
+def _get_returning_sql(returning):
+    """Gets a RETURNING clause for a list of column names."""
+    if len(returning) < 1:
+        return ""
+    return "\nRETURNING " + ", ".join(returning)
+
+def _make_return_type(statement, returning):
+    """Makes the namedtuple type for rows returned by a statement."""
+    return namedtuple("Returning_" + str(id(statement)), returning, rename=True)
+
+class _ReturningLoader(MultiRowLoader):
+    """Inserts rows with multi-row statements, keeping the rows returned."""
+    
+    def __init__(self, returned_rows):
+        self._returned_rows = returned_rows
+    
+    def insert_chunk(self, insert, chunk, cur):
+        insert._insert_multirow_chunk(chunk, cur, self._returned_rows)
+
+class _ParallelProgress(object):
+    """Tracks rows committed and errors raised by parallel insert workers."""
+    
+    def __init__(self, on_chunk=None):
+        self._lock = threading.Lock()
+        self._on_chunk = on_chunk
+        self.row_count = 0
+        self.errors = []
+    
+    def add_rows(self, row_count):
+        with self._lock:
+            self.row_count += row_count
+            if self._on_chunk is not None:
+                self._on_chunk(self.row_count)
+    
+    def add_error(self, chunk_number, error):
+        with self._lock:
+            self.errors.append((chunk_number, error))
+    
+    def failed(self):
+        return len(self.errors) > 0
+
+def _put_chunk(chunks, item, threads):
+    """Queues an item for parallel insert workers.
+    
+    :return: False if every worker stopped before the item could be queued.
+    """
+    while any(thread.is_alive() for thread in threads):
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
 class Insert(Statement):
     """Represents a database insert.
     
@@ -11,13 +170,14 @@ class Insert(Statement):
     the database itself using insert-into-select.
     """
     
-    def __init__(self, statement_base, table, columns, db=None):
+    def __init__(self, statement_base, table, columns, db=None, returning=[]):
         """Initializes an insert statement against a specific database.
         
         :param statement_base: The first part of the insert statement.
         :param table: The table to insert into.
         :param columns: The columns that data is being inserted in.
         :param db: The database to perform the insert on.
+        :param returning: Names of columns to return from inserted rows.
         """
         if db is None:
             raise InsertError("Attempting to insert without a database.")
@@ -26,8 +186,16 @@ class Insert(Statement):
         self._statement_base = statement_base
         self._table = table
         self._columns = columns
+        self._returning = returning
+        self._return_type = _make_return_type(self, returning)
         
-    def execute(self, data, conn=None):
+        # Statements for single rows and for full multi-row batches,
+        # built on first use.
+        self._row_statement = None
+        self._multirow_batch = None
+    
+    def execute(self, data, conn=None, *, multirow=False,
+            chunk_size=1000, commit_every=None, on_chunk=None):
         """Insert rows from data into the database.
         
         The "data" provided can either be a query or actual data.
@@ -35,29 +203,138 @@ class Insert(Statement):
         For a query, this will execute an insert-into-select statement
         in the database.
         
-        For in-memory data in python, this translated to a `cursor.executemany`
-        call. The data should be a list of suitable objects, which at this time
-        is limited to lists or tuples.
+        For in-memory data in python, the data can be any iterable of rows.
+        Rows that are lists or tuples hold values in the order of the insert's
+        columns and are passed to the DBAPI module as they are. Rows that are
+        dicts or namedtuples have their values looked up by column name.
+        The data can also be columnar: a mapping of column names to sequences
+        of values, such as lists or NumPy arrays. Iterables include
+        generators, so rows can be inserted while they are still being
+        produced. The rows are consumed in chunks of `chunk_size` and each
+        chunk is sent to the database on its own, so only one chunk of rows
+        is held in memory at a time. Chunks are sent through the database's
+        bulk loader, which uses the fastest path the DBAPI module offers and
+        otherwise falls back to `cursor.executemany`.
+        
+        With `multirow` set, rows are instead inserted with statements of the
+        form `INSERT ... VALUES (...), (...), ...`, each holding as many rows
+        as the database's parameter limit allows. Many drivers send each row
+        of an `executemany` call to the server separately, so this can
+        greatly reduce the number of round-trips.
         
-        :param data: The query or rows to insert.
+        :param data: The query, rows, or columns to insert.
         :param conn: Optional connection to use to execute this statement.
           An insert will get and put back a connection if this isn't provided.
+        :param multirow: Whether to insert rows with multi-row statements.
+        :param chunk_size: Number of rows to take from `data` at a time.
+        :param commit_every: Commit the connection after this many chunks.
+          By default, the insert is only committed if `conn` is not provided,
+          and then only once all rows have been inserted.
+        :param on_chunk: Optional callable, called after each chunk with the
+          total number of rows inserted so far.
+        
+        :return: The number of rows inserted. If the insert has columns to
+          return, a list of the returned rows instead. In-memory data is then
+          always inserted with multi-row statements.
         """
         manage_conn = conn is None
         if manage_conn:
-            conn = self._db.pool.get()
+            conn = self._db._connect_for_write()
         
         cur = conn.cursor()
         
+        returned_rows = []
         if isinstance(data, Query):
-            self._insert_from_query(data, cur)
+            row_count = self._insert_from_query(data, cur, returned_rows)
         else:
-            self._insert_row_data(data, cur)
+            row_count = self._insert_row_data(data, conn, cur,
+                multirow, chunk_size, commit_every, on_chunk, returned_rows)
         
         cur.close()
         if manage_conn:
             conn.commit()
             conn.close()
+        
+        if len(self._returning) > 0:
+            return [ self._return_type._make(r) for r in returned_rows ]
+        return row_count
+    
+    def execute_parallel(self, data, workers=4, *, multirow=False,
+            chunk_size=1000, on_chunk=None, timeout=None):
+        """Insert rows from data using several connections at once.
+        
+        Rows are taken from `data` in chunks and handed to worker threads,
+        each inserting through its own connection from the pool and
+        committing after every chunk. Only a few chunks are queued for the
+        workers at a time, so `data` is read no faster than it is inserted.
+        
+        If any chunk fails, it is rolled back, no further chunks are queued,
+        and a :class:`.ParallelInsertError` is raised once the workers stop.
+        Chunks that were already committed stay in the database.
+        
+        :param data: The rows or columns to insert, as for `execute`.
+        :param workers: The most connections to insert through. Only the
+          first connection is waited for, and the rest are only used if they
+          are free in the pool right away.
+        :param multirow: Whether to insert rows with multi-row statements.
+        :param chunk_size: Number of rows to take from `data` at a time.
+        :param on_chunk: Optional callable, called after each chunk is
+          committed with the total number of rows committed so far. It is
+          called from the worker threads, one at a time.
+        :param timeout: Most seconds to wait for the first connection. By
+          default this waits as long as it takes.
+        
+        :raises InsertError: If no connection became free within `timeout`.
+        
+        :return: The number of rows inserted.
+        """
+        if isinstance(data, Query):
+            raise InsertError("Parallel inserts need rows, not a query.")
+        if len(self._returning) > 0:
+            raise InsertError("Parallel inserts cannot return rows.")
+        
+        if multirow:
+            loader = MultiRowLoader()
+        else:
+            loader = self._db._bulk_loader
+        chunk_size = loader.get_chunk_size(self, chunk_size)
+        
+        conns = self._checkout_worker_conns(
+            max(1, min(workers, self._db.pool._conn_limit)), timeout)
+        chunks = queue.Queue(len(conns) * 2)
+        progress = _ParallelProgress(on_chunk)
+        threads = [
+            threading.Thread(target=self._load_chunks,
+                args=(conn, chunks, loader, progress), daemon=True)
+            for conn in conns
+        ]
+        for thread in threads:
+            thread.start()
+        
+        try:
+            rows = self._get_row_tuples(data)
+            chunk_number = 0
+            while not progress.failed():
+                chunk = list(islice(rows, chunk_size))
+                if len(chunk) < 1:
+                    break
+                
+                if not _put_chunk(chunks, (chunk_number, chunk), threads):
+                    progress.add_error(chunk_number,
+                        InsertError("All parallel insert workers stopped."))
+                    break
+                chunk_number += 1
+        finally:
+            # Each worker stops when it takes one of these.
+            for _ in threads:
+                _put_chunk(chunks, None, threads)
+            for thread in threads:
+                thread.join()
+        
+        if progress.failed():
+            raise ParallelInsertError(progress.errors, progress.row_count)
+        
+        return progress.row_count
     
     def show(self):
         if self._db._dbapi.paramstyle == "qmark":
@@ -69,41 +346,371 @@ class Insert(Statement):
         
         print(self._statement_base + " VALUES ({0})".format(",".join(param_marker for _ in self._columns)))
     
-    def _insert_from_query(self, query, cur):
-        statement = self._statement_base + "\n" + query._get_statement()
+    def _insert_from_query(self, query, cur, returned_rows):
+        statement = self._statement_base + "\n" + self._get_source_sql(query)
         
         params = get_param_store(self._db._dbapi.paramstyle)
         params.add_params(query._get_params())
+        statement += self._get_statement_suffix(params)
         
         cur.execute(statement, params.get_dbapi_params())
+        if len(self._returning) > 0:
+            returned_rows.extend(cur.fetchall())
+        return cur.rowcount
     
-    def _insert_row_data(self, data, cur):
-        if len(data) < 1:
-            return
+    def _insert_row_data(self, data, conn, cur,
+            multirow, chunk_size, commit_every, on_chunk, returned_rows):
+        if len(self._returning) > 0:
+            # Returned rows can only be fetched after a single execute.
+            loader = _ReturningLoader(returned_rows)
+        elif multirow:
+            loader = MultiRowLoader()
+        else:
+            loader = self._db._bulk_loader
+        chunk_size = loader.get_chunk_size(self, chunk_size)
+        
+        rows = self._get_row_tuples(data)
+        row_count = 0
+        chunk_count = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if len(chunk) < 1:
+                break
+            
+            loader.insert_chunk(self, chunk, cur)
+            
+            row_count += len(chunk)
+            chunk_count += 1
+            
+            if commit_every is not None and chunk_count % commit_every == 0:
+                conn.commit()
+            if on_chunk is not None:
+                on_chunk(row_count)
+        
+        return row_count
+    
+    def _checkout_worker_conns(self, workers, timeout):
+        """Takes the connections for the workers of `execute_parallel`.
+        
+        They are held until all chunks are loaded, so leak detection does
+        not apply to them. Only the first one is waited for, so that there
+        are never workers waiting on connections held by the others.
+        """
+        try:
+            conns = [ self._db._checkout_for_write(
+                track_leaks=False, timeout=timeout) ]
+        except queue.Empty:
+            raise InsertError(
+                "No connection became free for the parallel insert.")
+        
+        try:
+            while len(conns) < workers:
+                conns.append(self._db._checkout_for_write(
+                    track_leaks=False, block=False))
+        except queue.Empty:
+            pass
+        except Exception:
+            for conn in conns:
+                conn.close()
+            raise
+        return conns
+    
+    def _load_chunks(self, conn, chunks, loader, progress):
+        """Inserts chunks from a queue until it gives None.
+        
+        This is run by each worker thread of `execute_parallel`, which
+        closes `conn` once it is done.
+        """
+        try:
+            cur = conn.cursor()
+        except Exception as e:
+            progress.add_error(None, e)
+            cur = None
+        
+        try:
+            while True:
+                item = chunks.get()
+                if item is None:
+                    break
+                elif cur is None:
+                    # Keep taking chunks so that the queue never fills up.
+                    continue
+            
+                chunk_number, chunk = item
+                try:
+                    loader.insert_chunk(self, chunk, cur)
+                    conn.commit()
+                except Exception as e:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        # The chunk's own error is the one to report.
+                        pass
+                    progress.add_error(chunk_number, e)
+                else:
+                    progress.add_rows(len(chunk))
+        except Exception as e:
+            # Such as an error raised by `on_chunk`. The worker stops, and
+            # the other workers stop taking chunks once they see the error.
+            progress.add_error(None, e)
+        finally:
+            if cur is not None:
+                cur.close()
+            conn.close()
+    
+    def _get_row_tuples(self, data):
+        """Gets an iterator of rows with values in column order.
+        
+        Lists and tuples are used as they are. Only dicts, namedtuples and
+        columnar data need values picked out, which is done with `zip` and
+        the getters from :mod:`operator` to keep the cost per row low.
+        """
+        if isinstance(data, Mapping):
+            columns = []
+            for name in self._columns:
+                column = data[name]
+                # NumPy arrays convert their values to Python types all at once.
+                if hasattr(column, "tolist"):
+                    column = column.tolist()
+                columns.append(column)
+            return zip(*columns)
+        
+        rows = iter(data)
+        try:
+            first_row = next(rows)
+        except StopIteration:
+            return iter(())
+        rows = chain((first_row,), rows)
+        
+        if isinstance(first_row, Mapping):
+            getter = itemgetter(*self._columns)
+        elif hasattr(first_row, "_fields") and \
+                tuple(first_row._fields) != tuple(self._columns):
+            getter = attrgetter(*self._columns)
+        else:
+            return rows
+        
+        if len(self._columns) == 1:
+            # Getters for a single name return the value instead of a tuple.
+            return ((getter(row),) for row in rows)
+        return map(getter, rows)
+    
+    def _insert_chunk(self, chunk, cur):
+        if self._row_statement is None:
+            params = get_param_store(self._db._dbapi.paramstyle)
+            values = [ Value(None) for _ in self._columns ]
+            params.add_params(values)
+            
+            statement = self._statement_base + " VALUES ({0})".format(",".join(v._get_ref_field(params) for v in values))
+            statement += self._get_statement_suffix(params)
+            
+            if isinstance(params, MappedParamStore):
+                param_keys = [v._param_name for v in values]
+            else:
+                param_keys = None
+            self._row_statement = (
+                statement, param_keys, params.get_all_params()[len(values):])
+        
+        statement, param_keys, suffix_params = self._row_statement
+        
+        if param_keys is not None:
+            suffix_data = {p._param_name: p.get_value() for p in suffix_params}
+            param_data = [dict(zip(param_keys, row), **suffix_data) for row in chunk]
+        elif len(suffix_params) > 0:
+            suffix_data = [p.get_value() for p in suffix_params]
+            param_data = [list(row) + suffix_data for row in chunk]
+        else:
+            # Rows already hold their values in parameter order.
+            param_data = chunk
+        
+        cur.executemany(statement, param_data)
+    
+    def _insert_multirow_chunk(self, chunk, cur, returned_rows=None):
+        batch_size = self._get_multirow_batch_size()
+        
+        if self._multirow_batch is None:
+            self._multirow_batch = self._construct_multirow_sql(batch_size)
+        
+        _execute_values_batches(chunk, cur, batch_size, self._multirow_batch,
+            self._construct_multirow_sql, returned_rows)
+    
+    def _get_multirow_batch_size(self):
+        """Gets how many rows can go in one multi-row insert statement."""
+        param_limit = self._db._param_limit - len(self._get_suffix_params())
+        return max(1, min(
+            param_limit // len(self._columns), _MAX_ROWS_PER_STATEMENT))
+    
+    def _get_source_sql(self, query):
+        """Gets the SQL for a query whose rows are inserted."""
+        return query._get_statement()
+    
+    def _get_statement_suffix(self, param_store):
+        """Gets SQL that follows the inserted rows in the statement.
+        
+        Any parameters in the suffix are added to `param_store`.
+        Plain inserts only have a RETURNING clause, if any.
+        """
+        return _get_returning_sql(self._returning)
+    
+    def _get_suffix_params(self):
+        """Gets the parameters used in the statement suffix."""
+        return ()
+    
+    def _construct_multirow_sql(self, num_rows):
+        """Builds an insert statement for a number of rows.
+        
+        :return: A tuple of the statement, the names of its row parameters in
+          order, and the parameters from the statement suffix. The names are
+          None for paramstyles that take a sequence.
+        """
+        num_columns = len(self._columns)
         
         params = get_param_store(self._db._dbapi.paramstyle)
-        values = [ Value(None) for _ in self._columns ]
+        values = [ Value(None) for _ in range(num_rows * num_columns) ]
         params.add_params(values)
         
-        statement = self._statement_base + " VALUES ({0})".format(",".join(v._get_ref_field(params) for v in values))
+        statement = self._statement_base + " VALUES " + \
+            _get_values_rows_sql(values, num_columns, params)
+        statement += self._get_statement_suffix(params)
         
-        param_data = []
-        for row in data:
-            for param, value in zip(values, row):
-                param.set_value(value)
-            param_data.append(params.get_dbapi_params())
+        if isinstance(params, MappedParamStore):
+            param_keys = [v._param_name for v in values]
+        else:
+            param_keys = None
         
-        cur.executemany(statement, param_data)
+        return (statement, param_keys, params.get_all_params()[len(values):])
+
+class Upsert(Insert):
+    """Represents an insert that updates rows which already exist.
+    
+    Rows are inserted in all of the same ways as for :class:`Insert`,
+    including multi-row and streaming inserts. Rows conflicting with an
+    existing row are instead handled by the conflict clause, which
+    updates the existing row or leaves it alone.
+    """
+    
+    def __init__(self, statement_base, table, columns, conflict_clause, db=None,
+            returning=[]):
+        """Initializes an upsert statement against a specific database.
+        
+        :param statement_base: The first part of the insert statement.
+        :param table: The table to insert into.
+        :param columns: The columns that data is being inserted in.
+        :param conflict_clause: The :class:`ConflictClause` for the upsert.
+        :param db: The database to perform the upsert on.
+        :param returning: Names of columns to return from upserted rows.
+        """
+        super().__init__(statement_base, table, columns, db=db, returning=returning)
+        self._conflict_clause = conflict_clause
+    
+    def show(self):
+        params = get_param_store(self._db._dbapi.paramstyle)
+        values = [ Value(None) for _ in self._columns ]
+        params.add_params(values)
+        
+        print(self._statement_base +
+            " VALUES ({0})".format(",".join(v._get_ref_field(params) for v in values)) +
+            self._get_statement_suffix(params))
+    
+    def _get_source_sql(self, query):
+        if self._db._dialect == "sqlite":
+            # SQLite can parse the ON of ON CONFLICT as a join constraint for
+            # the query's FROM clause, unless a WHERE clause comes between.
+            return "SELECT * FROM (\n{}\n) WHERE true".format(
+                query._get_statement())
+        return query._get_statement()
+    
+    def _get_statement_suffix(self, param_store):
+        param_store.add_params(self._conflict_clause._get_params())
+        return "\n" + self._conflict_clause._get_ref_field(param_store) + \
+            _get_returning_sql(self._returning)
+    
+    def _get_suffix_params(self):
+        return self._conflict_clause._get_params()
+
+class Excluded(ValueExpr):
+    """The value a row would have had if it did not conflict in an upsert.
+    
+    This is rendered as `excluded.column` for SQLite and Postgres, and
+    as `VALUES(column)` for MySQL and MariaDB.
+    """
+    
+    def __init__(self, column_name, dialect):
+        """
+        :param column_name: The name of the inserted column.
+        :param dialect: The SQL dialect of the upsert's database.
+        """
+        self._column_name = column_name
+        self._dialect = dialect
+    
+    def _get_name(self):
+        return self._column_name
+    
+    def _get_ref_field(self, param_store):
+        if self._dialect == "mysql":
+            return "VALUES({})".format(self._column_name)
+        else:
+            return "excluded.{}".format(self._column_name)
+    
+    def _get_select_field(self, param_store):
+        return self._get_ref_field(param_store)
+    
+    def _get_tables(self):
+        return set()
+
+class ConflictClause(object):
+    """The clause of an upsert saying what to do with conflicting rows."""
+    
+    def __init__(self, dialect, conflict_columns, updates):
+        """
+        :param dialect: The SQL dialect of the upsert's database.
+        :param conflict_columns: Names of the columns of the unique index
+          that rows conflict on. MySQL checks every unique index, so there
+          they are only used to build an update that leaves rows as they are.
+        :param updates: A list of pairs of a column name and an expression
+          to update that column to. Conflicting rows are left as they are
+          if this is empty.
+        """
+        self._dialect = dialect
+        self._conflict_columns = conflict_columns
+        self._updates = updates
+    
+    def _get_params(self):
+        params = []
+        for _, expr in self._updates:
+            params.extend(expr._get_params())
+        return params
+    
+    def _get_ref_field(self, param_store):
+        if self._dialect == "mysql":
+            if len(self._updates) < 1:
+                # MySQL has no DO NOTHING, so do an update without effect.
+                return "ON DUPLICATE KEY UPDATE {0} = {0}".format(
+                    self._conflict_columns[0])
+            return "ON DUPLICATE KEY UPDATE " + ", ".join(
+                "{0} = {1}".format(name, expr._get_ref_field(param_store))
+                for name, expr in self._updates)
+        else:
+            conflict_target = "ON CONFLICT ({})".format(
+                ",".join(self._conflict_columns))
+            if len(self._updates) > 0:
+                return conflict_target + " DO UPDATE SET " + ", ".join(
+                    "{0} = {1}".format(name, expr._get_ref_field(param_store))
+                    for name, expr in self._updates)
+            else:
+                return conflict_target + " DO NOTHING"
 
 class Update(Statement):
     """Represents a database update."""
     
-    def __init__(self, statement, params, db=None):
+    def __init__(self, statement, params, db=None, returning=[]):
         """Initializes an update statement against a specific database.
         
         :param statement: The SQL statement for the update.
         :param params: A list of literal values to pass into the statement.
         :param db: The database to perform the update on.
+        :param returning: Names of columns the statement returns, if it
+          has a RETURNING clause.
         """
         if db is None:
             raise UpdateError("Attempting to update without a database.")
@@ -111,19 +718,37 @@ class Update(Statement):
         self._db = db
         self._statement = statement
         self._params = params
+        self._returning = returning
+        self._return_type = _make_return_type(self, returning)
     
     def execute(self, conn=None):
+        """Runs this statement.
+        
+        :param conn: Optional connection to use to execute this statement.
+          A connection will be taken from the pool and committed if this
+          isn't provided.
+        
+        :return: The number of rows affected, as reported by the cursor.
+          If the statement has columns to return, a list of the returned
+          rows instead.
+        """
         manage_conn = conn is None
         if manage_conn:
-            conn = self._db.pool.get()
+            conn = self._db._connect_for_write()
         cur = conn.cursor()
         
         cur.execute(self._statement, self._params.get_dbapi_params())
+        if len(self._returning) > 0:
+            result = [ self._return_type._make(r) for r in cur.fetchall() ]
+        else:
+            result = cur.rowcount
         
         cur.close()
         if manage_conn:
             conn.commit()
             conn.close()
+        
+        return result
     
     def set_param(self, param_key, value):
         return self._params.set_param_value(param_key, value)
@@ -131,15 +756,227 @@ class Update(Statement):
     def show(self):
         print(self._statement, self._params, sep="\n")
 
+class BulkUpdate(Statement):
+    """Represents an update of many rows, each to its own values.
+    
+    Rows are matched on a set of key columns and have a set of value columns
+    updated. Each row of data provided lists the values of the key columns
+    followed by the new values of the value columns.
+    
+    Where the database supports `UPDATE ... FROM`, as Postgres and
+    SQLite 3.33.0 and later do, many rows are updated in one statement by
+    joining the table with a VALUES list of the new data. Otherwise a single
+    prepared update is run for every row through `cursor.executemany`.
+    
+    When several rows of a chunk have the same key, the last of them wins,
+    as it would if the rows were updated one at a time.
+    """
+    
+    def __init__(self, table, key_columns, value_columns, db=None):
+        """Initializes a bulk update against a specific database.
+        
+        :param table: The table to update rows of.
+        :param key_columns: Names of the columns identifying rows to update.
+        :param value_columns: Names of the columns to update.
+        :param db: The database to perform the update on.
+        """
+        if db is None:
+            raise UpdateError("Attempting to update without a database.")
+        
+        self._db = db
+        self._table = table
+        self._key_columns = key_columns
+        self._value_columns = value_columns
+        
+        # Statements for single rows and for full batches of rows,
+        # built on first use.
+        self._row_statement = None
+        self._values_batch = None
+    
+    def execute(self, data, conn=None, *, chunk_size=1000, on_chunk=None):
+        """Updates rows from data in the database.
+        
+        All rows are updated in a single transaction, which is committed
+        at the end if a connection is not provided.
+        
+        :param data: An iterable of rows, each a list or tuple of the key
+          column values followed by the value column values.
+        :param conn: Optional connection to use to execute this statement.
+          An update will get and put back a connection if this isn't provided.
+        :param chunk_size: Number of rows to take from `data` at a time.
+        :param on_chunk: Optional callable, called after each chunk with the
+          total number of rows processed so far.
+        
+        :return: The number of rows of data processed.
+        """
+        manage_conn = conn is None
+        if manage_conn:
+            conn = self._db._connect_for_write()
+        cur = conn.cursor()
+        
+        join_values = self._can_join_values()
+        if join_values:
+            batch_size = self._get_batch_size()
+            chunk_size = max(batch_size, chunk_size - chunk_size % batch_size)
+        
+        rows = iter(data)
+        row_count = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if len(chunk) < 1:
+                break
+            
+            if join_values:
+                self._update_values_chunk(chunk, cur)
+            else:
+                self._update_chunk(chunk, cur)
+            
+            row_count += len(chunk)
+            if on_chunk is not None:
+                on_chunk(row_count)
+        
+        cur.close()
+        if manage_conn:
+            conn.commit()
+            conn.close()
+        
+        return row_count
+    
+    def show(self):
+        if self._can_join_values():
+            print(self._construct_values_sql(1)[0])
+        else:
+            print(self._construct_row_sql()[0])
+    
+    def _can_join_values(self):
+        """Checks whether the database can update from a VALUES list."""
+        if self._db._dialect == "postgres":
+            return True
+        elif self._db._dialect == "sqlite":
+            return self._db._dbapi.sqlite_version_info >= (3, 33, 0)
+        else:
+            return False
+    
+    def _get_batch_size(self):
+        """Gets how many rows can be updated from one VALUES list."""
+        num_columns = len(self._key_columns) + len(self._value_columns)
+        return max(1, min(
+            self._db._param_limit // num_columns, _MAX_ROWS_PER_STATEMENT))
+    
+    def _update_chunk(self, chunk, cur):
+        if self._row_statement is None:
+            self._row_statement = self._construct_row_sql()
+        statement, param_keys = self._row_statement
+        
+        # Rows list keys first but the statement takes the new values first.
+        num_keys = len(self._key_columns)
+        param_data = [list(row[num_keys:]) + list(row[:num_keys]) for row in chunk]
+        if param_keys is not None:
+            param_data = [dict(zip(param_keys, row)) for row in param_data]
+        
+        cur.executemany(statement, param_data)
+    
+    def _update_values_chunk(self, chunk, cur):
+        batch_size = self._get_batch_size()
+        
+        # A row joined with several VALUES rows is updated from an arbitrary
+        # one of them, so keep only the last row for each key.
+        num_keys = len(self._key_columns)
+        chunk = list({ tuple(row[:num_keys]): row for row in chunk }.values())
+        
+        if self._values_batch is None:
+            self._values_batch = self._construct_values_sql(batch_size)
+        
+        _execute_values_batches(chunk, cur, batch_size, self._values_batch,
+            self._construct_values_sql)
+    
+    def _construct_row_sql(self):
+        """Builds an update statement for a single row.
+        
+        :return: A tuple of the statement and the names of its parameters in
+          order, which is None for paramstyles that take a sequence.
+        """
+        params = get_param_store(self._db._dbapi.paramstyle)
+        set_values = [ Value(None) for _ in self._value_columns ]
+        key_values = [ Value(None) for _ in self._key_columns ]
+        params.add_params(set_values)
+        params.add_params(key_values)
+        
+        statement = "UPDATE {0} SET {1} WHERE {2}".format(
+            self._table.name,
+            ", ".join("{0} = {1}".format(name, v._get_ref_field(params))
+                for name, v in zip(self._value_columns, set_values)),
+            " AND ".join("{0} = {1}".format(name, v._get_ref_field(params))
+                for name, v in zip(self._key_columns, key_values)))
+        
+        if isinstance(params, MappedParamStore):
+            param_keys = [v._param_name for v in set_values + key_values]
+        else:
+            param_keys = None
+        
+        return (statement, param_keys)
+    
+    def _construct_values_sql(self, num_rows):
+        """Builds an update from a VALUES list for a number of rows.
+        
+        :return: A tuple of the statement, the names of its parameters in
+          order and its other parameters, of which there are none. The
+          names are None for paramstyles that take a sequence.
+        """
+        column_names = self._key_columns + self._value_columns
+        
+        params = get_param_store(self._db._dbapi.paramstyle)
+        values = [ Value(None) for _ in range(num_rows * len(column_names)) ]
+        params.add_params(values)
+        
+        # Columns of a VALUES list are named column1, column2, ... in both
+        # SQLite and Postgres. Starting the statement with UPDATE rather than
+        # a WITH clause keeps it inside the sqlite3 module's transactions.
+        value_refs = { name: "v.column{0}".format(i + 1)
+            for i, name in enumerate(column_names) }
+        
+        values_sql = _get_values_rows_sql(values, len(column_names), params)
+        if self._db._dialect == "postgres":
+            # Postgres types each column of a VALUES list from its values,
+            # which makes a column of only NULLs text. A leading row of
+            # NULLs cast to the table's row type gives every column the
+            # type of the column it updates. It never matches a row.
+            typed_row = "({0})".format(",".join(
+                "(NULL::{0}).{1}".format(self._table.name, name)
+                for name in column_names))
+            values_sql = typed_row + "," + values_sql
+        
+        statement = (
+            "UPDATE {0} SET {1}\n"
+            "FROM (VALUES {2}) AS v\n"
+            "WHERE {3}"
+        ).format(
+            self._table.name,
+            ", ".join("{0} = {1}".format(name, value_refs[name])
+                for name in self._value_columns),
+            values_sql,
+            " AND ".join("{0}.{1} = {2}".format(
+                    self._table.name, name, value_refs[name])
+                for name in self._key_columns))
+        
+        if isinstance(params, MappedParamStore):
+            param_keys = [v._param_name for v in values]
+        else:
+            param_keys = None
+        
+        return (statement, param_keys, ())
+
 class Delete(Statement):
     """Represents a database delete."""
     
-    def __init__(self, statement, params, db=None):
+    def __init__(self, statement, params, db=None, returning=[]):
         """Initializes a delete statement against a specific database.
         
         :param statement: The SQL statement for the delete.
         :param params: A list of literal values to pass into the statement.
         :param db: The database to perform the delete on.
+        :param returning: Names of columns the statement returns, if it
+          has a RETURNING clause.
         """
         if db is None:
             raise DeleteError("Attempting to delete without a database.")
@@ -147,22 +984,169 @@ class Delete(Statement):
         self._db = db
         self._statement = statement
         self._params = params
+        self._returning = returning
+        self._return_type = _make_return_type(self, returning)
     
     def execute(self, conn=None):
+        """Runs this statement.
+        
+        :param conn: Optional connection to use to execute this statement.
+          A connection will be taken from the pool and committed if this
+          isn't provided.
+        
+        :return: The number of rows affected, as reported by the cursor.
+          If the statement has columns to return, a list of the returned
+          rows instead.
+        """
         manage_conn = conn is None
         if manage_conn:
-            conn = self._db.pool.get()
+            conn = self._db._connect_for_write()
         cur = conn.cursor()
         
         cur.execute(self._statement, self._params.get_dbapi_params())
+        if len(self._returning) > 0:
+            result = [ self._return_type._make(r) for r in cur.fetchall() ]
+        else:
+            result = cur.rowcount
         
         cur.close()
         if manage_conn:
             conn.commit()
             conn.close()
+        
+        return result
     
     def set_param(self, param_key, value):
         return self._params.set_param_value(param_key, value)
     
     def show(self):
         print(self._statement, self._params, sep="\n")
+
+class KeyedBatch(object):
+    """Runs an update or delete in chunks of rows, ordered by a key column.
+    
+    Each chunk is run and committed in its own transaction, so that locks are
+    only held for a chunk at a time. Chunks are either ranges of the key,
+    found by selecting the next keys of the rows the statement applies to,
+    or slices of a list of keys provided to `execute`.
+    
+    The last key of each committed chunk is kept in `last_key`. After a
+    failure, calling `execute` again resumes after that key.
+    """
+    
+    def __init__(self, key_column, get_statement, get_key_query, db=None, *,
+            chunk_size=1000, pause=0, start_after=None):
+        """
+        :param key_column: The column to order and split rows by.
+        :param get_statement: Callable taking extra conditions and returning
+          the statement to run for rows matching them.
+        :param get_key_query: Callable taking extra conditions and returning
+          a query for the keys of rows the statement applies to, in order.
+        :param db: The database to run the statement against.
+        :param chunk_size: The number of rows to include in each chunk.
+        :param pause: Seconds to sleep between chunks, to leave room for
+          other work on the database.
+        :param start_after: Optional key to start after, for resuming a run
+          from an earlier process.
+        """
+        if db is None:
+            raise BuilderError("Attempting to batch a statement without a database.")
+        
+        self._db = db
+        self._key_column = key_column
+        self._get_statement = get_statement
+        self._get_key_query = get_key_query
+        self._chunk_size = chunk_size
+        self._pause = pause
+        
+        self.last_key = start_after
+        self.chunk_row_counts = []
+        
+        self._low = Value(None, param_name="_batch_low")
+        self._high = Value(None, param_name="_batch_high")
+        # Statements and key queries for the first range, which has no lower
+        # bound, and for all ranges after it. These are built on first use.
+        self._range_statements = None
+    
+    def execute(self, keys=None, *, on_chunk=None):
+        """Runs the statement for all remaining chunks.
+        
+        :param keys: Optional iterable of keys to run the statement for,
+          in ascending order. The statement's own conditions still apply.
+          Without this, chunks are ranges of the key column.
+        :param on_chunk: Optional callable, called after each chunk is
+          committed with the rows affected by the chunk and its last key.
+        
+        :return: The total number of rows affected.
+        """
+        if keys is None:
+            chunks = self._get_range_chunks()
+        else:
+            chunks = self._get_key_list_chunks(keys)
+        
+        total_row_count = 0
+        for chunk_number, (statement, last_key) in enumerate(chunks):
+            if chunk_number > 0 and self._pause > 0:
+                time.sleep(self._pause)
+            
+            conn = self._db._connect_for_write()
+            try:
+                row_count = statement.execute(conn=conn)
+                conn.commit()
+            finally:
+                conn.close()
+            
+            self.last_key = last_key
+            self.chunk_row_counts.append(row_count)
+            total_row_count += row_count
+            if on_chunk is not None:
+                on_chunk(row_count, last_key)
+        
+        return total_row_count
+    
+    def _get_range_chunks(self):
+        """Yields a statement for each range of keys and the key ending it."""
+        if self._range_statements is None:
+            key = self._key_column
+            self._range_statements = (
+                (self._get_statement([key <= self._high]),
+                    self._get_key_query([])),
+                (self._get_statement([key > self._low, key <= self._high]),
+                    self._get_key_query([key > self._low]))
+            )
+        
+        while True:
+            if self.last_key is None:
+                statement, key_query = self._range_statements[0]
+            else:
+                statement, key_query = self._range_statements[1]
+                statement.set_param("_batch_low", self.last_key)
+                key_query.set_param("_batch_low", self.last_key)
+            
+            rows = key_query.execute(limit=self._chunk_size)
+            if len(rows) < 1:
+                return
+            
+            high = rows[-1][0]
+            statement.set_param("_batch_high", high)
+            yield (statement, high)
+    
+    def _get_key_list_chunks(self, keys):
+        """Yields a statement for each slice of keys and the key ending it."""
+        keys = iter(keys)
+        if self.last_key is not None:
+            last_key = self.last_key
+            keys = dropwhile(lambda k: k <= last_key, keys)
+        
+        # Each key is a parameter of its own, next to the parameters of the
+        # statement's values and other conditions.
+        param_limit = self._db._param_limit - \
+            len(self._get_statement([])._params.get_all_params())
+        chunk_size = max(1, min(self._chunk_size, param_limit))
+        
+        while True:
+            chunk = list(islice(keys, chunk_size))
+            if len(chunk) < 1:
+                return
+            
+            yield (self._get_statement([InValues_(self._key_column, chunk)]), chunk[-1])
@@ -1,7 +1,7 @@
 from .query_components import TableExpression
 from .expressions import ValueExpr
-from .column_collection import ColumnCollection
-from ..exceptions import QueryError
+from .column_collection import ColumnCollection, _DerivedColumnCollection
+from ..exceptions import QueryError, MissingColumnError
 
 class _JoinColumn(ValueExpr):
     """A column used through a join expression."""
@@ -22,15 +22,19 @@ class _JoinColumn(ValueExpr):
     def _get_tables(self):
         return set((self._join_expr,))
 
-class _JoinedTable(ColumnCollection):
-    """A table that is one side of a join expression."""
+class _JoinedTable(_DerivedColumnCollection):
+    """A table that is one side of a join expression.
+    
+    Join columns wrapping the table's columns are created as they are used.
+    """
     
     def __init__(self, join_expr, table):
+        super().__init__(table.columns)
         self._join_expr = join_expr
         self._table = table
         
-        join_columns = [_JoinColumn(join_expr, column) for column in table._get_selectables()]
-        super().__init__(join_columns)
+    def _make_column(self, name):
+        return _JoinColumn(self._join_expr, self._table.get_column(name))
     
     def _get_tables(self):
         return {self._join_expr}
@@ -38,24 +42,77 @@ class _JoinedTable(ColumnCollection):
     def _get_from_field(self, param_store):
         return self._table._get_from_field(param_store)
     
-    def _get_joined_tables(self):
-        if isinstance(self._table, _Join):
-            return self._table._get_all_tables()
-        else:
-            return [self._table]
+class _JoinColumnCollection(ColumnCollection):
+    """The columns from both sides of a join expression."""
+    
+    def __init__(self, join_expr):
+        self._join_expr = join_expr
+        self._columns = {}
+        self._column_names = None
+        self._name_set = None
+    
+    def _make_column(self, name):
+        return self._join_expr._get_column(name)
+    
+    def _get_tables(self):
+        return {self._join_expr}
+    
+    def _get_selectables(self):
+        # Names on both sides resolve to the left column when looked up,
+        # so each side provides its own columns.
+        return self._join_expr._get_selectables()
+    
+    def get_names(self):
+        if self._column_names is None:
+            self._column_names = (
+                self._join_expr._left.get_names() +
+                self._join_expr._right.get_names())
+        return self._column_names
 
 class _Join(TableExpression):
-    """Represents a join of two table expressions."""
+    """Represents a join of two table expressions.
+    
+    Creating a join takes constant time regardless of how many joins are
+    nested inside of it. The lookup of joined tables by name and the name
+    of the join are only worked out when first needed.
+    """
     
     def __init__(self, left, right):
         """Creates a join for the left and right expressions."""
         self._left = _JoinedTable(self, left)
         self._right = _JoinedTable(self, right)
-        all_tables = self._get_all_tables()
-        self._tables = {table.get_name(): _JoinedTable(self, table)
-            for table in all_tables}
-        self._name = "jn_" + "_".join(
-            table.get_name() for table in all_tables)
+        self._all_tables = None
+        self._tables = None
+        self._name = None
+        self._hash = None
+        self._columns = _JoinColumnCollection(self)
+    
+    @classmethod
+    def chain(cls, first, *joins, using=None):
+        """Joins several table expressions from left to right.
+        
+        For qualified joins each of `joins` is a pair of the table expression
+        to join and the list of ON conditions for joining it. A USING list
+        can be given instead, in which case each of `joins` is just a table
+        expression and the same USING list applies to every join in the chain.
+        For cross joins each of `joins` is also just a table expression.
+        
+        :param first: The leftmost table expression.
+        :param joins: The table expressions to join onto the result, in order.
+        :param using: Column names for a USING condition on every join.
+        
+        :return: The last, outermost join in the chain.
+        """
+        result = first
+        for join in joins:
+            if using is not None:
+                result = cls(result, join, using=using)
+            elif issubclass(cls, _QualifiedJoin):
+                table, on = join
+                result = cls(result, table, on=on)
+            else:
+                result = cls(result, join)
+        return result
     
     @property
     def left(self):
@@ -67,16 +124,29 @@ class _Join(TableExpression):
     
     @property
     def tables(self):
+        if self._tables is None:
+            self._tables = {table.get_name(): _JoinedTable(self, table)
+                for table in self._get_all_tables()}
         return self._tables
     
+    @property
+    def columns(self):
+        """A :class:`.ColumnCollection` of the columns from both sides of the join."""
+        return self._columns
+    
     def get_column(self, key):
         return self._get_column(key)
     
     def get_name(self):
+        if self._name is None:
+            self._name = "jn_" + "_".join(
+                table.get_name() for table in self._get_all_tables())
         return self._name
     
     def __hash__(self):
-        return hash((self._left._table, self._right._table))
+        if self._hash is None:
+            self._hash = hash((self._left._table, self._right._table))
+        return self._hash
     
     def __eq__(self, other):
         if (isinstance(other, self.__class__)):
@@ -96,14 +166,26 @@ class _Join(TableExpression):
     def __getitem__(self, key):
         try:
             return self._get_column(key)
-        except MissingColumnExceptio:
+        except MissingColumnError:
             raise KeyError
     
     def _get_all_tables(self):
-        all_tables = []
-        all_tables.extend(self._left._get_joined_tables())
-        all_tables.extend(self._right._get_joined_tables())
-        return all_tables
+        if self._all_tables is None:
+            # Walks nested joins with a stack to avoid recursing once for
+            # each join in long chains.
+            all_tables = []
+            pending = [self._right._table, self._left._table]
+            while len(pending) > 0:
+                table = pending.pop()
+                if not isinstance(table, _Join):
+                    all_tables.append(table)
+                elif table._all_tables is not None:
+                    all_tables.extend(table._all_tables)
+                else:
+                    pending.append(table._right._table)
+                    pending.append(table._left._table)
+            self._all_tables = all_tables
+        return self._all_tables
     
     def _get_selectables(self):
         selectables = []
@@ -124,9 +206,9 @@ class _Join(TableExpression):
         if not isinstance(key, str):
             raise TypeError("Tables require strings for lookup keys.")
         
-        if key in self._left._columns:
+        if key in self._left:
             return self._left.get_column(key)
-        elif key in self._right._columns:
+        elif key in self._right:
             return self._right.get_column(key)
         else:
             raise MissingColumnError(key, self)
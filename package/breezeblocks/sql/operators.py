@@ -80,6 +80,28 @@ class In_(_SubqueryOperator):
         return "({}) IN {}".format(
             self._l_expr._get_ref_field(param_store), self._r_query._get_from_field(param_store))
 
+class InValues_(_Operator):
+    """SQL `IN` operator against a list of values."""
+    
+    def __init__(self, l_expr, values):
+        self._l_expr = _fix_expression(l_expr)
+        self._values = [ _fix_expression(v) for v in values ]
+    
+    def _get_ref_field(self, param_store):
+        return "({}) IN ({})".format(
+            self._l_expr._get_ref_field(param_store),
+            ", ".join(v._get_ref_field(param_store) for v in self._values))
+    
+    def _get_params(self):
+        params = []
+        params.extend(self._l_expr._get_params())
+        for value in self._values:
+            params.extend(value._get_params())
+        return params
+    
+    def _get_tables(self):
+        return self._l_expr._get_tables()
+
 class Between_(_Operator):
     """SQL `BETWEEN` operator.
     
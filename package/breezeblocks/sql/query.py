@@ -63,7 +63,7 @@ class Query(Statement, TableExpression):
         
         manage_conn = conn is None
         if manage_conn:
-            conn = self._db.pool.get()
+            conn = self._db._connect_for_read()
         cur = conn.cursor()
         
         cur.execute(statement, self._params.get_dbapi_params())
@@ -110,7 +110,7 @@ class Query(Statement, TableExpression):
         return self._return_type._make(r)
     
     def _get_column(self, name):
-        return self._columns.get_column(key)
+        return self._columns.get_column(name)
     
     def _get_from_field(self, param_store):
         return "({})".format(self._statement)
@@ -132,7 +132,7 @@ class Query(Statement, TableExpression):
     
     def __getitem__(self, key):
         try:
-            return self._get_column(name)
+            return self._get_column(key)
         except MissingColumnError:
             raise KeyError
 
@@ -2,7 +2,7 @@ from ..exceptions import MissingColumnError
 
 from .query_components import TableExpression
 from .column import ColumnExpr
-from .column_collection import ColumnCollection
+from .column_collection import ColumnCollection, _DerivedColumnCollection
 
 class Table(TableExpression):
     """Represents a database table."""
@@ -102,11 +102,27 @@ class Table(TableExpression):
 
 class _TableColumnCollection(ColumnCollection):
     def __init__(self, table, column_names):
-        columns = [ColumnExpr(name, table) for name in column_names]
-        super().__init__(columns)
+        # Column objects are created the first time they are used.
+        super().__init__([])
+        self._column_names = tuple(column_names)
         
         self._table = table
     
+    def _make_column(self, name):
+        return ColumnExpr(name, self._table)
+    
+    def _get_tables(self):
+        return {self._table}
+
+class _AliasedTableColumnCollection(_DerivedColumnCollection):
+    def __init__(self, table, source):
+        super().__init__(source)
+        
+        self._table = table
+    
+    def _make_column(self, name):
+        return ColumnExpr(name, self._table)
+    
     def _get_tables(self):
         return {self._table}
 
@@ -118,15 +134,14 @@ class AliasedTableExpression(TableExpression):
         self._table_expr = table_expr
         self.name = alias
         
-        # Add the underlying table's columns.
-        column_names = [col._get_name() for col in table_expr._get_selectables()]
-        self._columns = _TableColumnCollection(self, column_names)
+        # Use the underlying table's column names.
+        self._columns = _AliasedTableColumnCollection(self, table_expr.columns)
     
     def __hash__(self):
         return hash((self.name, self._table_expr))
     
     def __eq__(self, other):
-        if isinstance(other, AliasedTable):
+        if isinstance(other, AliasedTableExpression):
             return self.name == other.name and self._table_expr == other._table_expr
         else:
             return False
@@ -140,7 +155,7 @@ class AliasedTableExpression(TableExpression):
     def __getitem__(self, key):
         try:
             return self._get_column(key)
-        except MissingColumnExceptio:
+        except MissingColumnError:
             raise KeyError
     
     def _get_column(self, name):
@@ -0,0 +1,302 @@
+"""Buffers rows in memory and writes them to the database in the background.
+
+Inserting rows one at a time, each with its own connection checkout and
+commit, is slow when rows arrive thousands of times a second. A
+:class:`WriteBuffer` collects rows from any number of threads and a
+background thread flushes them through a single multi-row insert on a
+connection kept for the buffer.
+"""
+import threading
+import time
+from collections.abc import Mapping
+
+from .exceptions import InsertError
+
+class WriteBuffer(object):
+    """Collects rows for a table and writes them in batches.
+    
+    A flush happens whenever `flush_rows` rows are waiting, at least every
+    `flush_interval` seconds while rows are waiting, and when `flush` or
+    `close` is called. Each flush is committed before the rows are counted
+    as written.
+    
+    With `key` columns, the buffer keeps only the latest row for each key
+    and writes rows as an upsert on those columns, so rows that are changed
+    many times between flushes are written only once.
+    
+    With `max_depth`, rows that would take the buffer past that many
+    waiting rows either wait for a flush to make room or are refused,
+    so a database that is slow or down does not let the buffer grow
+    without bound.
+    
+    Rows are written from a background thread. With sqlite3, the database
+    must be opened with `check_same_thread=False` in its `connect_kwargs`.
+    """
+    
+    def __init__(self, db, table, columns, *,
+            flush_rows=1000, flush_interval=1.0, key=None,
+            max_depth=None, on_full="block"):
+        """
+        :param db: The database to write to.
+        :param table: The table to write rows into.
+        :param columns: Names of the columns the rows hold values for,
+          in the order the values appear in each row.
+        :param flush_rows: The number of buffered rows that triggers a flush.
+        :param flush_interval: Most seconds that rows wait before a flush.
+        :param key: Optional names of columns identifying rows. Rows with
+          the same key replace each other in the buffer.
+        :param max_depth: Most rows that may wait in the buffer. Optional.
+        :param on_full: What to do with rows added to a full buffer.
+          "block" waits until a flush makes room for them, and "raise"
+          raises an :class:`.InsertError` without adding any of them.
+        """
+        if on_full not in ("block", "raise"):
+            raise ValueError("Unknown full buffer action '{}'.".format(on_full))
+        
+        self._db = db
+        self._columns = list(columns)
+        self._flush_interval = flush_interval
+        self._max_depth = max_depth
+        self._block_when_full = on_full == "block"
+        # A full buffer is flushed right away, to make room for new rows.
+        if max_depth is not None:
+            flush_rows = min(flush_rows, max_depth)
+        self._flush_rows = flush_rows
+        
+        if key is None:
+            self._key_indexes = None
+            self._insert = db.insert(table, self._columns).get()
+            self._rows = []
+        else:
+            if isinstance(key, str):
+                key = [key]
+            self._key_indexes = [ self._columns.index(name) for name in key ]
+            self._insert = db.upsert(table, self._columns)\
+                .on_conflict(*key).get()
+            self._rows = {}
+        
+        # Guards the buffered rows. It wakes the background thread when a
+        # flush is due, and threads waiting for room when a flush starts.
+        self._cond = threading.Condition()
+        # Held while writing, so that flushes commit in the order they
+        # took rows from the buffer.
+        self._flush_lock = threading.Lock()
+        # The buffer's connection is used from the background thread, so it
+        # must not be one pinned by the calling thread. It is held for the
+        # buffer's whole life, so leak detection does not apply to it. It
+        # is replaced after a failed flush.
+        self._conn = db._checkout_for_write(track_leaks=False)
+        self._closed = False
+        # The number of threads waiting for room in a full buffer.
+        self._waiting_adds = 0
+        
+        self._rows_added = 0
+        self._rows_written = 0
+        self._flush_count = 0
+        self._failed_flush_count = 0
+        self._last_flush_time = time.monotonic()
+        self._last_error = None
+        
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    @property
+    def depth(self):
+        """The number of rows waiting to be written."""
+        with self._cond:
+            return len(self._rows)
+    
+    def add(self, row):
+        """Adds a row to be written.
+        
+        :param row: A list or tuple of values in the order of the buffer's
+          columns, or a mapping of column names to values.
+        """
+        self.add_rows([row])
+    
+    def add_rows(self, rows):
+        """Adds several rows to be written.
+        
+        :param rows: An iterable of rows, as for `add`.
+        """
+        rows = [ self._get_row_tuple(row) for row in rows ]
+        
+        with self._cond:
+            while not self._closed and not self._has_room(len(rows)):
+                if not self._block_when_full:
+                    raise InsertError("The write buffer is full.")
+                self._waiting_adds += 1
+                self._cond.notify_all()
+                self._cond.wait()
+                self._waiting_adds -= 1
+            
+            if self._closed:
+                raise InsertError("Attempting to add rows to a closed write buffer.")
+            
+            if self._key_indexes is None:
+                self._rows.extend(rows)
+            else:
+                for row in rows:
+                    self._rows[self._get_key(row)] = row
+            self._rows_added += len(rows)
+            
+            if len(self._rows) >= self._flush_rows:
+                self._cond.notify_all()
+    
+    def flush(self):
+        """Writes all buffered rows and commits them.
+        
+        Any error from writing is raised here, and the rows are kept in the
+        buffer to be written again. The buffer's connection is closed, and
+        the next flush writes through a new one.
+        
+        :return: The number of rows written.
+        """
+        with self._flush_lock:
+            with self._cond:
+                rows = self._rows
+                if self._key_indexes is None:
+                    self._rows = []
+                else:
+                    self._rows = {}
+                self._last_flush_time = time.monotonic()
+                # Let threads waiting for room add their rows.
+                self._cond.notify_all()
+            
+            if len(rows) < 1:
+                return 0
+            
+            if self._key_indexes is not None:
+                data = list(rows.values())
+            else:
+                data = rows
+            
+            try:
+                if self._conn is None:
+                    self._conn = self._db._checkout_for_write(track_leaks=False)
+                self._insert.execute(data, conn=self._conn, multirow=True)
+                self._conn.commit()
+            except Exception as e:
+                self._drop_conn()
+                self._restore_rows(rows)
+                with self._cond:
+                    self._failed_flush_count += 1
+                    self._last_error = e
+                raise
+            
+            with self._cond:
+                self._rows_written += len(data)
+                self._flush_count += 1
+            return len(data)
+    
+    def close(self):
+        """Stops the background thread, writes remaining rows, and gives
+        back the buffer's connection.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        
+        try:
+            self.flush()
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+    
+    def stats(self):
+        """Gets a snapshot of the buffer's counters.
+        
+        :return: A dictionary with the number of rows waiting (`depth`),
+          rows added and written, flushes done and failed, seconds since
+          the last flush, and the last error raised by a flush.
+        """
+        with self._cond:
+            return {
+                "depth": len(self._rows),
+                "rows_added": self._rows_added,
+                "rows_written": self._rows_written,
+                "flushes": self._flush_count,
+                "failed_flushes": self._failed_flush_count,
+                "seconds_since_flush": time.monotonic() - self._last_flush_time,
+                "last_error": self._last_error
+            }
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+    
+    def _run(self):
+        """Flushes rows in the background until the buffer is closed."""
+        while True:
+            with self._cond:
+                while not self._closed and not self._is_flush_due():
+                    if len(self._rows) > 0:
+                        timeout = self._last_flush_time + self._flush_interval \
+                            - time.monotonic()
+                    else:
+                        timeout = self._flush_interval
+                    self._cond.wait(max(timeout, 0))
+                
+                if self._closed:
+                    return
+            
+            try:
+                self.flush()
+            except Exception:
+                # The error is kept in the stats. Wait out an interval
+                # before trying again, however many rows are waiting.
+                with self._cond:
+                    retry_time = time.monotonic() + self._flush_interval
+                    while not self._closed and time.monotonic() < retry_time:
+                        self._cond.wait(retry_time - time.monotonic())
+    
+    def _has_room(self, row_count):
+        """Checks whether rows can be added without passing `max_depth`.
+        
+        An empty buffer always takes the rows, so that a batch larger than
+        `max_depth` does not wait forever.
+        """
+        if self._max_depth is None or len(self._rows) < 1:
+            return True
+        return len(self._rows) + row_count <= self._max_depth
+    
+    def _is_flush_due(self):
+        if len(self._rows) >= self._flush_rows or self._waiting_adds > 0:
+            return True
+        return len(self._rows) > 0 and \
+            time.monotonic() - self._last_flush_time >= self._flush_interval
+    
+    def _get_row_tuple(self, row):
+        if isinstance(row, Mapping):
+            return tuple(row[name] for name in self._columns)
+        return tuple(row)
+    
+    def _get_key(self, row):
+        return tuple(row[i] for i in self._key_indexes)
+    
+    def _drop_conn(self):
+        """Closes the connection after a failed flush.
+        
+        The connection may be broken, and closing it also discards the
+        failed transaction without a rollback that could raise an error of
+        its own.
+        """
+        conn = self._conn
+        self._conn = None
+        if conn is not None:
+            conn._discard()
+    
+    def _restore_rows(self, rows):
+        """Puts rows from a failed flush back in front of newer rows."""
+        with self._cond:
+            if self._key_indexes is None:
+                self._rows[:0] = rows
+            else:
+                # Newer rows for the same key take precedence.
+                rows.update(self._rows)
+                self._rows = rows
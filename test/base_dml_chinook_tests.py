@@ -1,3 +1,5 @@
+from collections import namedtuple
+
 from breezeblocks import Table
 from breezeblocks.sql.operators import Equal_, Like_, Or_
 from breezeblocks.sql import Value
@@ -32,6 +34,140 @@ class BaseDMLChinookTests(object):
         self.assertEqual(len(rows), 1)
         self.assertEqual(rows[0].Name, 'Weezer')
     
+    def test_insertMultirowValues(self):
+        t_playlist = self.tables['Playlist']
+        conn = self.db.pool.get()
+        
+        i = self.db.insert(t_playlist).add_columns('Name').get()
+        # Enough rows for several full statements and a partial one.
+        i.execute([('Multirow {}'.format(n),) for n in range(2500)],
+            conn=conn, multirow=True)
+        
+        q = self.db.query(t_playlist.columns['Name'])\
+            .where(Like_(t_playlist.columns['Name'], 'Multirow %'))\
+            .get()
+        
+        rows = q.execute(conn=conn)
+        self.assertEqual(len(rows), 2500)
+    
+    def test_insertFromGenerator(self):
+        t_playlist = self.tables['Playlist']
+        conn = self.db.pool.get()
+        
+        def generate_rows():
+            for n in range(250):
+                yield ('Streamed {}'.format(n),)
+        
+        progress = []
+        i = self.db.insert(t_playlist).add_columns('Name').get()
+        row_count = i.execute(generate_rows(), conn=conn,
+            chunk_size=100, on_chunk=progress.append)
+        
+        self.assertEqual(row_count, 250)
+        self.assertEqual(progress, [100, 200, 250])
+        
+        q = self.db.query(t_playlist.columns['Name'])\
+            .where(Like_(t_playlist.columns['Name'], 'Streamed %'))\
+            .get()
+        self.assertEqual(len(q.execute(conn=conn)), 250)
+    
+    def test_insertMappingsAndColumns(self):
+        t_artist = self.tables['Artist']
+        conn = self.db.pool.get()
+        
+        max_artist_id = self.db.query(t_artist.columns['ArtistId'])\
+            .order_by(t_artist.columns['ArtistId'], ascending=False)\
+            .get().execute(limit=1, conn=conn)[0].ArtistId
+        
+        ArtistRow = namedtuple('ArtistRow', ['Name', 'ArtistId'])
+        i = self.db.insert(t_artist, ['ArtistId', 'Name']).get()
+        i.execute([
+            {'Name': 'Mapped Artist', 'ArtistId': max_artist_id + 1},
+            {'Name': 'Mapped Artist', 'ArtistId': max_artist_id + 2}
+        ], conn=conn)
+        i.execute([ArtistRow('Mapped Artist', max_artist_id + 3)], conn=conn)
+        i.execute({
+            'ArtistId': [max_artist_id + 4, max_artist_id + 5],
+            'Name': ['Mapped Artist', 'Mapped Artist']
+        }, conn=conn)
+        
+        q = self.db.query(t_artist.columns['ArtistId'])\
+            .where(Equal_(t_artist.columns['Name'], 'Mapped Artist'))\
+            .order_by(t_artist.columns['ArtistId']).get()
+        self.assertEqual([row.ArtistId for row in q.execute(conn=conn)],
+            list(range(max_artist_id + 1, max_artist_id + 6)))
+    
+    def test_upsert(self):
+        t_genre = self.tables['Genre']
+        conn = self.db.pool.get()
+        
+        max_genre_id = self.db.query(t_genre.columns['GenreId'])\
+            .order_by(t_genre.columns['GenreId'], ascending=False)\
+            .get().execute(limit=1, conn=conn)[0].GenreId
+        
+        u = self.db.upsert(t_genre, ['GenreId', 'Name'])\
+            .on_conflict('GenreId').get()
+        u.execute([
+            (1, 'Rock & Roll'),
+            (max_genre_id + 1, 'Chiptune')
+        ], conn=conn, multirow=True)
+        
+        q = self.db.query(t_genre.columns['Name'])\
+            .where(Or_(
+                t_genre.columns['GenreId'] == 1,
+                t_genre.columns['GenreId'] == max_genre_id + 1
+            ))\
+            .order_by(t_genre.columns['GenreId']).get()
+        
+        self.assertEqual([row.Name for row in q.execute(conn=conn)],
+            ['Rock & Roll', 'Chiptune'])
+    
+    def test_upsertDoNothing(self):
+        t_genre = self.tables['Genre']
+        conn = self.db.pool.get()
+        
+        q = self.db.query(t_genre.columns['Name'])\
+            .where(t_genre.columns['GenreId'] == 1).get()
+        name = q.execute(conn=conn)[0].Name
+        
+        u = self.db.upsert(t_genre, ['GenreId', 'Name'])\
+            .on_conflict('GenreId').do_nothing().get()
+        u.execute([(1, 'Not ' + name)], conn=conn)
+        
+        self.assertEqual(q.execute(conn=conn)[0].Name, name)
+    
+    def test_upsertFromQuery(self):
+        t_genre = self.tables['Genre']
+        conn = self.db.pool.get()
+        
+        source = self.db.query(
+            t_genre.columns['GenreId'], Value('Renamed').as_('Name')).get()
+        
+        u = self.db.upsert(t_genre, ['GenreId', 'Name'])\
+            .on_conflict('GenreId').get()
+        u.execute(source, conn=conn)
+        
+        q = self.db.query(t_genre.columns['Name']).get()
+        self.assertEqual({row.Name for row in q.execute(conn=conn)},
+            {'Renamed'})
+    
+    def test_insertReturning(self):
+        t_playlist = self.tables['Playlist']
+        conn = self.db.pool.get()
+        
+        i = self.db.insert(t_playlist, ['Name'])\
+            .returning('PlaylistId', t_playlist.columns['Name']).get()
+        rows = i.execute(
+            (('Returning Playlist {}'.format(n),) for n in range(3)), conn=conn)
+        
+        self.assertEqual([row.Name for row in rows],
+            ['Returning Playlist {}'.format(n) for n in range(3)])
+        
+        q = self.db.query(t_playlist.columns['Name'])\
+            .where(Equal_(t_playlist.columns['PlaylistId'], rows[-1].PlaylistId))\
+            .get()
+        self.assertEqual(q.execute(conn=conn)[0].Name, 'Returning Playlist 2')
+    
     def test_insertIntoSelect(self):
         t_genre = self.tables['Genre']
         t_track = self.tables['Track']
@@ -91,6 +227,48 @@ class BaseDMLChinookTests(object):
         for row in q.execute(conn=conn):
             self.assertEqual(row.GenreId, genre_id)
     
+    def test_bulkUpdate(self):
+        t_genre = self.tables['Genre']
+        conn = self.db.pool.get()
+        
+        u = self.db.bulk_update(t_genre, ['GenreId'], ['Name']).get()
+        row_count = u.execute(
+            ((genre_id, 'Genre {}'.format(genre_id)) for genre_id in (1, 2, 3)),
+            conn=conn, chunk_size=2)
+        self.assertEqual(row_count, 3)
+        
+        q = self.db.query(t_genre.columns['Name'])\
+            .where(t_genre.columns['GenreId'] < 5)\
+            .order_by(t_genre.columns['GenreId']).get()
+        names = [row.Name for row in q.execute(conn=conn)]
+        self.assertEqual(names[:3], ['Genre 1', 'Genre 2', 'Genre 3'])
+        self.assertNotEqual(names[3], 'Genre 4')
+    
+    def test_bulkUpdateLastRowWins(self):
+        t_genre = self.tables['Genre']
+        conn = self.db.pool.get()
+        
+        u = self.db.bulk_update(t_genre, ['GenreId'], ['Name']).get()
+        u.execute([(1, 'First'), (2, 'Second'), (1, 'Third')], conn=conn)
+        
+        q = self.db.query(t_genre.columns['Name'])\
+            .where(t_genre.columns['GenreId'] < 3)\
+            .order_by(t_genre.columns['GenreId']).get()
+        self.assertEqual([row.Name for row in q.execute(conn=conn)],
+            ['Third', 'Second'])
+    
+    def test_bulkUpdateToNull(self):
+        t_track = self.tables['Track']
+        conn = self.db.pool.get()
+        
+        u = self.db.bulk_update(t_track, ['TrackId'], ['GenreId']).get()
+        u.execute([(1, None), (2, None)], conn=conn)
+        
+        q = self.db.query(t_track.columns['GenreId'])\
+            .where(t_track.columns['TrackId'] < 3).get()
+        self.assertEqual([row.GenreId for row in q.execute(conn=conn)],
+            [None, None])
+    
     def test_delete(self):
         conn = self.db.pool.get()
         
@@ -109,6 +287,50 @@ class BaseDMLChinookTests(object):
         # All corresponding rows should have been deleted on this connection
         self.assertEqual(len(rows), 0)
     
+    def test_deleteReturning(self):
+        t_album = self.tables['Album']
+        conn = self.db.pool.get()
+        
+        expected_ids = [row.AlbumId for row in
+            self.db.query(t_album.columns['AlbumId'])\
+                .where(Like_(t_album.columns['Title'], 'Lost, Season%'))\
+                .order_by(t_album.columns['AlbumId']).get().execute(conn=conn)]
+        
+        rows = self.db.delete(t_album)\
+            .where(Like_(t_album.columns['Title'], 'Lost, Season%'))\
+            .returning('AlbumId').get().execute(conn=conn)
+        
+        self.assertEqual(sorted(row.AlbumId for row in rows), expected_ids)
+    
+    def test_deleteBatched(self):
+        t_artist = self.tables['Artist']
+        
+        # Batched runs commit each chunk, so work only on rows added here.
+        max_artist_id = self.db.query(t_artist.columns['ArtistId'])\
+            .order_by(t_artist.columns['ArtistId'], ascending=False)\
+            .get().execute(limit=1)[0].ArtistId
+        new_ids = list(range(max_artist_id + 1, max_artist_id + 6))
+        self.db.insert(t_artist, ['ArtistId', 'Name']).get()\
+            .execute([(artist_id, 'Batch Artist') for artist_id in new_ids])
+        
+        batch = self.db.delete(t_artist)\
+            .where(Equal_(t_artist.columns['Name'], 'Batch Artist'))\
+            .get_batched('ArtistId', chunk_size=2)
+        
+        row_count = batch.execute(keys=new_ids[:2])
+        self.assertEqual(row_count, 2)
+        self.assertEqual(batch.last_key, new_ids[1])
+        
+        chunks = []
+        row_count = batch.execute(on_chunk=lambda n, key: chunks.append((n, key)))
+        self.assertEqual(row_count, 3)
+        self.assertEqual(chunks, [(2, new_ids[3]), (1, new_ids[4])])
+        self.assertEqual(batch.chunk_row_counts, [2, 2, 1])
+        
+        q = self.db.query(t_artist.columns['ArtistId'])\
+            .where(Equal_(t_artist.columns['Name'], 'Batch Artist')).get()
+        self.assertEqual(len(q.execute()), 0)
+    
     def test_setUpdateParamValue(self):
         t_genre = self.tables['Genre']
         t_album = self.tables['Album']
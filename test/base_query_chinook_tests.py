@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 from breezeblocks import Table
 from breezeblocks.exceptions import QueryError
 from breezeblocks.sql.aggregates import Count_, RecordCount
@@ -268,6 +271,18 @@ class BaseQueryChinookTests(object):
             self.assertTrue(hasattr(row, "ArtistId"))
             self.assertTrue(hasattr(row, "Name"))
     
+    def test_joinColumnsSelectables(self):
+        tbl_album = self.tables["Album"]
+        tbl_track = self.tables["Track"]
+        
+        tbl_joinAlbumTrack = InnerJoin(tbl_album, tbl_track, using=["AlbumId"])
+        
+        join_columns = tbl_joinAlbumTrack.columns._get_selectables()
+        expected = tbl_joinAlbumTrack._get_selectables()
+        self.assertEqual(len(join_columns), len(expected))
+        for column, expected_column in zip(join_columns, expected):
+            self.assertIs(column, expected_column)
+    
     def test_leftOuterJoin(self):
         tbl_track = self.tables["Track"]
         tbl_playlist_track = self.tables["PlaylistTrack"]
@@ -399,6 +414,28 @@ class BaseQueryChinookTests(object):
             self.assertTrue(hasattr(row, "TrackName"))
             self.assertEqual(row.ArtistId, row.AlbumArtistId)
     
+    def test_joinChain(self):
+        tbl_album = self.tables["Album"]
+        tbl_artist = self.tables["Artist"]
+        tbl_track = self.tables["Track"]
+        
+        tbl_joinArtistAlbumTrack = InnerJoin.chain(tbl_artist,
+            (tbl_album, [tbl_album.columns["ArtistId"] == tbl_artist.columns["ArtistId"]]),
+            (tbl_track, [tbl_track.columns["AlbumId"] == tbl_album.columns["AlbumId"]])
+        )
+        
+        q = self.db.query(
+            tbl_joinArtistAlbumTrack.tables["Artist"]["ArtistId"],
+            tbl_joinArtistAlbumTrack.tables["Album"]["ArtistId"].as_("AlbumArtistId"),
+            tbl_joinArtistAlbumTrack.tables["Track"]["Name"].as_("TrackName")
+        ).get()
+        
+        rows = q.execute()
+        self.assertGreater(len(rows), 0)
+        for row in rows:
+            self.assertTrue(hasattr(row, "TrackName"))
+            self.assertEqual(row.ArtistId, row.AlbumArtistId)
+    
     def test_setQueryParamValue(self):
         tbl_genre = self.tables["Genre"]
         tbl_track = self.tables["Track"]
@@ -445,3 +482,29 @@ class BaseQueryChinookTests(object):
             self.assertTrue(hasattr(row, "Name"))
             self.assertTrue(hasattr(row, "AlbumId"))
             self.assertEqual(row.GenreId, 2)
+    
+    def test_reflectTables(self):
+        tables = self.db.reflect()
+        
+        self.assertEqual(
+            self.tables["Album"].columns.get_names(),
+            tables["Album"].columns.get_names())
+        
+        q = self.db.query(tables["Artist"]).get()
+        for row in q.execute(limit=5):
+            self.assertTrue(hasattr(row, "ArtistId"))
+            self.assertTrue(hasattr(row, "Name"))
+    
+    def test_reflectTablesFromCache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, "schema.json")
+            self.db.reflect(cache_path=cache_path)
+            self.assertTrue(os.path.exists(cache_path))
+            
+            cached_tables = self.db.reflect(cache_path=cache_path)
+            self.assertEqual(
+                self.tables["Track"].columns.get_names(),
+                cached_tables["Track"].columns.get_names())
+            
+            with self.assertRaises(KeyError):
+                cached_tables["NotATable"]
@@ -0,0 +1,103 @@
+import sqlite3
+import unittest
+from breezeblocks import Database, Table
+from breezeblocks.bulk import ExecuteManyLoader
+from breezeblocks.sql.operators import Equal_
+
+from test_bulk_loaders import make_fake_dbapi
+
+class StatementBatchTests(unittest.TestCase):
+    """Tests running statements together with `Database.batch`."""
+    
+    table = Table("Artist", ["ArtistId", "Name"])
+    
+    def setUp(self):
+        self.db = Database(sqlite3, ":memory:", minconn=1, maxconn=1)
+        conn = self.db.pool.get()
+        cur = conn.cursor()
+        cur.execute("CREATE TABLE Artist (ArtistId INTEGER, Name TEXT)")
+        conn.commit()
+        cur.close()
+        conn.close()
+    
+    def test_batchCommitsOnExit(self):
+        t = self.table
+        with self.db.batch() as batch:
+            batch.add(self.db.insert(t, ["ArtistId", "Name"]).get(),
+                [(1, "Weezer"), (2, "Pixies")])
+            batch.add(self.db.update(t).set_(t.columns["Name"], "Weezer (Blue)")
+                .where(Equal_(t.columns["ArtistId"], 1)).get())
+            batch.add_sql("DELETE FROM Artist WHERE ArtistId = ?", [2])
+            self.assertEqual(len(batch), 3)
+        
+        rows = self.db.query(t.columns["Name"]).get().execute()
+        self.assertEqual([row.Name for row in rows], ["Weezer (Blue)"])
+    
+    def test_batchDroppedOnError(self):
+        t = self.table
+        with self.assertRaises(ValueError):
+            with self.db.batch() as batch:
+                batch.add(self.db.insert(t, ["ArtistId", "Name"]).get(),
+                    [(1, "Weezer")])
+                raise ValueError()
+        
+        self.assertEqual(len(self.db.query(t.columns["Name"]).get().execute()), 0)
+    
+    def test_batchJoinsStatements(self):
+        t = self.table
+        dbapi = make_fake_dbapi("psycopg2", "pyformat")
+        db = Database(dbapi, "fake", bulk_loader=ExecuteManyLoader())
+        
+        with db.batch() as batch:
+            batch.add(db.delete(t).where(Equal_(t.columns["ArtistId"], 1)).get())
+            batch.add(db.update(t).set_(t.columns["Name"], "Pixies").get())
+            batch.add(db.insert(t, ["ArtistId", "Name"]).get(), [(3, "Weezer")])
+            batch.add_sql("DELETE FROM Artist")
+        
+        executes = [call for call in dbapi.calls if call[0] in ("execute", "executemany")]
+        self.assertEqual([call[0] for call in executes],
+            ["execute", "executemany", "execute"])
+        
+        statement, params = executes[0][1:]
+        self.assertEqual(statement.count(";\n"), 1)
+        self.assertEqual(sorted(params.values(), key=str), [1, "Pixies"])
+        self.assertEqual(executes[2][1:], ("DELETE FROM Artist", None))
+        self.assertEqual(dbapi.calls.count(("commit",)), 1)
+
+    def test_batchRolledBackOnFailure(self):
+        batch = self.db.batch()
+        batch.add_sql("INSERT INTO Artist VALUES (?, ?)", [1, "Weezer"])
+        batch.add_sql("INSERT INTO NotATable VALUES (1)")
+        with self.assertRaises(sqlite3.OperationalError):
+            batch.execute()
+        
+        self.assertEqual(self.db.pool.in_use_count, 0)
+        self.assertEqual(len(self.db.query(self.table).get().execute()), 0)
+    
+    def test_batchKeepsUnescapedSqlApart(self):
+        t = self.table
+        dbapi = make_fake_dbapi("psycopg2", "pyformat")
+        db = Database(dbapi, "fake", bulk_loader=ExecuteManyLoader())
+        
+        with db.batch() as batch:
+            batch.add(db.delete(t).where(Equal_(t.columns["ArtistId"], 1)).get())
+            batch.add_sql("DELETE FROM Artist WHERE Name LIKE 'P%'")
+            batch.add_sql("DELETE FROM Artist WHERE Name LIKE 'W%'")
+        
+        executes = [call for call in dbapi.calls if call[0] == "execute"]
+        self.assertEqual(len(executes), 2)
+        self.assertEqual(executes[1][1:], (
+            "DELETE FROM Artist WHERE Name LIKE 'P%';\n"
+            "DELETE FROM Artist WHERE Name LIKE 'W%'", None))
+
+    def test_keyedBatchParamLimit(self):
+        t = self.table
+        dbapi = make_fake_dbapi("psycopg2", "pyformat")
+        db = Database(dbapi, "fake", param_limit=4,
+            bulk_loader=ExecuteManyLoader())
+        
+        db.delete(t).where(Equal_(t.columns["Name"], "Weezer"))\
+            .get_batched("ArtistId", chunk_size=10).execute(keys=range(7))
+        
+        executes = [call for call in dbapi.calls if call[0] == "execute"]
+        self.assertEqual([len(call[2]) for call in executes], [4, 4, 2])
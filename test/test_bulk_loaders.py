@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+from breezeblocks import Database, Table
+from breezeblocks.bulk import (
+    BulkLoader, ExecuteManyLoader, PyodbcLoader, Psycopg2Loader,
+    Psycopg2CopyLoader, get_bulk_loader)
+from breezeblocks.exceptions import InsertError, ParallelInsertError
+
+class FakeCursor(object):
+    """Cursor for a fake DBAPI module that records what is done with it."""
+    
+    def __init__(self, calls):
+        self.calls = calls
+        self.rowcount = -1
+    
+    def __setattr__(self, name, value):
+        if name not in ("calls", "rowcount"):
+            self.calls.append(("setattr", name, value))
+        object.__setattr__(self, name, value)
+    
+    def execute(self, statement, params=None):
+        self.calls.append(("execute", statement, params))
+    
+    def executemany(self, statement, param_data):
+        self.calls.append(("executemany", statement, list(param_data)))
+    
+    def copy_expert(self, statement, file):
+        self.calls.append(("copy_expert", statement, file.read()))
+    
+    def fetchall(self):
+        return []
+    
+    def close(self):
+        pass
+
+class FakeConnection(object):
+    def __init__(self, calls):
+        self.calls = calls
+    
+    def cursor(self):
+        return FakeCursor(self.calls)
+    
+    def commit(self):
+        self.calls.append(("commit",))
+    
+    def rollback(self):
+        self.calls.append(("rollback",))
+    
+    def close(self):
+        pass
+
+def make_fake_dbapi(name, paramstyle="qmark"):
+    """Creates a module-like object that can stand in for a DBAPI module."""
+    module = types.ModuleType(name)
+    module.paramstyle = paramstyle
+    module.Error = Exception
+    module.calls = []
+    module.connect = lambda *args, **kwargs: FakeConnection(module.calls)
+    return module
+
+def make_fake_extras(calls):
+    """Creates a stand-in for the `psycopg2.extras` module."""
+    extras = types.ModuleType("psycopg2.extras")
+    
+    def execute_values(cur, statement, argslist, page_size=100):
+        calls.append(("execute_values", statement, list(argslist)))
+    
+    extras.execute_values = execute_values
+    return extras
+
+class BulkLoaderTests(unittest.TestCase):
+    """Tests choosing and using bulk loaders for inserts."""
+    
+    table = Table("Artist", ["ArtistId", "Name"])
+    
+    def test_loaderChosenFromModule(self):
+        self.assertIsInstance(get_bulk_loader(sqlite3), ExecuteManyLoader)
+        self.assertIsInstance(get_bulk_loader(make_fake_dbapi("pyodbc")), PyodbcLoader)
+        self.assertIsInstance(
+            get_bulk_loader(make_fake_dbapi("unknown_module")), ExecuteManyLoader)
+    
+    def test_pyodbcFastExecuteMany(self):
+        dbapi = make_fake_dbapi("pyodbc")
+        db = Database(dbapi, "DSN=fake")
+        
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        i.execute([(1, "Weezer"), (2, "Pixies")])
+        
+        self.assertIn(("setattr", "fast_executemany", True), dbapi.calls)
+        self.assertIn(
+            ("executemany", "INSERT INTO Artist (ArtistId,Name) VALUES (?,?)",
+                [(1, "Weezer"), (2, "Pixies")]),
+            dbapi.calls)
+    
+    def test_customLoader(self):
+        class RecordingLoader(BulkLoader):
+            def __init__(self):
+                self.chunks = []
+            
+            def insert_chunk(self, insert, chunk, cur):
+                self.chunks.append(chunk)
+        
+        loader = RecordingLoader()
+        db = Database(make_fake_dbapi("unknown_module"), "fake", bulk_loader=loader)
+        
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        i.execute(((n, str(n)) for n in range(5)), chunk_size=2)
+        
+        self.assertEqual([len(chunk) for chunk in loader.chunks], [2, 2, 1])
+    
+    def test_sqliteExecuteMany(self):
+        db = Database(sqlite3, ":memory:", minconn=1, maxconn=1)
+        conn = db.pool.get()
+        cur = conn.cursor()
+        cur.execute("CREATE TABLE Artist (ArtistId INTEGER, Name TEXT)")
+        cur.close()
+        
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        row_count = i.execute([(n, str(n)) for n in range(10)], conn=conn)
+        
+        self.assertEqual(row_count, 10)
+        self.assertEqual(len(db.query(self.table).get().execute(conn=conn)), 10)
+    
+    def test_parallelInsert(self):
+        fd, db_path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        try:
+            db = Database(sqlite3, db_path, minconn=4, maxconn=4,
+                connect_kwargs={"check_same_thread": False, "timeout": 30})
+            conn = db.pool.get()
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE Artist (ArtistId INTEGER, Name TEXT)")
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+            progress = []
+            i = db.insert(self.table, ["ArtistId", "Name"]).get()
+            row_count = i.execute_parallel(
+                ((n, str(n)) for n in range(1000)), workers=8,
+                chunk_size=50, on_chunk=progress.append)
+            
+            self.assertEqual(row_count, 1000)
+            self.assertEqual(len(progress), 20)
+            self.assertEqual(progress[-1], 1000)
+            
+            rows = db.query(self.table.columns["ArtistId"]).get().execute()
+            self.assertEqual(sorted(row.ArtistId for row in rows), list(range(1000)))
+        finally:
+            os.remove(db_path)
+    
+    def test_parallelInsertErrors(self):
+        class FailingLoader(BulkLoader):
+            def insert_chunk(self, insert, chunk, cur):
+                if chunk[0][0] == 2:
+                    raise ValueError("Bad chunk")
+                cur.executemany("INSERT", chunk)
+        
+        dbapi = make_fake_dbapi("unknown_module")
+        db = Database(dbapi, "fake", bulk_loader=FailingLoader())
+        
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        with self.assertRaises(ParallelInsertError) as cm:
+            i.execute_parallel([(n, str(n)) for n in range(4)],
+                workers=2, chunk_size=2)
+        
+        self.assertEqual(cm.exception.row_count, 2)
+        self.assertEqual(len(cm.exception.errors), 1)
+        chunk_number, error = cm.exception.errors[0]
+        self.assertEqual(chunk_number, 1)
+        self.assertIsInstance(error, ValueError)
+        self.assertIn(("rollback",), dbapi.calls)
+
+    def test_parallelInsertCallbackError(self):
+        def on_chunk(row_count):
+            raise ValueError("Bad callback")
+        
+        db = Database(make_fake_dbapi("unknown_module"), "fake",
+            bulk_loader=ExecuteManyLoader())
+        
+        # The only worker stops on the first chunk, and the rest of the
+        # chunks must not wait for it forever.
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        with self.assertRaises(ParallelInsertError) as cm:
+            i.execute_parallel([(n, str(n)) for n in range(100)],
+                workers=1, chunk_size=1, on_chunk=on_chunk)
+        
+        self.assertEqual(cm.exception.errors[0][0], None)
+        self.assertIsInstance(cm.exception.errors[0][1], ValueError)
+        self.assertEqual(db.pool.in_use_count, 0)
+    
+    def test_parallelInsertFewConnections(self):
+        db = Database(make_fake_dbapi("unknown_module"), "fake",
+            minconn=1, maxconn=1, bulk_loader=ExecuteManyLoader())
+        rows = [(n, str(n)) for n in range(10)]
+        
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        self.assertEqual(i.execute_parallel(rows, workers=4, chunk_size=2), 10)
+        
+        # No worker can get a connection while this one is held.
+        conn = db.pool.get()
+        with self.assertRaises(InsertError):
+            i.execute_parallel(rows, workers=4, chunk_size=2, timeout=0.1)
+        conn.close()
+        self.assertEqual(db.pool.in_use_count, 0)
+    
+    def test_psycopg2ExecuteValues(self):
+        dbapi = make_fake_dbapi("psycopg2", "pyformat")
+        with mock.patch.dict(sys.modules,
+                {"psycopg2.extras": make_fake_extras(dbapi.calls)}):
+            db = Database(dbapi, "dbname=fake")
+        self.assertIsInstance(db._bulk_loader, Psycopg2Loader)
+        
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        i.execute([(1, "Weezer"), (2, None)])
+        
+        self.assertIn(
+            ("execute_values", "INSERT INTO Artist (ArtistId,Name) VALUES %s",
+                [(1, "Weezer"), (2, None)]),
+            dbapi.calls)
+    
+    def test_psycopg2CopyNulls(self):
+        dbapi = make_fake_dbapi("psycopg2", "pyformat")
+        db = Database(dbapi, "dbname=fake", bulk_loader=Psycopg2CopyLoader())
+        
+        i = db.insert(self.table, ["ArtistId", "Name"]).get()
+        i.execute([(1, 'Say "Hi", Weezer'), (2, None), (None, "")])
+        
+        self.assertIn(
+            ("copy_expert",
+                "COPY Artist (ArtistId,Name) FROM STDIN WITH (FORMAT csv, NULL '')",
+                '"1","Say ""Hi"", Weezer"\n"2",\n,""\n'),
+            dbapi.calls)
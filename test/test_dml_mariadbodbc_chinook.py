@@ -11,4 +11,5 @@ class MariaDBODBCTests(BaseDMLChinookTests, unittest.TestCase):
     """Tests using MariaDB through an ODBC adapter."""
     
     def setUp(self):
-        self.db = Database(dsn=CONNECTION_STRING, dbapi_module=pyodbc)
+        self.db = Database(dsn=CONNECTION_STRING, dbapi_module=pyodbc,
+            dialect="mysql")
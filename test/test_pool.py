@@ -0,0 +1,548 @@
+import gc
+import queue
+import random
+import sqlite3
+import threading
+import time
+import types
+import unittest
+import warnings
+from breezeblocks import Database, Table
+from breezeblocks.exceptions import ConnectionLeakWarning, PoolClosedError
+from breezeblocks.pool import ConnectionPool
+
+class FakeError(Exception):
+    pass
+
+class FakeCursor(object):
+    def __init__(self, dbapi, conn):
+        self._dbapi = dbapi
+        self._conn = conn
+    
+    def execute(self, statement, params=None):
+        if self._conn.broken:
+            raise FakeError()
+        with self._dbapi.lock:
+            self._dbapi.executed.append(statement)
+    
+    def fetchall(self):
+        return []
+    
+    def close(self):
+        pass
+
+class FakeConnection(object):
+    def __init__(self, dbapi):
+        self._dbapi = dbapi
+        self.broken = False
+        self.closed = False
+    
+    def cursor(self):
+        return FakeCursor(self._dbapi, self)
+    
+    def commit(self):
+        pass
+    
+    def rollback(self):
+        with self._dbapi.lock:
+            self._dbapi.rollbacks += 1
+        if self.broken:
+            raise FakeError()
+    
+    def close(self):
+        with self._dbapi.lock:
+            if not self.closed:
+                self.closed = True
+                self._dbapi.open_conns -= 1
+
+def make_counting_dbapi():
+    """Creates a fake DBAPI module that counts its open connections."""
+    dbapi = types.ModuleType("counting_dbapi")
+    dbapi.paramstyle = "qmark"
+    dbapi.Error = FakeError
+    dbapi.lock = threading.Lock()
+    dbapi.open_conns = 0
+    dbapi.max_open_conns = 0
+    dbapi.executed = []
+    dbapi.rollbacks = 0
+    
+    def connect(*args, **kwargs):
+        with dbapi.lock:
+            dbapi.open_conns += 1
+            dbapi.max_open_conns = max(dbapi.max_open_conns, dbapi.open_conns)
+        return FakeConnection(dbapi)
+    
+    dbapi.connect = connect
+    return dbapi
+
+class ConnectionPoolTests(unittest.TestCase):
+    """Tests connection accounting in the pool under contention."""
+    
+    def test_stressAccounting(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 3, 5, None)
+        errors = []
+        
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(200):
+                    try:
+                        conn = pool.get(timeout=rng.choice([None, 0.001]))
+                    except queue.Empty:
+                        continue
+                    
+                    self.assertLessEqual(pool.open_count, 5)
+                    conn.cursor().execute("UPDATE")
+                    if rng.random() < 0.1:
+                        # Dropped by the pool when the rollback fails.
+                        conn._conn.broken = True
+                    time.sleep(rng.random() * 0.0005)
+                    conn.close()
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [ threading.Thread(target=worker, args=(n,)) for n in range(16) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertLessEqual(dbapi.max_open_conns, 5)
+        self.assertEqual(pool.in_use_count, 0)
+        self.assertEqual(pool.open_count, pool.idle_count)
+        self.assertLessEqual(pool.idle_count, 3)
+        self.assertEqual(dbapi.open_conns, pool.open_count)
+    
+    def test_nonBlockingGet(self):
+        pool = ConnectionPool(make_counting_dbapi(), 1, 1, None)
+        conn = pool.get()
+        with self.assertRaises(queue.Empty):
+            pool.get(block=False)
+        with self.assertRaises(queue.Empty):
+            pool.get(timeout=0.01)
+        
+        conn.close()
+        pool.get(block=False).close()
+        self.assertEqual(pool.open_count, 1)
+    
+    def test_waitersServedInOrder(self):
+        pool = ConnectionPool(make_counting_dbapi(), 1, 1, None)
+        conn = pool.get()
+        order = []
+        
+        def waiter(n):
+            c = pool.get()
+            order.append(n)
+            c.close()
+        
+        threads = []
+        for n in range(5):
+            thread = threading.Thread(target=waiter, args=(n,))
+            thread.start()
+            threads.append(thread)
+            # Let each thread get in line before starting the next one.
+            while len(pool._waiters) < n + 1:
+                time.sleep(0.001)
+        
+        conn.close()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(order, list(range(5)))
+    
+    def test_failedConnectGivesUpPlace(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None)
+        connect = dbapi.connect
+        
+        def failing_connect(*args, **kwargs):
+            raise FakeError()
+        
+        pool._connect = failing_connect
+        with self.assertRaises(FakeError):
+            pool.get(block=False)
+        self.assertEqual(pool.open_count, 0)
+        
+        pool._connect = connect
+        pool.get(block=False).close()
+        self.assertEqual(pool.open_count, 1)
+    
+    def test_warm(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 3, 5, None)
+        pool.warm(replenish=False)
+        
+        self.assertEqual(pool.open_count, 3)
+        self.assertEqual(pool.idle_count, 3)
+        self.assertEqual(dbapi.open_conns, 3)
+        
+        pool.close()
+        self.assertEqual(pool.open_count, 0)
+        self.assertEqual(dbapi.open_conns, 0)
+    
+    def test_replenishDroppedConnections(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 3, 5, None)
+        pool.warm()
+        
+        conns = [ pool.get() for _ in range(3) ]
+        for conn in conns:
+            conn.cursor().execute("UPDATE")
+            conn._conn.broken = True
+            conn.close()
+        
+        deadline = time.monotonic() + 5
+        while pool.idle_count < 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        
+        self.assertEqual(pool.idle_count, 3)
+        self.assertEqual(dbapi.open_conns, 3)
+        pool.close()
+    
+    def test_onConnectOncePerConnection(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, "SETUP", on_checkout="RESET")
+        
+        for _ in range(3):
+            pool.get().close()
+        
+        self.assertEqual(dbapi.executed, ["SETUP", "RESET", "RESET", "RESET"])
+
+    def test_rollbackOnlyWhenNeeded(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None)
+        
+        pool.get().close()
+        self.assertEqual(dbapi.rollbacks, 0)
+        
+        conn = pool.get()
+        conn.cursor().execute("UPDATE")
+        conn.commit()
+        conn.close()
+        self.assertEqual(dbapi.rollbacks, 0)
+        
+        conn = pool.get()
+        conn.cursor().execute("UPDATE")
+        conn.close()
+        self.assertEqual(dbapi.rollbacks, 1)
+    
+    def test_rollbackAfterKeptExecute(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None)
+        
+        conn = pool.get()
+        run = conn.cursor().execute
+        run("UPDATE")
+        conn.commit()
+        run("UPDATE")
+        conn.close()
+        self.assertEqual(dbapi.rollbacks, 1)
+    
+    def test_autocommitCheckout(self):
+        pool = ConnectionPool(sqlite3, 1, 1, None, ":memory:")
+        
+        conn = pool.get(autocommit=True)
+        self.assertTrue(conn.autocommit)
+        self.assertIsNone(conn._conn.isolation_level)
+        conn.cursor().execute("SELECT 1")
+        self.assertFalse(conn._in_transaction)
+        conn.close()
+        
+        conn = pool.get()
+        self.assertFalse(conn.autocommit)
+        self.assertEqual(conn._conn.isolation_level, "")
+        conn.close()
+
+    def test_expiredConnectionsNotHandedOut(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None,
+            max_lifetime=0.05, lifetime_jitter=0)
+        
+        conn = pool.get()
+        first = conn._conn
+        conn.close()
+        time.sleep(0.06)
+        
+        conn = pool.get()
+        self.assertIsNot(conn._conn, first)
+        self.assertTrue(first.closed)
+        conn.close()
+        pool.close()
+    
+    def test_pingOnlyAfterIdle(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None, ping_after=0.05)
+        
+        conn = pool.get()
+        first = conn._conn
+        conn.close()
+        pool.get().close()
+        self.assertEqual(dbapi.executed, [])
+        
+        time.sleep(0.06)
+        pool.get().close()
+        self.assertEqual(dbapi.executed, ["SELECT 1"])
+        
+        first.broken = True
+        time.sleep(0.06)
+        conn = pool.get()
+        self.assertIsNot(conn._conn, first)
+        self.assertTrue(first.closed)
+        conn.close()
+    
+    def test_reaperClosesIdleConnections(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 3, None, max_idle=0.05)
+        conns = [ pool.get() for _ in range(3) ]
+        for conn in conns:
+            conn.close()
+        # Connections beyond the pool size wait for the reaper.
+        self.assertEqual(pool.idle_count, 3)
+        
+        deadline = time.monotonic() + 5
+        while dbapi.open_conns > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        # One idle connection is kept, however long it sits.
+        time.sleep(0.1)
+        self.assertEqual(dbapi.open_conns, 1)
+        self.assertEqual(pool.open_count, 1)
+        pool.close()
+    
+    def test_reaperClosesExpiredConnections(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 2, 2, None, max_lifetime=0.05)
+        conns = [ pool.get() for _ in range(2) ]
+        for conn in conns:
+            conn.close()
+        
+        deadline = time.monotonic() + 5
+        while dbapi.open_conns > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        self.assertEqual(dbapi.open_conns, 0)
+        self.assertEqual(pool.open_count, 0)
+        pool.close()
+
+    def test_statsAndListeners(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 2, None)
+        events = []
+        pool.add_listener(lambda event, seconds: events.append(event))
+        
+        first = pool.get()
+        second = pool.get()
+        stats = pool.stats()
+        self.assertEqual(stats["open"], 2)
+        self.assertEqual(stats["in_use"], 2)
+        self.assertEqual(stats["created"], 2)
+        
+        first.close()
+        second.close()
+        stats = pool.stats()
+        self.assertEqual(stats["idle"], 1)
+        self.assertEqual(stats["dropped"], 1)
+        self.assertEqual(stats["wait_time"]["count"], 2)
+        self.assertEqual(stats["hold_time"]["count"], 2)
+        self.assertEqual(sum(n for _, n in stats["hold_time"]["buckets"]), 2)
+        self.assertEqual(events, ["connect", "checkout", "connect", "checkout",
+            "checkin", "checkin", "drop"])
+
+    def test_leakWarning(self):
+        pool = ConnectionPool(make_counting_dbapi(), 1, 1, None,
+            leak_threshold=0.05)
+        
+        def leak():
+            return pool.get()
+        
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            conn = leak()
+            deadline = time.monotonic() + 5
+            while len(caught) < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            conn.close()
+        
+        self.assertEqual(len(caught), 1)
+        self.assertIs(caught[0].category, ConnectionLeakWarning)
+        report = pool.leak_report()
+        self.assertEqual(len(report), 1)
+        self.assertIn("leak", report[0][0])
+        self.assertEqual(report[0][1], 1)
+        pool.close()
+    
+    def test_leakReclaim(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None,
+            leak_threshold=0.05, leak_action="reclaim")
+        
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            conn = pool.get()
+            # Blocks until the leaked connection's place is freed.
+            other = pool.get(timeout=5)
+        
+        self.assertTrue(conn._conn.closed)
+        conn.close()
+        other.close()
+        self.assertEqual(pool.open_count, 1)
+        self.assertEqual(dbapi.open_conns, 1)
+        pool.close()
+    
+    def test_leakOnDelete(self):
+        pool = ConnectionPool(make_counting_dbapi(), 1, 1, None,
+            leak_threshold=60)
+        
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            pool.get()
+            gc.collect()
+        
+        self.assertEqual(len(caught), 1)
+        self.assertIn("never closed", str(caught[0].message))
+        self.assertEqual(pool.idle_count, 1)
+        pool.close()
+
+    def test_deleteWhileLocked(self):
+        pool = ConnectionPool(make_counting_dbapi(), 1, 1, None,
+            leak_threshold=60)
+        
+        def delete_while_locked():
+            conn = pool.get()
+            # Only the cycle collector can delete the connection now.
+            conn.cycle = conn
+            del conn
+            with pool._lock:
+                gc.collect()
+        
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            thread = threading.Thread(target=delete_while_locked, daemon=True)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            
+            # The next checkout puts the queued connection back first.
+            pool.get(timeout=5).close()
+        
+        self.assertEqual(len(caught), 1)
+        self.assertIn("never closed", str(caught[0].message))
+        self.assertEqual(pool.open_count, 1)
+        self.assertEqual(pool.idle_count, 1)
+        pool.close()
+    
+    def test_pinnedConnection(self):
+        db = Database(sqlite3, ":memory:", minconn=1, maxconn=2)
+        table = Table("Artist", ["ArtistId", "Name"])
+        
+        with db.pinned() as conn:
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE Artist (ArtistId INTEGER, Name TEXT)")
+            cur.close()
+            
+            db.insert(table, ["ArtistId", "Name"]).get().execute([(1, "Weezer")])
+            with db.pinned():
+                rows = db.query(table).get().execute()
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(db.pool.in_use_count, 1)
+        
+        stats = db.pool.stats()
+        self.assertEqual(stats["wait_time"]["count"], 1)
+        self.assertEqual(stats["in_use"], 0)
+        
+        # The table was created on the pinned connection, which is back
+        # in the pool and is the only one.
+        self.assertEqual(len(db.query(table).get().execute()), 1)
+
+    def test_checkoutOrder(self):
+        for order, expected in (("fifo", 0), ("lifo", 2)):
+            pool = ConnectionPool(make_counting_dbapi(), 3, 3, None,
+                checkout_order=order)
+            conns = [ pool.get() for _ in range(3) ]
+            raw_conns = [ conn._conn for conn in conns ]
+            for conn in conns:
+                conn.close()
+            
+            conn = pool.get()
+            self.assertIs(conn._conn, raw_conns[expected])
+            conn.close()
+    
+    def test_lifoLetsSurplusGoIdle(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 3, None,
+            max_idle=0.1, checkout_order="lifo")
+        conns = [ pool.get() for _ in range(3) ]
+        for conn in conns:
+            conn.close()
+        
+        # One connection at a time keeps being reused, while the other two
+        # sit idle until they are closed.
+        deadline = time.monotonic() + 5
+        while dbapi.open_conns > 1 and time.monotonic() < deadline:
+            pool.get().close()
+            time.sleep(0.01)
+        
+        self.assertEqual(dbapi.open_conns, 1)
+        pool.close()
+
+    def test_autocommitMethod(self):
+        dbapi = make_counting_dbapi()
+        modes = []
+        
+        def connect(*args, **kwargs):
+            conn = FakeConnection(dbapi)
+            # Like pymysql and MySQLdb, which switch modes with a method.
+            conn.autocommit = modes.append
+            conn.get_autocommit = lambda: False
+            return conn
+        
+        dbapi.connect = connect
+        pool = ConnectionPool(dbapi, 1, 1, None)
+        
+        conn = pool.get(autocommit=True)
+        self.assertTrue(conn.autocommit)
+        conn.cursor().execute("SELECT 1")
+        conn.close()
+        pool.get().close()
+        
+        self.assertEqual(modes, [True, False])
+        self.assertEqual(dbapi.rollbacks, 0)
+    
+    def test_autocommitUnsupported(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None)
+        
+        conn = pool.get(autocommit=True)
+        self.assertFalse(conn.autocommit)
+        conn.cursor().execute("SELECT 1")
+        conn.close()
+        self.assertEqual(dbapi.rollbacks, 1)
+
+    def test_closedPool(self):
+        dbapi = make_counting_dbapi()
+        pool = ConnectionPool(dbapi, 1, 1, None, max_idle=60)
+        conn = pool.get()
+        
+        waiter_errors = []
+        def wait_for_conn():
+            try:
+                pool.get(timeout=5)
+            except Exception as e:
+                waiter_errors.append(e)
+        
+        thread = threading.Thread(target=wait_for_conn)
+        thread.start()
+        time.sleep(0.05)
+        pool.close()
+        thread.join(5)
+        self.assertEqual([ type(e) for e in waiter_errors ], [PoolClosedError])
+        
+        # Connections put back after closing are closed, not kept.
+        conn.close()
+        self.assertEqual(dbapi.open_conns, 0)
+        self.assertEqual(pool.open_count, 0)
+        
+        with self.assertRaises(PoolClosedError):
+            pool.get()
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import tempfile
+import types
+import unittest
+from breezeblocks import Database
+from breezeblocks.reflection import _get_information_schema_sql
+
+class ReflectionTests(unittest.TestCase):
+    """Tests reflecting tables and caching them."""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "db.sqlite")
+        self.cache_path = os.path.join(self.temp_dir.name, "schema.json")
+        self.db = Database(sqlite3, self.db_path, minconn=1, maxconn=2)
+        self.run_sql("CREATE TABLE Event (EventId INTEGER PRIMARY KEY)")
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def run_sql(self, statement):
+        conn = self.db.connect()
+        cur = conn.cursor()
+        cur.execute(statement)
+        conn.commit()
+        cur.close()
+        conn.close()
+    
+    def get_event_columns(self, **kwargs):
+        tables = self.db.reflect(cache_path=self.cache_path, **kwargs)
+        return tables["Event"].columns.get_names()
+    
+    def test_cacheMaxAge(self):
+        self.get_event_columns()
+        self.run_sql("ALTER TABLE Event ADD COLUMN Name TEXT")
+        
+        self.assertEqual(self.get_event_columns(), ("EventId",))
+        self.assertEqual(self.get_event_columns(max_age=0), ("EventId", "Name"))
+        # The refreshed cache is used again.
+        self.assertEqual(self.get_event_columns(), ("EventId", "Name"))
+    
+    def test_refresh(self):
+        tables = self.db.reflect(cache_path=self.cache_path)
+        self.run_sql("ALTER TABLE Event ADD COLUMN Name TEXT")
+        
+        tables.refresh()
+        self.assertEqual(tables["Event"].columns.get_names(), ("EventId", "Name"))
+    
+    def test_currentSchemaByDefault(self):
+        for dialect, condition in [
+                ("postgres", "table_schema = current_schema()"),
+                ("mysql", "table_schema = DATABASE()")]:
+            db = types.SimpleNamespace(
+                _dbapi=types.SimpleNamespace(paramstyle="format"),
+                _dialect=dialect)
+            statement, params = _get_information_schema_sql(db, None)
+            self.assertIn(condition, statement)
+            self.assertEqual(len(params.get_dbapi_params()), 0)
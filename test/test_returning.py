@@ -0,0 +1,39 @@
+import unittest
+from breezeblocks import Database, Table
+from breezeblocks.bulk import ExecuteManyLoader
+from breezeblocks.exceptions import DeleteError, InsertError
+from breezeblocks.sql.dml import supports_returning
+
+from test_bulk_loaders import make_fake_dbapi
+
+class ReturningSupportTests(unittest.TestCase):
+    """Tests which MySQL-dialect servers are sent RETURNING clauses."""
+    
+    table = Table("Artist", ["ArtistId", "Name"])
+    
+    def get_db(self, server_version):
+        db = Database(make_fake_dbapi("pymysql", "format"), "fake",
+            bulk_loader=ExecuteManyLoader())
+        db._server_version = server_version
+        return db
+    
+    def test_mysqlHasNoReturning(self):
+        db = self.get_db("8.0.34")
+        for statement_type in ("INSERT", "UPDATE", "DELETE"):
+            self.assertFalse(supports_returning(db, statement_type))
+        
+        with self.assertRaises(InsertError):
+            db.insert(self.table, ["Name"]).returning("ArtistId")
+        with self.assertRaises(DeleteError):
+            db.delete(self.table).returning("ArtistId")
+    
+    def test_mariadbReturning(self):
+        for server_version, expected in (
+                ("10.4.31-MariaDB", False),
+                ("10.5.22-MariaDB-1:10.5.22+maria~ubu2004", True),
+                ("5.5.5-10.11.2-MariaDB", True),
+                ("11.1.2-MariaDB-log", True)):
+            db = self.get_db(server_version)
+            self.assertEqual(supports_returning(db, "INSERT"), expected)
+            self.assertEqual(supports_returning(db, "DELETE"), expected)
+            self.assertFalse(supports_returning(db, "UPDATE"))
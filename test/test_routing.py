@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from breezeblocks import Table
+from breezeblocks.exceptions import PoolClosedError
+from breezeblocks.routing import RoutedDatabase
+
+class RoutedDatabaseTests(unittest.TestCase):
+    """Tests routing statements between a primary and read replicas."""
+    
+    table = Table("Source", ["Name"])
+    
+    def setUp(self):
+        self.paths = []
+        for name in ("primary", "replica1", "replica2"):
+            fd, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+            self.paths.append(path)
+            
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE Source (Name TEXT)")
+            conn.execute("INSERT INTO Source VALUES (?)", (name,))
+            conn.commit()
+            conn.close()
+    
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+    
+    def get_db(self, **kwargs):
+        return RoutedDatabase(sqlite3, self.paths[0], self.paths[1:],
+            minconn=1, maxconn=2, **kwargs)
+    
+    def read_names(self, db):
+        return [ row.Name for row in db.query(self.table).get().execute() ]
+    
+    def test_roundRobinReads(self):
+        db = self.get_db()
+        names = [ self.read_names(db) for _ in range(4) ]
+        self.assertEqual(names,
+            [["replica1"], ["replica2"], ["replica1"], ["replica2"]])
+    
+    def test_leastLoadedReads(self):
+        db = self.get_db(strategy="least_loaded")
+        conn = db.replica_pools[0].get()
+        names = [ self.read_names(db) for _ in range(2) ]
+        conn.close()
+        self.assertEqual(names, [["replica2"], ["replica2"]])
+    
+    def test_writesGoToPrimary(self):
+        db = self.get_db()
+        db.insert(self.table, ["Name"]).get().execute([("written",)])
+        
+        conn = db.connect()
+        cur = conn.cursor()
+        cur.execute("SELECT Name FROM Source ORDER BY Name")
+        self.assertEqual(cur.fetchall(), [("primary",), ("written",)])
+        cur.close()
+        conn.close()
+        
+        self.assertEqual(self.read_names(db), ["replica1"])
+    
+    def test_stickyAfterWrite(self):
+        db = self.get_db(sticky_seconds=0.05)
+        db.insert(self.table, ["Name"]).get().execute([("written",)])
+        self.assertEqual(self.read_names(db), ["primary", "written"])
+        
+        time.sleep(0.06)
+        self.assertEqual(self.read_names(db), ["replica1"])
+
+    def test_stickyAfterWriteInOtherThread(self):
+        db = self.get_db(sticky_seconds=0.05,
+            connect_kwargs={"check_same_thread": False})
+        insert = db.insert(self.table, ["Name"]).get()
+        thread = threading.Thread(target=insert.execute, args=([("written",)],))
+        thread.start()
+        thread.join()
+        
+        self.assertEqual(self.read_names(db), ["primary", "written"])
+    
+    def test_stickyFromCommit(self):
+        db = self.get_db(sticky_seconds=0.05)
+        conn = db.connect()
+        time.sleep(0.06)
+        cur = conn.cursor()
+        cur.execute("INSERT INTO Source VALUES ('written')")
+        cur.close()
+        conn.commit()
+        
+        self.assertEqual(self.read_names(db), ["primary", "written"])
+        conn.close()
+        
+        time.sleep(0.06)
+        self.assertEqual(self.read_names(db), ["replica1"])
+    
+    def test_pinnedOnPrimary(self):
+        db = self.get_db()
+        with db.pinned():
+            self.assertEqual(self.read_names(db), ["primary"])
+        self.assertEqual(self.read_names(db), ["replica1"])
+
+    def test_close(self):
+        with self.get_db() as db:
+            self.assertEqual(self.read_names(db), ["replica1"])
+        
+        for pool in [db.pool] + db.replica_pools:
+            with self.assertRaises(PoolClosedError):
+                pool.get()
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from breezeblocks import Database, Table
+from breezeblocks.exceptions import QueryError
+from breezeblocks.sql.aggregates import Sum_
+from breezeblocks.sql.join import InnerJoin
+from breezeblocks.sharding import ShardedDatabase
+
+class ShardedDatabaseTests(unittest.TestCase):
+    """Tests routing and merging queries across shards."""
+    
+    table = Table("Invoice", ["TenantId", "Total"])
+    
+    def setUp(self):
+        self.paths = []
+        shards = []
+        for _ in range(3):
+            fd, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+            self.paths.append(path)
+            
+            db = Database(sqlite3, path, minconn=1, maxconn=1,
+                connect_kwargs={"check_same_thread": False})
+            conn = db.pool.get()
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE Invoice (TenantId INTEGER, Total INTEGER)")
+            conn.commit()
+            cur.close()
+            conn.close()
+            shards.append(db)
+        
+        self.db = ShardedDatabase(shards, "TenantId", lambda tenant: tenant % 3)
+        for tenant in range(6):
+            rows = [ (tenant, tenant * 10 + n) for n in range(3) ]
+            self.db.shard(tenant).insert(self.table, ["TenantId", "Total"])\
+                .get().execute(rows)
+    
+    def tearDown(self):
+        self.db.close()
+        for path in self.paths:
+            os.remove(path)
+    
+    def checkout_counts(self):
+        return [ db.pool.stats()["wait_time"]["count"] for db in self.db.shards ]
+    
+    def test_singleShardQuery(self):
+        before = self.checkout_counts()
+        q = self.db.query(self.table.columns["Total"])\
+            .where(self.table.columns["TenantId"] == 4).get()
+        rows = q.execute()
+        after = self.checkout_counts()
+        
+        self.assertEqual(sorted(row.Total for row in rows), [40, 41, 42])
+        self.assertEqual([ a - b for a, b in zip(after, before) ], [0, 1, 0])
+    
+    def test_singleShardOrderedByUnselected(self):
+        tenant = self.table.columns["TenantId"]
+        total = self.table.columns["Total"]
+        q = self.db.query(tenant).where(tenant == 4)\
+            .order_by(total, ascending=False).get()
+        self.assertEqual([ row.TenantId for row in q.execute() ], [4, 4, 4])
+        
+        q = self.db.query(tenant).order_by(total).get()
+        with self.assertRaises(QueryError):
+            q.execute()
+    
+    def test_mergeOrderedResults(self):
+        total = self.table.columns["Total"]
+        q = self.db.query(self.table).order_by(total, ascending=False).get()
+        
+        rows = q.execute()
+        self.assertEqual([ row.Total for row in rows ],
+            sorted((t * 10 + n for t in range(6) for n in range(3)), reverse=True))
+        
+        rows = q.execute(limit=4, offset=2)
+        self.assertEqual([ row.Total for row in rows ], [50, 42, 41, 40])
+    
+    def test_mergeMixedOrderings(self):
+        tenant = self.table.columns["TenantId"]
+        total = self.table.columns["Total"]
+        q = self.db.query(tenant, total)\
+            .where(total > 30)\
+            .order_by(tenant).order_by(total, ascending=False).get()
+        
+        self.assertEqual([ tuple(row) for row in q.execute() ],
+            [(3, 32), (3, 31), (4, 42), (4, 41), (4, 40),
+                (5, 52), (5, 51), (5, 50)])
+
+    def test_unmergeableQueries(self):
+        tenant = self.table.columns["TenantId"]
+        total = self.table.columns["Total"]
+        
+        queries = [
+            self.db.query(Sum_(total)).get(),
+            self.db.query(tenant, Sum_(total).as_("Sum")).group_by(tenant).get(),
+            self.db.query(tenant).distinct().get()
+        ]
+        for q in queries:
+            with self.assertRaises(QueryError):
+                q.execute()
+        
+        q = self.db.query(Sum_(total).as_("Sum")).where(tenant == 4).get()
+        self.assertEqual(q.execute()[0].Sum, 123)
+    
+    def test_shardKeyOfTable(self):
+        note = Table("Note", ["TenantId", "Text"])
+        for tenant in range(6):
+            db = self.db.shard(tenant)
+            conn = db.connect()
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS Note (TenantId INTEGER, Text TEXT)")
+            cur.execute("INSERT INTO Note VALUES (?, 'Note')", (tenant,))
+            conn.commit()
+            cur.close()
+            conn.close()
+        
+        sharded_db = ShardedDatabase(self.db.shards, (self.table, "TenantId"),
+            lambda tenant: tenant % 3)
+        join = InnerJoin(self.table, note, using=["TenantId"])
+        
+        before = self.checkout_counts()
+        q = sharded_db.query(join.left["Total"])\
+            .where(join.left["TenantId"] == 4).get()
+        self.assertEqual(sorted(row.Total for row in q.execute()), [40, 41, 42])
+        after = self.checkout_counts()
+        self.assertEqual([ a - b for a, b in zip(after, before) ], [0, 1, 0])
+        
+        # Only the invoice's column is the shard key, so this runs on all
+        # shards, and still finds the rows.
+        q = sharded_db.query(join.left["Total"])\
+            .where(join.right["TenantId"] == 4).get()
+        self.assertEqual(sorted(row.Total for row in q.execute()), [40, 41, 42])
+        self.assertEqual([ a - b for a, b in zip(self.checkout_counts(), after) ],
+            [1, 1, 1])
+        sharded_db.close()
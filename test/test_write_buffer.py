@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+from breezeblocks import Database, Table
+from breezeblocks.exceptions import InsertError
+
+class WriteBufferTests(unittest.TestCase):
+    """Tests writing rows in the background with `Database.write_buffer`."""
+    
+    table = Table("Event", ["EventId", "Name"])
+    
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.db = Database(sqlite3, self.db_path, minconn=2, maxconn=4,
+            connect_kwargs={"check_same_thread": False}, dialect="sqlite")
+        
+        conn = self.db.pool.get()
+        cur = conn.cursor()
+        cur.execute("CREATE TABLE Event (EventId INTEGER PRIMARY KEY, Name TEXT)")
+        conn.commit()
+        cur.close()
+        conn.close()
+    
+    def tearDown(self):
+        os.remove(self.db_path)
+    
+    def get_rows(self):
+        q = self.db.query(self.table).order_by(self.table.columns["EventId"]).get()
+        return [tuple(row) for row in q.execute()]
+    
+    def test_flushFromManyThreads(self):
+        buffer = self.db.write_buffer(self.table, ["EventId", "Name"],
+            flush_rows=50, flush_interval=60)
+        
+        def add_events(start):
+            for n in range(start, start + 100):
+                buffer.add((n, "Event"))
+        
+        threads = [ threading.Thread(target=add_events, args=(start,))
+            for start in range(0, 400, 100) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        buffer.flush()
+        self.assertEqual(buffer.depth, 0)
+        self.assertEqual(len(self.get_rows()), 400)
+        
+        stats = buffer.stats()
+        self.assertEqual(stats["rows_added"], 400)
+        self.assertEqual(stats["rows_written"], 400)
+        buffer.close()
+    
+    def test_flushOnInterval(self):
+        with self.db.write_buffer(self.table, ["EventId", "Name"],
+                flush_interval=0.05) as buffer:
+            buffer.add({"Name": "Late", "EventId": 1})
+            
+            deadline = time.monotonic() + 5
+            while buffer.stats()["rows_written"] < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            
+            self.assertEqual(self.get_rows(), [(1, "Late")])
+    
+    def test_coalesceByKey(self):
+        buffer = self.db.write_buffer(self.table, ["EventId", "Name"],
+            flush_interval=60, key="EventId")
+        buffer.add_rows([(1, "First"), (2, "Second"), (1, "Third")])
+        self.assertEqual(buffer.depth, 2)
+        buffer.close()
+        
+        self.assertEqual(self.get_rows(), [(1, "Third"), (2, "Second")])
+        
+        with self.db.write_buffer(self.table, ["EventId", "Name"],
+                flush_interval=60, key="EventId") as buffer:
+            buffer.add((2, "Fourth"))
+        
+        self.assertEqual(self.get_rows(), [(1, "Third"), (2, "Fourth")])
+
+    def test_survivesLeakThreshold(self):
+        db = Database(sqlite3, self.db_path, minconn=2, maxconn=4,
+            connect_kwargs={"check_same_thread": False}, dialect="sqlite",
+            leak_threshold=0.05, leak_action="reclaim")
+        
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with db.write_buffer(self.table, ["EventId", "Name"],
+                    flush_interval=60) as buffer:
+                time.sleep(0.15)
+                buffer.add((1, "Held"))
+        
+        self.assertEqual(caught, [])
+        self.assertEqual(self.get_rows(), [(1, "Held")])
+
+    def test_reconnectAfterFailedFlush(self):
+        with self.db.write_buffer(self.table, ["EventId", "Name"],
+                flush_interval=60) as buffer:
+            buffer.add((1, "Retried"))
+            # Break the buffer's connection under it.
+            buffer._conn._conn.close()
+            with self.assertRaises(sqlite3.ProgrammingError):
+                buffer.flush()
+            self.assertEqual(buffer.depth, 1)
+            
+            self.assertEqual(buffer.flush(), 1)
+        
+        self.assertEqual(self.get_rows(), [(1, "Retried")])
+        self.assertEqual(self.db.pool.in_use_count, 0)
+    
+    def test_maxDepth(self):
+        buffer = self.db.write_buffer(self.table, ["EventId", "Name"],
+            flush_interval=60, max_depth=2, on_full="raise")
+        with buffer._flush_lock:
+            # No flush can take rows out of the buffer meanwhile.
+            buffer.add_rows([(1, "First"), (2, "Second")])
+            with self.assertRaises(InsertError):
+                buffer.add((3, "Third"))
+            self.assertEqual(buffer.depth, 2)
+        buffer.close()
+        
+        with self.db.write_buffer(self.table, ["EventId", "Name"],
+                flush_interval=60, max_depth=2) as buffer:
+            # Each add waits for a flush to make room.
+            for n in range(3, 10):
+                buffer.add((n, "Later"))
+                self.assertLessEqual(buffer.depth, 2)
+        
+        self.assertEqual(len(self.get_rows()), 9)